@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+
+"""measure the time needed to decode the args of events
+
+Decodes synthetic Transfer logs with eth_abi one by one and with the batch
+decoder used when inserting events and reports the time per 100k events.
+"""
+
+import argparse
+import time
+
+from bench_events import make_logs, make_topic_index
+
+from ethindex import logdecode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    topic_index = make_topic_index()
+    logs = make_logs(topic_index, args.count)
+
+    def per_100k(seconds):
+        return "{:.2f} s".format(seconds / args.count * 100000)
+
+    events = topic_index.decode_logs(logs)
+    start = time.perf_counter()
+    for event in events:
+        event._decoder.decode_generic(event._data, event._topics)
+    generic_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    logdecode.decode_events(events)
+    batch_time = time.perf_counter() - start
+
+    print(f"{args.count} events")
+    print("eth_abi:      ", per_100k(generic_time), "per 100k")
+    print("batch decoder:", per_100k(batch_time), "per 100k")
+
+
+if __name__ == "__main__":
+    main()
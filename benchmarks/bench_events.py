@@ -0,0 +1,94 @@
+#! /usr/bin/env python3
+
+"""measure the memory used by decoded events
+
+Builds synthetic Transfer logs, like web3 returns them from eth_getLogs, decodes
+them with a TopicIndex and reports the memory held by the events per 100k
+events, before and after their args have been decoded.
+"""
+
+import argparse
+import gc
+import json
+import os
+import tracemalloc
+
+import eth_abi
+import eth_utils
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+from ethindex import logdecode
+
+CONTRACTS_JSON = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "build", "contracts.json"
+)
+
+
+def make_topic_index():
+    with open(CONTRACTS_JSON) as f:
+        abi = json.load(f)["MergedCurrencyNetworksAbi"]["abi"]
+    address = eth_utils.to_checksum_address("0x" + "11" * 20)
+    return logdecode.TopicIndex({address: abi})
+
+
+def make_logs(topic_index, count):
+    address = topic_index.addresses[0]
+    (decoder,) = topic_index.address2decoders[address].values()
+    logs = []
+    for i in range(count):
+        logs.append(
+            AttributeDict(
+                {
+                    "address": address,
+                    "blockNumber": i // 10,
+                    "blockHash": HexBytes((i // 10).to_bytes(32, "big")),
+                    "transactionHash": HexBytes(i.to_bytes(32, "big")),
+                    "transactionIndex": i % 10,
+                    "logIndex": i % 10,
+                    "data": HexBytes(eth_abi.encode_single("uint256", i)),
+                    "topics": [
+                        decoder.topic,
+                        HexBytes(eth_abi.encode_single("address", address)),
+                        HexBytes(eth_abi.encode_single("uint256", i)),
+                    ],
+                    "removed": False,
+                }
+            )
+        )
+    return logs
+
+
+def traced_memory():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    topic_index = make_topic_index()
+    tracemalloc.start()
+    baseline = traced_memory()
+    logs = make_logs(topic_index, args.count)
+    logs_memory = traced_memory() - baseline
+    events = topic_index.decode_logs(logs)
+    del logs
+    undecoded_memory = traced_memory() - baseline
+    for event in events:
+        event.args
+    decoded_memory = traced_memory() - baseline
+
+    def per_100k(memory):
+        return "{:.1f} MB".format(memory / args.count * 100000 / 1e6)
+
+    print(f"{args.count} events")
+    print("raw logs:                 ", per_100k(logs_memory), "per 100k")
+    print("events, args not decoded: ", per_100k(undecoded_memory), "per 100k")
+    print("events, args decoded:     ", per_100k(decoded_memory), "per 100k")
+
+
+if __name__ == "__main__":
+    main()
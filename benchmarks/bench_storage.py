@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+
+"""compare the postgres and the SQLite storage on the same workload
+
+Writes synthetic Transfer events in rounds like a sync job, one transaction
+per round, writes the same rounds again like a sync job resyncing unconfirmed
+blocks and reads the events back page by page. Reports the time per 100k
+events for every backend. Postgres is started in a temporary data directory
+with testing.postgresql, like the tests do.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import testing.postgresql
+from bench_events import make_logs, make_topic_index
+
+from ethindex import logdecode, pgimport
+
+PAGE_SIZE = 1000
+
+
+def write_rounds(conn, events, blocks_per_round):
+    """write the events in rounds of blocks_per_round blocks"""
+    storage = pgimport.get_storage(conn)
+    addresses = sorted({event.address for event in events})
+    last_block = events[-1].blocknumber
+    index = 0
+    for from_block in range(0, last_block + 1, blocks_per_round):
+        to_block = from_block + blocks_per_round - 1
+        start = index
+        while index < len(events) and events[index].blocknumber <= to_block:
+            index += 1
+        pgimport.delete_events(conn, from_block, addresses, to_block)
+        storage.insert_events(conn, events[start:index])
+        with conn.cursor() as cur:
+            cur.execute(
+                """UPDATE sync SET last_block_number=%s, last_confirmed_block_number=%s
+                   WHERE syncid=%s""",
+                (to_block, to_block, "default"),
+            )
+        conn.commit()
+
+
+def read_pages(conn, address):
+    """read the events of address in pages ordered by block number"""
+    count = 0
+    last = (-1, -1)
+    with conn.cursor() as cur:
+        while True:
+            cur.execute(
+                """SELECT * FROM events
+                   WHERE address=%s AND (blockNumber>%s
+                                         OR (blockNumber=%s AND logIndex>%s))
+                   ORDER BY blockNumber, logIndex LIMIT %s""",
+                (address, last[0], last[0], last[1], PAGE_SIZE),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                conn.commit()
+                return count
+            count += len(rows)
+            last = (rows[-1]["blocknumber"], rows[-1]["logindex"])
+
+
+def run(conn, events, blocks_per_round):
+    storage = pgimport.get_storage(conn)
+    storage.create_tables(conn)
+    with conn:
+        pgimport.insert_sync_entry(
+            conn, "default", sorted({event.address for event in events})
+        )
+    timings = {}
+    start = time.perf_counter()
+    write_rounds(conn, events, blocks_per_round)
+    timings["write"] = time.perf_counter() - start
+    start = time.perf_counter()
+    write_rounds(conn, events, blocks_per_round)
+    timings["rewrite"] = time.perf_counter() - start
+    start = time.perf_counter()
+    assert read_pages(conn, events[0].address) == len(events)
+    timings["read"] = time.perf_counter() - start
+    conn.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument(
+        "--blocks-per-round",
+        type=int,
+        default=1000,
+        help="the synthetic events fill 10 per block",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["postgres", "sqlite"],
+        action="append",
+        help="can be given multiple times, defaults to both",
+    )
+    args = parser.parse_args()
+
+    topic_index = make_topic_index()
+    events = topic_index.decode_logs(make_logs(topic_index, args.count))
+    for event in events:
+        event.timestamp = event.blocknumber
+    # don't let the first backend pay for decoding the args
+    logdecode.decode_events(events)
+
+    def per_100k(seconds):
+        return "{:.2f} s".format(seconds / args.count * 100000)
+
+    print(f"{args.count} events")
+    for backend in args.backend or ["postgres", "sqlite"]:
+        if backend == "postgres":
+            with testing.postgresql.Postgresql() as postgresql:
+                conn = pgimport.connect(postgresql.url())
+                timings = run(conn, events, args.blocks_per_round)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                conn = pgimport.connect_storage(
+                    os.path.join(directory, "ethindex.sqlite")
+                )
+                timings = run(conn, events, args.blocks_per_round)
+        for step, seconds in timings.items():
+            print(f"{backend + ' ' + step + ':':18}", per_100k(seconds), "per 100k")
+
+
+if __name__ == "__main__":
+    main()
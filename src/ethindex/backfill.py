@@ -0,0 +1,340 @@
+"""backfill a block range with parallel worker processes
+
+The block range is split into sub-ranges. Every sub-range is synced by a
+worker with its own row in the sync table, which stops at the end of its
+sub-range. The worker rows are named '<syncid>/backfill/<i>'. When all workers
+are done, the graph feed is built from the imported events and the worker rows
+are replaced by a normal sync row for syncid, which `ethindex runsync` can
+continue from.
+
+Since the workers only sync confirmed blocks and store their progress in the
+sync table, an interrupted backfill can be resumed by running the same command
+again.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+from typing import List, Tuple
+
+import click
+
+from ethindex import density, pgimport, rpc, util
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_SYNCID_INFIX = "/backfill/"
+DEFAULT_WORKERS = 4
+GRAPH_EVENT_NAMES = (
+    pgimport.BALANCE_UPDATE_EVENT_NAME,
+    pgimport.TRUSTLINE_UPDATE_EVENT_NAME,
+    pgimport.NETWORK_FREEZE_EVENT_NAME,
+    pgimport.NETWORK_UNFREEZE_EVENT_NAME,
+)
+
+
+def worker_syncid(syncid, i):
+    return f"{syncid}{BACKFILL_SYNCID_INFIX}{i}"
+
+
+def is_worker_syncid(syncid, candidate):
+    prefix, infix, index = candidate.rpartition(BACKFILL_SYNCID_INFIX)
+    return prefix == syncid and infix != "" and index.isdigit()
+
+
+def split_range(start_block, end_block, parts) -> List[Tuple[int, int]]:
+    """split the block range [start_block, end_block] into at most parts
+    consecutive sub-ranges of about the same size"""
+    num_blocks = end_block - start_block + 1
+    parts = max(1, min(parts, num_blocks))
+    ranges = []
+    first = start_block
+    for i in range(parts):
+        last = start_block + (num_blocks * (i + 1)) // parts - 1
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def plan_ranges(cur, start_block, end_block, workers) -> List[Tuple[int, int]]:
+    """split the block range for the workers
+
+    If there are event density statistics, the sub-ranges are sized so every
+    worker has about the same work to do, otherwise they have the same size.
+    """
+    event_density = density.load_event_density(cur)
+    if event_density.is_empty():
+        return split_range(start_block, end_block, workers)
+    return event_density.split_range(
+        start_block,
+        end_block,
+        workers,
+        pgimport.Synchronizer.events_per_round,
+        pgimport.Synchronizer.blocks_per_round,
+    )
+
+
+def find_worker_syncids(cur, syncid) -> List[str]:
+    cur.execute("""SELECT syncid FROM sync""")
+    return sorted(
+        row["syncid"]
+        for row in cur.fetchall()
+        if is_worker_syncid(syncid, row["syncid"])
+    )
+
+
+def plan_backfill(
+    conn, syncid, start_block, end_block, workers=DEFAULT_WORKERS, event_names=None
+) -> List[str]:
+    """create the sync rows of the backfill workers and return their syncids
+
+    If the worker rows of an interrupted backfill for syncid exist, these are
+    returned unchanged, so the backfill is resumed.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("""SELECT syncid FROM sync WHERE syncid=%s""", (syncid,))
+            if cur.fetchall():
+                raise RuntimeError(
+                    f"sync job {syncid} already exists, cannot backfill it"
+                )
+            worker_syncids = find_worker_syncids(cur, syncid)
+            if worker_syncids:
+                logger.info(
+                    "resuming backfill of %s with %s workers",
+                    syncid,
+                    len(worker_syncids),
+                )
+                return worker_syncids
+
+            if end_block < start_block:
+                raise ValueError(
+                    f"cannot backfill empty block range {start_block} -> {end_block}"
+                )
+            addresses = pgimport.find_unsynced_addresses(cur)
+            for i, (first, last) in enumerate(
+                plan_ranges(cur, start_block, end_block, workers)
+            ):
+                logger.info("worker %s syncs blocks %s -> %s", i, first, last)
+                pgimport.insert_sync_entry(
+                    conn,
+                    worker_syncid(syncid, i),
+                    addresses,
+                    start_block=first - 1,
+                    event_names=event_names,
+                    end_block=last,
+                )
+                worker_syncids.append(worker_syncid(syncid, i))
+            return worker_syncids
+
+
+def sync_worker(conn, web3, syncid, required_confirmations=10, **kwargs):
+    """sync the block range of the backfill worker with the given syncid"""
+    synchronizer = pgimport.Synchronizer(
+        conn,
+        web3,
+        syncid,
+        required_confirmations=required_confirmations,
+        feed_graph=False,
+        **kwargs,
+    )
+    synchronizer.sync_until_current()
+
+
+def run_worker(
+    syncid,
+    jsonrpc,
+    required_confirmations,
+    addresses_per_shard,
+    requests_per_second=None,
+    burst=None,
+):
+    """entry point of the backfill worker processes"""
+    logging.basicConfig(level=logging.INFO)
+    conn = pgimport.connect("")
+    try:
+        sync_worker(
+            conn,
+            rpc.make_web3(
+                jsonrpc, requests_per_second=requests_per_second, burst=burst
+            ),
+            syncid,
+            required_confirmations=required_confirmations,
+            addresses_per_shard=addresses_per_shard,
+        )
+    finally:
+        conn.close()
+
+
+def run_workers(
+    worker_syncids,
+    jsonrpc,
+    required_confirmations,
+    addresses_per_shard=None,
+    requests_per_second=None,
+    burst=None,
+):
+    """run every backfill worker in its own process
+
+    If requests_per_second is given, every worker may send that many requests
+    per second to every endpoint."""
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=len(worker_syncids),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = [
+            executor.submit(
+                run_worker,
+                syncid,
+                jsonrpc,
+                required_confirmations,
+                addresses_per_shard,
+                requests_per_second,
+                burst,
+            )
+            for syncid in worker_syncids
+        ]
+        for future in futures:
+            future.result()
+
+
+def feed_graph_from_events(conn, addresses, end_block):
+    """insert the graph updates for the events up to end_block into the graph
+    feed, in the order a sequential sync would have inserted them"""
+    with conn.cursor(name="backfill_graph_events") as events_cur:
+        events_cur.itersize = 10000
+        events_cur.execute(
+            """SELECT * FROM events
+               WHERE address IN %s AND eventName IN %s AND blockNumber<=%s
+               ORDER BY blockNumber, logIndex""",
+            (tuple(addresses), GRAPH_EVENT_NAMES, end_block),
+        )
+        with conn.cursor() as cur:
+            pgimport.insert_graph_feed_updates(
+                cur, (pgimport.build_event_from_row(row) for row in events_cur)
+            )
+
+
+def finish_backfill(conn, syncid):
+    """hand off from the backfill workers to a normal sync row for syncid"""
+    with conn:
+        with conn.cursor() as cur:
+            worker_syncids = find_worker_syncids(cur, syncid)
+            if not worker_syncids:
+                raise RuntimeError(f"no backfill workers found for {syncid}")
+            cur.execute(
+                """SELECT * FROM sync WHERE syncid IN %s FOR UPDATE""",
+                (tuple(worker_syncids),),
+            )
+            rows = cur.fetchall()
+            unfinished = [
+                row["syncid"]
+                for row in rows
+                if row["last_confirmed_block_number"] < row["end_block"]
+            ]
+            if unfinished:
+                raise RuntimeError(
+                    f"backfill workers {unfinished} did not finish, please resume"
+                )
+            addresses = rows[0]["addresses"]
+            end_block = max(row["end_block"] for row in rows)
+
+            feed_graph_from_events(conn, addresses, end_block)
+            pgimport.insert_sync_entry(
+                conn,
+                syncid,
+                addresses,
+                start_block=end_block,
+                event_names=rows[0]["event_names"],
+            )
+            cur.execute(
+                """DELETE FROM sync WHERE syncid IN %s""", (tuple(worker_syncids),)
+            )
+    logger.info("backfill of %s finished at block %s", syncid, end_block)
+
+
+@click.command()
+@click.option(
+    "--jsonrpc",
+    help="jsonrpc URL to use, can be given multiple times to spread the requests "
+    "over multiple endpoints",
+    default=["http://127.0.0.1:8545"],
+    multiple=True,
+)
+@click.option(
+    "--required-confirmations",
+    help="number of confirmations until we consider a block final",
+    default=10,
+)
+@click.option("--syncid", help="syncid of the sync job to create", default="default")
+@click.option("--startblock", help="first block to backfill", default=0)
+@click.option(
+    "--endblock",
+    help="last block to backfill, defaults to the latest confirmed block",
+    type=int,
+    default=None,
+)
+@click.option("--workers", help="number of worker processes", default=DEFAULT_WORKERS)
+@click.option(
+    "--event-name",
+    "event_names",
+    help="only import events with this name, can be given multiple times",
+    multiple=True,
+)
+@click.option(
+    "--addresses-per-request",
+    help="split the addresses into shards of this size, fetching the logs of "
+    "each shard with a separate eth_getLogs request",
+    type=int,
+    default=None,
+)
+@click.option(
+    "--rpc-rate",
+    help="maximum number of requests per second every worker sends to every "
+    "jsonrpc URL",
+    type=float,
+    default=None,
+)
+@click.option(
+    "--rpc-burst",
+    help="number of requests, which may be sent at once before --rpc-rate applies, "
+    "defaults to the rate",
+    type=float,
+    default=None,
+)
+def backfill(
+    jsonrpc,
+    required_confirmations,
+    syncid,
+    startblock,
+    endblock,
+    workers,
+    event_names,
+    addresses_per_request,
+    rpc_rate,
+    rpc_burst,
+):
+    """sync a block range with parallel workers, then hand off to runsync"""
+    logging.basicConfig(level=logging.INFO)
+    logger.info("version %s starting", util.get_version())
+
+    jsonrpc = list(jsonrpc)
+    if endblock is None:
+        endblock = rpc.make_web3(jsonrpc).eth.blockNumber - required_confirmations
+    conn = pgimport.connect("")
+    worker_syncids = plan_backfill(
+        conn,
+        syncid,
+        startblock,
+        endblock,
+        workers=workers,
+        event_names=list(event_names) or None,
+    )
+    run_workers(
+        worker_syncids,
+        jsonrpc,
+        required_confirmations,
+        addresses_per_shard=addresses_per_request,
+        requests_per_second=rpc_rate,
+        burst=rpc_burst,
+    )
+    finish_backfill(conn, syncid)
@@ -1,7 +1,14 @@
 import click
 
+import ethindex.backfill
+import ethindex.compaction
 import ethindex.pgimport
+import ethindex.query
+import ethindex.reproject
+import ethindex.server
+import ethindex.snapshot
 import ethindex.util
+import ethindex.verify
 
 
 def report_version():
@@ -23,3 +30,10 @@ cli.add_command(ethindex.pgimport.importabi)
 cli.add_command(ethindex.pgimport.runsync)
 cli.add_command(ethindex.pgimport.createtables)
 cli.add_command(ethindex.pgimport.droptables)
+cli.add_command(ethindex.backfill.backfill)
+cli.add_command(ethindex.query.query)
+cli.add_command(ethindex.server.serve)
+cli.add_command(ethindex.compaction.compactgraphfeed)
+cli.add_command(ethindex.snapshot.snapshot)
+cli.add_command(ethindex.reproject.reproject)
+cli.add_command(ethindex.verify.verify)
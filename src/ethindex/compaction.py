@@ -0,0 +1,155 @@
+"""compact the graph feed
+
+Consumers of the graph feed apply the rows in the order of their ids, only the
+latest update for a trustline, a balance or the frozen status of a network
+matters for the resulting graph. Compaction deletes all other rows up to a
+watermark id and archives them in a gzipped json lines file, so the table and
+the time needed by a new consumer to read it stay bounded.
+
+The default watermark is the id before the first row caused by a block, which
+is not confirmed by all sync jobs yet.
+"""
+import gzip
+import json
+import logging
+import os
+import time
+
+import click
+
+from ethindex import pgimport, util
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100000
+
+# the key of the state a graph feed row updates, rows of unknown events are
+# never compacted
+GRAPHFEED_KEY = """
+    CASE eventName
+      WHEN 'TrustlineUpdate' THEN
+        'trustline:' || LEAST(args->>'_creditor', args->>'_debtor')
+        || ':' || GREATEST(args->>'_creditor', args->>'_debtor')
+      WHEN 'BalanceUpdate' THEN
+        'balance:' || LEAST(args->>'_from', args->>'_to')
+        || ':' || GREATEST(args->>'_from', args->>'_to')
+      WHEN 'NetworkFreeze' THEN 'frozen'
+      WHEN 'NetworkUnfreeze' THEN 'frozen'
+      ELSE 'id:' || id
+    END
+"""
+
+
+def safe_watermark(cur):
+    """return the highest graph feed id, up to which all rows are caused by
+    confirmed blocks
+
+    Rows of older versions without block number are considered confirmed.
+    """
+    cur.execute("SELECT min(last_confirmed_block_number) AS n FROM sync")
+    confirmed_block_number = cur.fetchone()["n"]
+    if confirmed_block_number is None:
+        return 0
+    cur.execute(
+        "SELECT min(id) AS id FROM graphfeed WHERE blockNumber>%s",
+        (confirmed_block_number,),
+    )
+    first_unconfirmed_id = cur.fetchone()["id"]
+    if first_unconfirmed_id is not None:
+        return first_unconfirmed_id - 1
+    cur.execute("SELECT max(id) AS id FROM graphfeed")
+    return cur.fetchone()["id"] or 0
+
+
+def compact_graphfeed(
+    conn, archive_dir, watermark=None, batch_size=DEFAULT_BATCH_SIZE
+) -> int:
+    """compact the graph feed up to watermark, return the number of rows removed
+
+    The removed rows are written to a file in archive_dir. watermark is capped
+    at the safe watermark.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            safe = safe_watermark(cur)
+            if watermark is None or watermark > safe:
+                watermark = safe
+            logger.info("compacting graph feed up to id %s", watermark)
+            cur.execute(
+                f"""CREATE TEMPORARY TABLE graphfeed_keep ON COMMIT DROP AS
+                    SELECT max(id) AS id FROM graphfeed WHERE id<=%s
+                    GROUP BY address, {GRAPHFEED_KEY}""",
+                (watermark,),
+            )
+            cur.execute("CREATE INDEX ON graphfeed_keep (id)")
+            cur.execute(
+                "SELECT min(id) AS id FROM graphfeed WHERE id<=%s", (watermark,)
+            )
+            first_id = cur.fetchone()["id"]
+            if first_id is None:
+                return 0
+
+            path = os.path.join(
+                archive_dir,
+                "graphfeed-{}-{}-{}.jsonl.gz".format(
+                    first_id, watermark, int(time.time())
+                ),
+            )
+            removed = archive_removed_rows(cur, path, first_id, watermark, batch_size)
+            if removed:
+                logger.info("archived %s graph feed rows in %s", removed, path)
+    return removed
+
+
+def archive_removed_rows(cur, path, first_id, watermark, batch_size):
+    """delete the rows not in graphfeed_keep batch by batch and write them to
+    the archive at path
+
+    The archive is removed again if there are no such rows or if we fail.
+    """
+    removed = 0
+    archive = gzip.open(path, "xt")
+    try:
+        for start in range(first_id, watermark + 1, batch_size):
+            cur.execute(
+                """DELETE FROM graphfeed
+                   WHERE id>=%s AND id<=%s
+                         AND id NOT IN (SELECT id FROM graphfeed_keep)
+                   RETURNING *""",
+                (start, min(start + batch_size - 1, watermark)),
+            )
+            rows = sorted(cur.fetchall(), key=lambda row: row["id"])
+            for row in rows:
+                archive.write(json.dumps(row) + "\n")
+            removed += len(rows)
+        archive.close()
+    except Exception:
+        archive.close()
+        os.remove(path)
+        raise
+    if removed == 0:
+        os.remove(path)
+    return removed
+
+
+@click.command()
+@click.option(
+    "--archive-dir",
+    help="directory to write the archive of the removed rows to",
+    default=".",
+    show_default=True,
+    type=click.Path(exists=True, file_okay=False, writable=True),
+)
+@click.option(
+    "--watermark",
+    help="only compact rows up to this id, defaults to the last id caused by "
+    "confirmed blocks",
+    type=int,
+    default=None,
+)
+def compactgraphfeed(archive_dir, watermark):
+    """remove graph feed rows superseded by later updates"""
+    logging.basicConfig(level=logging.INFO)
+    logger.info("version %s starting", util.get_version())
+    removed = compact_graphfeed(pgimport.connect(""), archive_dir, watermark=watermark)
+    logger.info("removed %s graph feed rows", removed)
@@ -0,0 +1,235 @@
+"""statistics of the event density of block ranges
+
+The number of events per block varies a lot over the history of a network.
+Every sync job records the number of confirmed blocks it synced, the number of
+events and the number of blocks with events per bucket of BUCKET_BLOCKS blocks
+in the event_density table. These statistics are used to size the block ranges
+of sync rounds and backfill workers and to forecast when a sync job catches up
+with the chain.
+
+The cost of a block range is measured in rounds. A round should contain about
+target_events events, but at most max_blocks blocks, so the cost of a range is
+
+    events / target_events + blocks / max_blocks
+
+Events are assumed to be spread evenly over the blocks of a bucket. A bucket no
+sync job has synced yet is assumed to be as dense as the closest bucket before
+it, or the first synced bucket if there is none before it. If multiple sync
+jobs synced a bucket, the densest one is used.
+"""
+import bisect
+import collections
+import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ethindex import logdecode
+
+BUCKET_BLOCKS = 10000
+# weight of the latest measurement in the forecast's average duration of a round
+FORECAST_SMOOTHING = 0.3
+
+
+class BucketStats(NamedTuple):
+    blocks: int
+    events: int
+    event_blocks: int
+
+
+def bucket_range(bucket) -> Tuple[int, int]:
+    first = bucket * BUCKET_BLOCKS
+    return first, first + BUCKET_BLOCKS - 1
+
+
+def count_events(
+    events: Iterable[logdecode.Event], from_block, to_block
+) -> Dict[int, BucketStats]:
+    """count the blocks, events and blocks with events per bucket of the range"""
+    events_per_bucket: Dict[int, int] = collections.Counter()
+    event_blocks = set()
+    for event in events:
+        if from_block <= event.blocknumber <= to_block:
+            events_per_bucket[event.blocknumber // BUCKET_BLOCKS] += 1
+            event_blocks.add(event.blocknumber)
+    event_blocks_per_bucket = collections.Counter(
+        block_number // BUCKET_BLOCKS for block_number in event_blocks
+    )
+    stats = {}
+    for bucket in range(from_block // BUCKET_BLOCKS, to_block // BUCKET_BLOCKS + 1):
+        first, last = bucket_range(bucket)
+        stats[bucket] = BucketStats(
+            min(last, to_block) - max(first, from_block) + 1,
+            events_per_bucket[bucket],
+            event_blocks_per_bucket[bucket],
+        )
+    return stats
+
+
+class EventDensity:
+    """the recorded statistics of all sync jobs"""
+
+    def __init__(self, rows: Iterable[Tuple[str, int, BucketStats]] = ()):
+        self.stats: Dict[Tuple[str, int], BucketStats] = {}
+        for syncid, bucket, stats in rows:
+            self.stats[(syncid, bucket)] = stats
+        self._densest: Optional[Dict[int, BucketStats]] = None
+        self._buckets: List[int] = []
+
+    def is_empty(self) -> bool:
+        return not self.stats
+
+    def add(self, syncid, stats: Dict[int, BucketStats]):
+        """add the statistics of newly synced blocks of syncid"""
+        for bucket, new in stats.items():
+            old = self.stats.get((syncid, bucket), BucketStats(0, 0, 0))
+            self.stats[(syncid, bucket)] = BucketStats(
+                old.blocks + new.blocks,
+                old.events + new.events,
+                old.event_blocks + new.event_blocks,
+            )
+        self._densest = None
+
+    def bucket_stats(self, bucket) -> Optional[BucketStats]:
+        """return the statistics of the bucket or of the closest synced bucket,
+        None if no bucket has been synced"""
+        if self._densest is None:
+            self._densest = {}
+            for (syncid, b), stats in self.stats.items():
+                if stats.blocks == 0:
+                    continue
+                densest = self._densest.get(b)
+                if densest is None or (
+                    stats.events * densest.blocks > densest.events * stats.blocks
+                ):
+                    self._densest[b] = stats
+            self._buckets = sorted(self._densest)
+        if not self._buckets:
+            return None
+        index = bisect.bisect_right(self._buckets, bucket) - 1
+        return self._densest[self._buckets[max(index, 0)]]
+
+    def events_per_block(self, bucket) -> float:
+        stats = self.bucket_stats(bucket)
+        return stats.events / stats.blocks if stats is not None else 0.0
+
+    def estimate(self, from_block, to_block) -> Tuple[float, float]:
+        """estimate the number of events and of blocks with events in the range"""
+        events = 0.0
+        event_blocks = 0.0
+        for first, last in self._bucket_parts(from_block, to_block):
+            stats = self.bucket_stats(first // BUCKET_BLOCKS)
+            if stats is not None:
+                events += (last - first + 1) * stats.events / stats.blocks
+                event_blocks += (last - first + 1) * stats.event_blocks / stats.blocks
+        return events, event_blocks
+
+    def cost(self, from_block, to_block, target_events, max_blocks) -> float:
+        """the cost of the range in rounds"""
+        events, _ = self.estimate(from_block, to_block)
+        return events / target_events + (to_block - from_block + 1) / max_blocks
+
+    def end_of_cost(self, from_block, cost, target_events, max_blocks, limit) -> int:
+        """return the last block of the range starting at from_block, which
+        costs about cost, but at least one block and at most up to limit"""
+        for first, last in self._bucket_parts(from_block, limit):
+            block_cost = (
+                self.events_per_block(first // BUCKET_BLOCKS) / target_events
+                + 1 / max_blocks
+            )
+            blocks = last - first + 1
+            # allow for rounding errors, a round of max_blocks empty blocks
+            # must cost exactly 1
+            if blocks * block_cost > cost + 1e-9:
+                return max(first + int(cost / block_cost + 1e-6) - 1, from_block)
+            cost -= blocks * block_cost
+        return limit
+
+    def plan_round(self, from_block, target_events, max_blocks) -> int:
+        """return the last block of the next round starting at from_block"""
+        return self.end_of_cost(
+            from_block, 1.0, target_events, max_blocks, from_block + max_blocks - 1
+        )
+
+    def split_range(
+        self, start_block, end_block, parts, target_events, max_blocks
+    ) -> List[Tuple[int, int]]:
+        """split the block range into at most parts consecutive sub-ranges of
+        about the same cost"""
+        parts = max(1, min(parts, end_block - start_block + 1))
+        part_cost = self.cost(start_block, end_block, target_events, max_blocks) / parts
+        ranges = []
+        first = start_block
+        for _ in range(parts - 1):
+            if first > end_block:
+                break
+            last = self.end_of_cost(
+                first, part_cost, target_events, max_blocks, end_block
+            )
+            ranges.append((first, last))
+            first = last + 1
+        if first <= end_block:
+            ranges.append((first, end_block))
+        return ranges
+
+    @staticmethod
+    def _bucket_parts(from_block, to_block):
+        """split the range at bucket boundaries"""
+        first = from_block
+        while first <= to_block:
+            last = min(to_block, bucket_range(first // BUCKET_BLOCKS)[1])
+            yield first, last
+            first = last + 1
+
+
+def load_event_density(cur) -> EventDensity:
+    cur.execute(
+        "SELECT syncid, bucket, blocks, events, event_blocks FROM event_density"
+    )
+    return EventDensity(
+        (
+            row["syncid"],
+            row["bucket"],
+            BucketStats(row["blocks"], row["events"], row["event_blocks"]),
+        )
+        for row in cur.fetchall()
+    )
+
+
+def record_event_density(cur, syncid, stats: Dict[int, BucketStats]):
+    for bucket, bucket_stats in sorted(stats.items()):
+        cur.execute(
+            """INSERT INTO event_density (syncid, bucket, blocks, events, event_blocks)
+               VALUES (%s, %s, %s, %s, %s)
+               ON CONFLICT (syncid, bucket) DO UPDATE
+               SET blocks=event_density.blocks + EXCLUDED.blocks,
+                   events=event_density.events + EXCLUDED.events,
+                   event_blocks=event_density.event_blocks + EXCLUDED.event_blocks""",
+            (syncid, bucket, *bucket_stats),
+        )
+
+
+def delete_event_density(cur, syncid):
+    cur.execute("DELETE FROM event_density WHERE syncid=%s", (syncid,))
+
+
+class Forecast:
+    """forecasts the time needed to sync the remaining cost from the measured
+    duration of rounds"""
+
+    def __init__(self):
+        self.seconds_per_cost: Optional[float] = None
+
+    def record(self, cost, seconds):
+        if cost <= 0:
+            return
+        measured = seconds / cost
+        if self.seconds_per_cost is None:
+            self.seconds_per_cost = measured
+        else:
+            self.seconds_per_cost += FORECAST_SMOOTHING * (
+                measured - self.seconds_per_cost
+            )
+
+    def eta(self, remaining_cost) -> Optional[datetime.timedelta]:
+        if self.seconds_per_cost is None:
+            return None
+        return datetime.timedelta(seconds=round(remaining_cost * self.seconds_per_cost))
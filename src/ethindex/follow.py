@@ -0,0 +1,194 @@
+"""helpers for following the head of the chain
+
+When a sync job has caught up with the chain, new blocks are usually just
+appended to the chain we already know about. In that case we don't need to
+delete and reinsert the whole unconfirmed part of the chain, but only have to
+import the events of the new blocks. UnconfirmedWindow keeps the unconfirmed
+block headers in memory, so we can check that new blocks extend our chain.
+
+Most new blocks contain no event of our contracts. Every block header carries
+a bloom filter of the addresses and topics of its logs, LogsBloomFilter checks
+it, so we can skip eth_getLogs for blocks, which definitely contain nothing we
+are interested in.
+"""
+import collections
+import logging
+import time
+from typing import Deque, Iterable, NamedTuple
+
+import eth_utils
+
+from ethindex import logdecode
+
+logger = logging.getLogger(__name__)
+
+STATS_LOG_INTERVAL = 300.0
+# number of latency measurements kept for the statistics
+LATENCY_SAMPLES = 1000
+BLOOM_SIZE = 256
+
+
+class BlockHeader(NamedTuple):
+    number: int
+    hash: str
+    parent_hash: str
+
+
+class UnconfirmedWindow:
+    """the headers of the blocks we synced, which are not confirmed yet"""
+
+    def __init__(self, head_number, head_hash):
+        self.headers: Deque[BlockHeader] = collections.deque(
+            [BlockHeader(head_number, head_hash, "")]
+        )
+
+    @property
+    def head(self) -> BlockHeader:
+        return self.headers[-1]
+
+    def extends_head(self, headers) -> bool:
+        """check that the given consecutive headers extend the head of the window"""
+        previous = self.head
+        for header in headers:
+            if header.number != previous.number + 1:
+                return False
+            if header.parent_hash != previous.hash:
+                return False
+            previous = header
+        return True
+
+    def append(self, headers):
+        self.headers.extend(headers)
+
+    def prune(self, last_confirmed_block_number):
+        """forget about confirmed blocks, but always keep the head"""
+        while (
+            len(self.headers) > 1
+            and self.headers[0].number <= last_confirmed_block_number
+        ):
+            self.headers.popleft()
+
+
+class LatencyStats:
+    """measures the time from seeing a new block until its events are committed"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.samples: Deque[float] = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.blocks = 0
+        self._last_log_time = clock()
+
+    def record(self, latency, num_blocks=1):
+        self.samples.append(latency)
+        self.blocks += num_blocks
+        now = self.clock()
+        if now - self._last_log_time > STATS_LOG_INTERVAL:
+            self._last_log_time = now
+            self.log()
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def log(self):
+        if not self.samples:
+            return
+        logger.info(
+            "followed %s blocks, block to commit latency: median %.0f ms, "
+            "p99 %.0f ms, max %.0f ms",
+            self.blocks,
+            self.percentile(0.5) * 1000,
+            self.percentile(0.99) * 1000,
+            max(self.samples) * 1000,
+        )
+
+
+def bloom_bits(value: bytes):
+    """return the (byte index, mask) pairs of the three bits set for value in a
+    logs bloom"""
+    h = eth_utils.keccak(value)
+    bits = []
+    for i in (0, 2, 4):
+        bit = ((h[i] << 8) | h[i + 1]) & 2047
+        bits.append((BLOOM_SIZE - 1 - bit // 8, 1 << (bit % 8)))
+    return tuple(bits)
+
+
+def bloom_to_bytes(bloom) -> bytes:
+    if isinstance(bloom, int):
+        return bloom.to_bytes(BLOOM_SIZE, "big")
+    return logdecode.to_bytes(bloom)
+
+
+class LogsBloomFilter:
+    """checks the logs bloom of a block header for logs we may be interested in
+
+    These are the logs of one of the addresses with one of the topics as first
+    topic. The bloom does not tell us, whether the address and the topic belong
+    to the same log, so there are false positives, but no false negatives.
+    """
+
+    def __init__(self, addresses: Iterable[str], topics: Iterable[str]):
+        self.address_bits = [
+            bloom_bits(logdecode.to_bytes(address)) for address in addresses
+        ]
+        self.topic_bits = [bloom_bits(logdecode.to_bytes(topic)) for topic in topics]
+
+    @staticmethod
+    def _contains(bloom: bytes, bits) -> bool:
+        return all(bloom[index] & mask for index, mask in bits)
+
+    def may_contain(self, bloom) -> bool:
+        """check if a block with the given logs bloom may contain relevant logs
+
+        A block without logs bloom may always contain them."""
+        if bloom is None:
+            return True
+        bloom = bloom_to_bytes(bloom)
+        return any(self._contains(bloom, bits) for bits in self.address_bits) and any(
+            self._contains(bloom, bits) for bits in self.topic_bits
+        )
+
+
+class BloomStats:
+    """counts the blocks for which we skipped eth_getLogs thanks to the bloom"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.blocks = 0
+        self.skipped_blocks = 0
+        self.requests = 0
+        self.skipped_requests = 0
+        self._last_log_time = clock()
+
+    def record(self, num_blocks, num_skipped_blocks):
+        self.blocks += num_blocks
+        self.skipped_blocks += num_skipped_blocks
+        self.requests += 1
+        if num_skipped_blocks == num_blocks:
+            self.skipped_requests += 1
+        now = self.clock()
+        if now - self._last_log_time > STATS_LOG_INTERVAL:
+            self._last_log_time = now
+            self.log()
+
+    @property
+    def skip_rate(self):
+        if not self.blocks:
+            return None
+        return self.skipped_blocks / self.blocks
+
+    def log(self):
+        if not self.blocks:
+            return
+        logger.info(
+            "logs bloom: skipped eth_getLogs for %s of %s blocks (%.1f%%), "
+            "%s of %s rounds without request",
+            self.skipped_blocks,
+            self.blocks,
+            self.skip_rate * 100,
+            self.skipped_requests,
+            self.requests,
+        )
@@ -6,9 +6,13 @@ See https://codeburst.io/deep-dive-into-ethereum-logs-a8d2047c7371 for a nice
 explanation.
 """
 
+import functools
+import hashlib
 import itertools
+import json
 import logging
-from typing import Any, Dict, List, Optional
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
 import attr
 import eth_abi
@@ -18,11 +22,16 @@ import hexbytes
 logger = logging.getLogger(__name__)
 
 
+# computing a checksum address needs a keccak hash. The same addresses show up
+# in many events, so we cache them. This also lets events share the strings.
+to_checksum_address = functools.lru_cache(maxsize=4096)(eth_utils.to_checksum_address)
+
+
 def replace_with_checksum_address(values: List[Any], types: List[str]) -> List[Any]:
     """returns a new list of values with addresses replaced with their checksum
     address"""
     return [
-        eth_utils.to_checksum_address(value) if _type == "address" else value
+        to_checksum_address(value) if _type == "address" else value
         for (value, _type) in zip(values, types)
     ]
 
@@ -52,85 +61,134 @@ def build_address_to_abi_dict(
     return res
 
 
-def decode_non_indexed_inputs(abi, log):
-    """decode non-indexed inputs from a log entry
-
-    This one decodes the values stored in the 'data' field."""
-    inputs = [input_ for input_ in abi["inputs"] if not input_["indexed"]]
-    types = [input_["type"] for input_ in inputs]
-    names = [input_["name"] for input_ in inputs]
-    data = hexbytes.HexBytes(log["data"])
-    values = eth_abi.decode_abi(types, data)
-    return zip(names, replace_with_checksum_address(values, types))
-
-
-def decode_indexed_inputs(abi, log):
-    """decode indexed inputs from a log entry
+def abi_hash(abi) -> str:
+    """return the content hash of an ABI
 
-    This one decodes the values stored in topics fields (without topic 0)"""
-    inputs = [input_ for input_ in abi["inputs"] if input_["indexed"]]
-    types = [input_["type"] for input_ in inputs]
-    names = [input_["name"] for input_ in inputs]
-    values = [
-        eth_abi.decode_single(type_, value)
-        for type_, value in zip(types, log["topics"][1:])
-    ]
-    return zip(names, replace_with_checksum_address(values, types))
+    The hash is computed over a canonical json encoding, i.e. two ABIs with the
+    same content have the same hash regardless of key order."""
+    canonical = json.dumps(abi, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
 
 
 def get_event_abis(abi):
     return [some_abi for some_abi in abi if some_abi["type"] == "event"]
 
 
-@attr.s(cmp=False)
-class Event:
-    name = attr.ib(type=str)
-    args = attr.ib(type=Dict)
-    log = attr.ib(type=Dict)
-    timestamp = attr.ib(type=Optional[int])
+def to_bytes(value) -> bytes:
+    """convert a hex string or bytes-like value to bytes"""
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    return bytes(value)
 
-    @property
-    def blocknumber(self):
-        return self.log["blockNumber"]
-
-    @property
-    def blockhash(self):
-        return self.log["blockHash"]
 
-    @property
-    def transactionhash(self):
-        return self.log["transactionHash"]
+class Event:
+    """a decoded log entry
 
-    @property
-    def address(self):
-        return self.log["address"]
+    The fields of the log are stored flat, hashes as bytes. The args are only
+    decoded, when they are accessed for the first time. The raw data and topics
+    of the log are released afterwards.
+    """
 
-    @property
-    def transactionindex(self):
-        return self.log["transactionIndex"]
+    __slots__ = (
+        "name",
+        "address",
+        "blocknumber",
+        "blockhash",
+        "transactionhash",
+        "transactionindex",
+        "logindex",
+        "timestamp",
+        "_args",
+        "_decoder",
+        "_data",
+        "_topics",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        args: Optional[Dict],
+        address: str,
+        blocknumber: int,
+        blockhash: bytes,
+        transactionhash: bytes,
+        transactionindex: int,
+        logindex: int,
+        timestamp: Optional[int] = None,
+    ):
+        self.name = name
+        self.address = address
+        self.blocknumber = blocknumber
+        self.blockhash = blockhash
+        self.transactionhash = transactionhash
+        self.transactionindex = transactionindex
+        self.logindex = logindex
+        self.timestamp = timestamp
+        self._args = args
+        self._decoder = None
+        self._data = None
+        self._topics = None
+
+    @classmethod
+    def from_log(cls, decoder: "EventDecoder", log) -> "Event":
+        """build an event from a log, its args are decoded lazily with decoder"""
+        event = cls(
+            name=decoder.name,
+            args=None,
+            address=log["address"],
+            blocknumber=log["blockNumber"],
+            blockhash=to_bytes(log["blockHash"]),
+            transactionhash=to_bytes(log["transactionHash"]),
+            transactionindex=log["transactionIndex"],
+            logindex=log["logIndex"],
+        )
+        event._decoder = decoder
+        event._data = log["data"]
+        event._topics = log["topics"]
+        return event
 
     @property
-    def logindex(self):
-        return self.log["logIndex"]
+    def args(self) -> Dict:
+        if self._args is None:
+            self._args = self._decoder.decode(self._data, self._topics)
+            self._decoder = self._data = self._topics = None
+        return self._args
+
+    @args.setter
+    def args(self, args: Dict) -> None:
+        self._args = args
+        self._decoder = self._data = self._topics = None
+
+    def _compared_fields(self):
+        # When comparing events (e.g. figuring out new or missing events due to reorg)
+        # we don't compare the raw log, which isn't stored in the database.
+        return (
+            self.name,
+            self.address,
+            self.blocknumber,
+            self.blockhash,
+            self.transactionhash,
+            self.transactionindex,
+            self.logindex,
+            self.timestamp,
+            self.args,
+        )
 
     def __eq__(self, other):
         if type(other) != type(self):
             return False
-        # When comparing events (e.g. figuring out new or missing events due to reorg)
-        # We don't compare the exact log, but match other attributes.
-        # This is useful for events reconstructed from the database where the full log is not stored.
-        compared_attributes = set(
-            attribute for attribute in dir(self) if not attribute.startswith("_")
-        )
-        compared_attributes.remove("log")
-        for attribute in compared_attributes:
-            if self.__getattribute__(attribute) != other.__getattribute__(attribute):
-                return False
-        return True
+        return self._compared_fields() == other._compared_fields()
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __repr__(self):
+        return (
+            f"Event(name={self.name!r}, address={self.address!r}, "
+            f"blocknumber={self.blocknumber}, logindex={self.logindex}, "
+            f"args={self.args!r}, timestamp={self.timestamp})"
+        )
+
 
 @attr.s(auto_attribs=True)
 class GraphUpdate:
@@ -138,25 +196,264 @@ class GraphUpdate:
     args: Dict
     address: str
     timestamp: Optional[int]
+    # number of the block, which caused this update
+    blocknumber: Optional[int] = None
+
+
+WORD_SIZE = 32
+INT_TYPE_RE = re.compile(r"^(u?)int(\d+)$")
+BYTES_TYPE_RE = re.compile(r"^bytes(\d+)$")
+
+
+class InvalidWord(ValueError):
+    """raised for a word eth_abi would not accept for its type"""
+
+
+def make_word_decoder(type_) -> Optional[Callable[[bytes], Any]]:
+    """return a function decoding a 32 byte word of the given type like eth_abi
+
+    Returns None for types, which are not encoded in a single word. The
+    function raises InvalidWord, if the padding of the word is invalid.
+    """
+    if type_ == "address":
+
+        def decode_address(word):
+            if any(word[:12]):
+                raise InvalidWord(type_)
+            return to_checksum_address("0x" + word[12:].hex())
+
+        return decode_address
+
+    if type_ == "bool":
+
+        def decode_bool(word):
+            value = int.from_bytes(word, "big")
+            if value > 1:
+                raise InvalidWord(type_)
+            return value == 1
+
+        return decode_bool
+
+    match = INT_TYPE_RE.match(type_)
+    if match:
+        signed = match.group(1) == ""
+        bits = int(match.group(2))
+        low = -pow(2, bits - 1) if signed else 0
+        high = pow(2, bits - 1) if signed else pow(2, bits)
+
+        def decode_int(word):
+            value = int.from_bytes(word, "big", signed=signed)
+            if not low <= value < high:
+                raise InvalidWord(type_)
+            return value
+
+        return decode_int
+
+    match = BYTES_TYPE_RE.match(type_)
+    if match:
+        size = int(match.group(1))
+
+        def decode_bytes(word):
+            if any(word[size:]):
+                raise InvalidWord(type_)
+            return word[:size]
+
+        return decode_bytes
+
+    return None
+
+
+def make_word_decoders(types) -> Optional[List[Callable[[bytes], Any]]]:
+    """return word decoders for types, None if one of them is not a single word"""
+    decoders = [make_word_decoder(type_) for type_ in types]
+    if any(decoder is None for decoder in decoders):
+        return None
+    return decoders  # type: ignore
+
+
+class EventDecoder:
+    """decoder for the logs of a single event
+
+    The topic as well as the types and names of the inputs are computed once
+    from the event's ABI, so they don't have to be recomputed for every log.
+
+    Events, whose inputs all fit into a single 32 byte word, like all the
+    events of the currency networks, are decoded without eth_abi. The words are
+    decoded field by field for a whole batch of logs. Everything else, as well
+    as logs eth_abi would reject, are decoded with eth_abi.
+    """
+
+    def __init__(self, event_abi):
+        self.abi = event_abi
+        self.name = event_abi["name"]
+        self.topic = hexbytes.HexBytes(eth_utils.event_abi_to_log_topic(event_abi))
+        non_indexed_inputs = [i for i in event_abi["inputs"] if not i["indexed"]]
+        indexed_inputs = [i for i in event_abi["inputs"] if i["indexed"]]
+        self.data_types = [i["type"] for i in non_indexed_inputs]
+        self.data_names = [i["name"] for i in non_indexed_inputs]
+        self.topic_types = [i["type"] for i in indexed_inputs]
+        self.topic_names = [i["name"] for i in indexed_inputs]
+        self.names = self.data_names + self.topic_names
+        self.data_word_decoders = make_word_decoders(self.data_types)
+        self.topic_word_decoders = make_word_decoders(self.topic_types)
+        self.data_word_offsets = [
+            (i * WORD_SIZE, (i + 1) * WORD_SIZE) for i in range(len(self.data_types))
+        ]
+
+    def decode_args(self, log) -> Dict:
+        return self.decode(log["data"], log["topics"])
+
+    def decode(self, data, topics) -> Dict:
+        """decode the args from the data and topics of a log"""
+        return self.decode_many([(data, topics)])[0]
+
+    def decode_many(self, logs: Sequence[Tuple[Any, Any]]) -> List[Dict]:
+        """decode the args of many (data, topics) pairs of logs of this event"""
+        if self.data_word_decoders is None or self.topic_word_decoders is None:
+            return [self.decode_generic(data, topics) for data, topics in logs]
+        datas = [to_bytes(data) for data, topics in logs]
+        topic_lists = [[to_bytes(topic) for topic in topics[1:]] for _, topics in logs]
+        if not all(
+            len(data) >= len(self.data_word_offsets) * WORD_SIZE for data in datas
+        ) or not all(
+            len(topics) == len(self.topic_types)
+            and all(len(topic) == WORD_SIZE for topic in topics)
+            for topics in topic_lists
+        ):
+            return [self.decode_generic(data, topics) for data, topics in logs]
+        try:
+            columns = [
+                [decode_word(data[start:end]) for data in datas]
+                for decode_word, (start, end) in zip(
+                    self.data_word_decoders, self.data_word_offsets
+                )
+            ]
+            columns.extend(
+                [decode_word(topics[i]) for topics in topic_lists]
+                for i, decode_word in enumerate(self.topic_word_decoders)
+            )
+        except InvalidWord:
+            # let eth_abi raise its error for the culprit
+            return [self.decode_generic(data, topics) for data, topics in logs]
+        if not columns:
+            return [{} for _ in logs]
+        return [dict(zip(self.names, row)) for row in zip(*columns)]
+
+    def decode_generic(self, data, topics) -> Dict:
+        """decode the args from the data and topics of a log with eth_abi"""
+        data_values = eth_abi.decode_abi(self.data_types, hexbytes.HexBytes(data))
+        topic_values = [
+            eth_abi.decode_single(type_, hexbytes.HexBytes(value))
+            for type_, value in zip(self.topic_types, topics[1:])
+        ]
+        return dict(
+            itertools.chain(
+                zip(
+                    self.data_names,
+                    replace_with_checksum_address(data_values, self.data_types),
+                ),
+                zip(
+                    self.topic_names,
+                    replace_with_checksum_address(topic_values, self.topic_types),
+                ),
+            )
+        )
+
+
+def decode_events(events: Iterable[Event]) -> None:
+    """decode the args of all events, which have not been decoded yet
+
+    The events are decoded in batches, one per event decoder.
+    """
+    batches: Dict[int, List[Event]] = {}
+    for event in events:
+        if event._args is None:
+            batches.setdefault(id(event._decoder), []).append(event)
+    for batch in batches.values():
+        decoder = batch[0]._decoder
+        assert decoder is not None
+        args_list = decoder.decode_many([(e._data, e._topics) for e in batch])
+        for event, args in zip(batch, args_list):
+            event.args = args
+
+
+def build_event_decoders(abi) -> Dict[bytes, EventDecoder]:
+    """build a topic to EventDecoder mapping for all events in the given ABI"""
+    decoders = [EventDecoder(event_abi) for event_abi in get_event_abis(abi)]
+    return {decoder.topic: decoder for decoder in decoders}
 
 
 class TopicIndex:
-    def __init__(self, address2abi):
-        """build a TopicIndex from an contract address to ABI dict"""
+    def __init__(self, address2abi, address2abi_hash=None, event_names=None):
+        """build a TopicIndex from an contract address to ABI dict
+
+        All addresses using the same ABI share one set of event decoders. ABIs
+        are identified by their content hash. If address2abi_hash is given, it
+        must map the addresses to the hashes of their ABIs, which saves us from
+        computing them again.
+
+        If event_names is given, only events with those names are decoded.
+        """
         self.addresses = list(address2abi.keys())
         self.address2abi = address2abi
-        self.address_topic2event_abi = {}
+        self.abi_hash2decoders: Dict[str, Dict[bytes, EventDecoder]] = {}
+        self.address2decoders: Dict[str, Dict[bytes, EventDecoder]] = {}
+        # the same ABI object is usually shared between many addresses, only
+        # hash it once
+        hash_by_abi_id: Dict[int, str] = {}
         for address, abi in self.address2abi.items():
-            for event_abi in get_event_abis(abi):
-                self.address_topic2event_abi[
-                    (
-                        address,
-                        hexbytes.HexBytes(eth_utils.event_abi_to_log_topic(event_abi)),
-                    )
-                ] = event_abi
+            if address2abi_hash is not None:
+                hash_ = address2abi_hash[address]
+            else:
+                if id(abi) not in hash_by_abi_id:
+                    hash_by_abi_id[id(abi)] = abi_hash(abi)
+                hash_ = hash_by_abi_id[id(abi)]
+            if hash_ not in self.abi_hash2decoders:
+                self.abi_hash2decoders[hash_] = build_event_decoders(abi)
+            self.address2decoders[address] = self.abi_hash2decoders[hash_]
+
+        self.event_names = None if event_names is None else set(event_names)
+        # the topics of all events we can decode, to be passed as first topic
+        # to eth_getLogs, so the node only sends us the logs we are interested in
+        self.topics = sorted(
+            {
+                eth_utils.encode_hex(decoder.topic)
+                for decoders in self.abi_hash2decoders.values()
+                for decoder in decoders.values()
+                if self.is_wanted(decoder)
+            }
+        )
+
+    @classmethod
+    def from_abi_hashes(cls, address2abi_hash, abi_hash2abi, event_names=None):
+        """build a TopicIndex from content-addressed ABIs
+
+        address2abi_hash maps contract addresses to ABI hashes, abi_hash2abi maps
+        those hashes to the ABIs.
+        """
+        return cls(
+            {
+                address: abi_hash2abi[hash_]
+                for address, hash_ in address2abi_hash.items()
+            },
+            address2abi_hash=address2abi_hash,
+            event_names=event_names,
+        )
+
+    def is_wanted(self, decoder: EventDecoder) -> bool:
+        return self.event_names is None or decoder.name in self.event_names
+
+    def get_decoder_for_log(self, log) -> Optional[EventDecoder]:
+        decoders = self.address2decoders.get(log["address"])
+        if decoders is None:
+            return None
+        return decoders.get(log["topics"][0])
 
     def get_abi_for_log(self, log):
-        return self.address_topic2event_abi.get((log["address"], log["topics"][0]))
+        decoder = self.get_decoder_for_log(log)
+        if decoder is None:
+            return None
+        return decoder.abi
 
     def decode_logs(self, logs) -> List[Event]:
         decoded_logs = []
@@ -167,14 +464,11 @@ class TopicIndex:
         return decoded_logs
 
     def decode_log(self, log) -> Optional[Event]:
-        abi = self.get_abi_for_log(log)
-        if abi is None:
+        decoder = self.get_decoder_for_log(log)
+        if decoder is None:
             logger.warning(f"Could not find abi for log {log}")
             return None
+        if not self.is_wanted(decoder):
+            return None
 
-        args = dict(
-            itertools.chain(
-                decode_non_indexed_inputs(abi, log), decode_indexed_inputs(abi, log)
-            )
-        )
-        return Event(name=abi["name"], args=args, log=log, timestamp=None)
+        return Event.from_log(decoder, log)
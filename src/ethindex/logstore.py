@@ -0,0 +1,445 @@
+"""append-only store of raw logs on disk
+
+Changing which events are imported, e.g. after importing a new ABI, used to
+require syncing from the node again. runsync can write the raw logs and the
+timestamps of their blocks to a directory of segment files, each covering a
+range of confirmed blocks. Re-projection jobs read them back without any
+json-rpc request.
+
+Segments are memory mapped. The reader hands out views into the mapping
+instead of copying the data and topics of every log, they are only copied
+when the args of an event are decoded.
+
+A segment file consists of a header, the addresses, the blocks and the logs::
+
+    header:  magic, first block, last block, #addresses, #blocks, #logs
+    address: 20 bytes, the addresses the logs were fetched for
+    block:   number, timestamp, hash
+    log:     block number, transaction index, log index, address index,
+             #topics, data length, transaction hash, topics, data
+
+The store only contains the logs fetched by the sync job, i.e. the logs of its
+addresses with topics of events we could decode at that time. Every segment
+records the addresses it covers, a new segment is started when they change.
+"""
+import bisect
+import logging
+import mmap
+import os
+import re
+import struct
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ethindex import logdecode
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ETHLOGS1"
+SEGMENT_HEADER = struct.Struct("<8sqqIII")
+BLOCK_RECORD = struct.Struct("<qQ32s")
+LOG_RECORD = struct.Struct("<qIIHBI32s")
+ADDRESS_SIZE = 20
+TOPIC_SIZE = 32
+# confirmed blocks are collected in memory until they fill a segment of that
+# many blocks
+DEFAULT_SEGMENT_BLOCKS = 10000
+SEGMENT_NAME_RE = re.compile(r"^logs-(\d{12})-(\d{12})\.seg$")
+
+
+def segment_name(first_block, last_block):
+    return f"logs-{first_block:012d}-{last_block:012d}.seg"
+
+
+def encode_segment(first_block, last_block, logs, blocks, addresses=()) -> bytes:
+    """encode the logs and the blocks containing them
+
+    logs are web3 log entries ordered by block number and log index, blocks are
+    web3 blocks. addresses are the addresses the logs were fetched for, the
+    addresses of the logs are added to them."""
+    address_index: Dict[bytes, int] = {}
+    for address in addresses:
+        address_index.setdefault(logdecode.to_bytes(address), len(address_index))
+    log_records = []
+    for log in logs:
+        address = logdecode.to_bytes(log["address"])
+        topics = [logdecode.to_bytes(topic) for topic in log["topics"]]
+        data = logdecode.to_bytes(log["data"])
+        log_records.append(
+            LOG_RECORD.pack(
+                log["blockNumber"],
+                log["transactionIndex"],
+                log["logIndex"],
+                address_index.setdefault(address, len(address_index)),
+                len(topics),
+                len(data),
+                logdecode.to_bytes(log["transactionHash"]),
+            )
+        )
+        log_records.extend(topics)
+        log_records.append(data)
+    block_records = [
+        BLOCK_RECORD.pack(
+            block["number"], block["timestamp"], logdecode.to_bytes(block["hash"])
+        )
+        for block in sorted(blocks, key=lambda block: block["number"])
+    ]
+    return b"".join(
+        [
+            SEGMENT_HEADER.pack(
+                MAGIC,
+                first_block,
+                last_block,
+                len(address_index),
+                len(block_records),
+                len(logs),
+            ),
+            *address_index,
+            *block_records,
+            *log_records,
+        ]
+    )
+
+
+class StoredLog:
+    """a log read from a segment
+
+    It can be used like a web3 log entry. data and topics are memoryviews into
+    the segment.
+    """
+
+    __slots__ = (
+        "address",
+        "blockNumber",
+        "blockHash",
+        "transactionHash",
+        "transactionIndex",
+        "logIndex",
+        "topics",
+        "data",
+        "timestamp",
+    )
+
+    def __init__(
+        self,
+        address,
+        blockNumber,
+        blockHash,
+        transactionHash,
+        transactionIndex,
+        logIndex,
+        topics,
+        data,
+        timestamp,
+    ):
+        self.address = address
+        self.blockNumber = blockNumber
+        self.blockHash = blockHash
+        self.transactionHash = transactionHash
+        self.transactionIndex = transactionIndex
+        self.logIndex = logIndex
+        self.topics = topics
+        self.data = data
+        self.timestamp = timestamp
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class Segment:
+    """a memory mapped segment file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        (
+            magic,
+            self.first_block,
+            self.last_block,
+            num_addresses,
+            num_blocks,
+            self.num_logs,
+        ) = SEGMENT_HEADER.unpack_from(self._view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a log segment")
+        offset = SEGMENT_HEADER.size
+        self.addresses = []
+        for _ in range(num_addresses):
+            end = offset + ADDRESS_SIZE
+            self.addresses.append(
+                logdecode.to_checksum_address(bytes(self._view[offset:end]))
+            )
+            offset = end
+        self.blocks: Dict[int, Tuple[int, bytes]] = {}
+        for _ in range(num_blocks):
+            number, timestamp, hash_ = BLOCK_RECORD.unpack_from(self._view, offset)
+            self.blocks[number] = (timestamp, hash_)
+            offset += BLOCK_RECORD.size
+        self._logs_offset = offset
+
+    def iterate_logs(self, from_block=None, to_block=None) -> Iterator[StoredLog]:
+        view = self._view
+        offset = self._logs_offset
+        for _ in range(self.num_logs):
+            (
+                block_number,
+                transaction_index,
+                log_index,
+                address_index,
+                num_topics,
+                data_length,
+                transaction_hash,
+            ) = LOG_RECORD.unpack_from(view, offset)
+            topics_start = offset + LOG_RECORD.size
+            data_start = topics_start + num_topics * TOPIC_SIZE
+            offset = data_start + data_length
+            if from_block is not None and block_number < from_block:
+                continue
+            if to_block is not None and block_number > to_block:
+                return
+            timestamp, block_hash = self.blocks[block_number]
+            starts = range(topics_start, data_start + TOPIC_SIZE, TOPIC_SIZE)
+            yield StoredLog(
+                address=self.addresses[address_index],
+                blockNumber=block_number,
+                blockHash=block_hash,
+                transactionHash=transaction_hash,
+                transactionIndex=transaction_index,
+                logIndex=log_index,
+                topics=tuple(view[a:b] for a, b in zip(starts, starts[1:])),
+                data=view[data_start:offset],
+                timestamp=timestamp,
+            )
+
+
+class LogStore:
+    """a directory of segment files covering ranges of confirmed blocks
+
+    Appended blocks are kept in memory until they fill a segment. Every flush
+    writes the blocks appended since the last flush to a small tail segment,
+    so runsync can flush before every commit, writing every block only once.
+    When the pending blocks fill a segment, they are written to one segment
+    and their tail segments are removed. Tail segments left by a previous run
+    are read back, so they are merged into the next full segment. Blocks we
+    already have are ignored when appending.
+    """
+
+    def __init__(self, directory, segment_blocks=DEFAULT_SEGMENT_BLOCKS):
+        self.directory = directory
+        self.segment_blocks = segment_blocks
+        self._clear_pending()
+        self._remove_replaced_segments()
+        self._load_tail_segments()
+
+    def _segment_path(self, first_block, last_block):
+        return os.path.join(self.directory, segment_name(first_block, last_block))
+
+    def _all_segment_ranges(self) -> List[Tuple[int, int]]:
+        ranges = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_NAME_RE.match(name)
+            if match:
+                ranges.append((int(match.group(1)), int(match.group(2))))
+        # a range comes after the ranges it contains
+        ranges.sort(key=lambda r: (r[0], -r[1]))
+        return ranges
+
+    def segment_ranges(self) -> List[Tuple[int, int]]:
+        """return the block ranges of the segments, ordered by first block
+
+        Tail segments, which have been merged into a full segment but not
+        removed yet, are left out."""
+        ranges = []
+        for first, last in self._all_segment_ranges():
+            if not ranges or last > ranges[-1][1]:
+                ranges.append((first, last))
+        return ranges
+
+    def _remove_replaced_segments(self):
+        """remove tail segments left behind by a crash after merging them"""
+        ranges = set(self.segment_ranges())
+        for first, last in self._all_segment_ranges():
+            if (first, last) not in ranges:
+                os.remove(self._segment_path(first, last))
+
+    def _load_tail_segments(self):
+        """make the tail segments after the last full segment pending again"""
+        tail: List[Segment] = []
+        tail_blocks = 0
+        for first, last in reversed(self.segment_ranges()):
+            tail_blocks += last - first + 1
+            if tail_blocks >= self.segment_blocks or (
+                tail and last + 1 != tail[0].first_block
+            ):
+                break
+            segment = Segment(self._segment_path(first, last))
+            if tail and sorted(segment.addresses) != sorted(tail[0].addresses):
+                break
+            tail.insert(0, segment)
+        if not tail:
+            return
+        for segment in tail:
+            for log in segment.iterate_logs():
+                self._pending_logs.append(
+                    {
+                        "address": log.address,
+                        "blockNumber": log.blockNumber,
+                        "blockHash": bytes(log.blockHash),
+                        "transactionHash": bytes(log.transactionHash),
+                        "transactionIndex": log.transactionIndex,
+                        "logIndex": log.logIndex,
+                        "topics": [bytes(topic) for topic in log.topics],
+                        "data": bytes(log.data),
+                    }
+                )
+            for number, (timestamp, hash_) in segment.blocks.items():
+                self._pending_blocks[number] = {
+                    "number": number,
+                    "timestamp": timestamp,
+                    "hash": hash_,
+                }
+            self._tail_ranges.append((segment.first_block, segment.last_block))
+        self._pending_range = (tail[0].first_block, tail[-1].last_block)
+        self._pending_addresses = sorted(tail[0].addresses)
+        self._written_logs = len(self._pending_logs)
+
+    def last_block(self) -> int:
+        """the last block stored or pending, -1 if there is none"""
+        if self._pending_range is not None:
+            return self._pending_range[1]
+        ranges = self.segment_ranges()
+        return max(last for first, last in ranges) if ranges else -1
+
+    def append(self, first_block, last_block, logs, blocks, addresses=()):
+        """append the logs of the confirmed blocks first_block to last_block
+
+        blocks must contain the blocks of all logs, addresses are the addresses
+        the logs were fetched for. The logs are written to a segment as soon as
+        there are segment_blocks pending blocks.
+        """
+        first_block = max(first_block, self.last_block() + 1)
+        if first_block > last_block:
+            return
+        addresses = sorted(addresses)
+        if self._pending_range is None:
+            self._pending_range = (first_block, last_block)
+        elif (
+            first_block == self._pending_range[1] + 1
+            and addresses == self._pending_addresses
+        ):
+            self._pending_range = (self._pending_range[0], last_block)
+        else:
+            # there is a gap or the addresses changed, start a new segment
+            self._write_segment()
+            self._pending_range = (first_block, last_block)
+        if self._unwritten_first is None:
+            self._unwritten_first = first_block
+        self._pending_addresses = addresses
+        block_by_number = {block["number"]: block for block in blocks}
+        for log in logs:
+            if first_block <= log["blockNumber"] <= last_block:
+                self._pending_logs.append(log)
+                self._pending_blocks[log["blockNumber"]] = block_by_number[
+                    log["blockNumber"]
+                ]
+        first, last = self._pending_range
+        if last - first + 1 >= self.segment_blocks:
+            self._write_segment()
+
+    def flush(self):
+        """write the pending blocks, which have not been written yet, to a tail
+        segment"""
+        if self._unwritten_first is None:
+            return
+        first, last = self._unwritten_first, self._pending_range[1]
+        written = self._written_logs
+        self._write(
+            first,
+            last,
+            self._pending_logs[written:],
+            [b for n, b in self._pending_blocks.items() if n >= first],
+        )
+        self._tail_ranges.append((first, last))
+        self._unwritten_first = None
+        self._written_logs = len(self._pending_logs)
+
+    def _write_segment(self):
+        """write all pending blocks to one segment and remove their tail
+        segments"""
+        if self._pending_range is None:
+            return
+        if self._tail_ranges != [self._pending_range]:
+            self._write(
+                *self._pending_range,
+                self._pending_logs,
+                self._pending_blocks.values(),
+            )
+            for first, last in self._tail_ranges:
+                os.remove(self._segment_path(first, last))
+        self._clear_pending()
+
+    def _write(self, first, last, logs, blocks):
+        path = self._segment_path(first, last)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encode_segment(first, last, logs, blocks, self._pending_addresses))
+        os.replace(tmp_path, path)
+        logger.debug(
+            "wrote %s logs of blocks %s -> %s to %s", len(logs), first, last, path
+        )
+
+    def _clear_pending(self):
+        self._pending_range: Optional[Tuple[int, int]] = None
+        self._pending_logs: List = []
+        self._pending_blocks: Dict[int, object] = {}
+        self._pending_addresses: List[str] = []
+        # the ranges of the tail segments the pending blocks were written to
+        self._tail_ranges: List[Tuple[int, int]] = []
+        # the first pending block not written to a tail segment, if any
+        self._unwritten_first: Optional[int] = None
+        # the number of pending logs written to tail segments
+        self._written_logs = 0
+
+    def missing_ranges(self, from_block, to_block) -> List[Tuple[int, int]]:
+        """return the parts of the block range not covered by any segment"""
+        missing = []
+        next_block = from_block
+        for first, last in self.segment_ranges():
+            if last < next_block:
+                continue
+            if first > to_block:
+                break
+            if first > next_block:
+                missing.append((next_block, first - 1))
+            next_block = last + 1
+        if next_block <= to_block:
+            missing.append((next_block, to_block))
+        return missing
+
+    def iterate_segments(self, from_block, to_block) -> Iterator[Segment]:
+        """iterate over the segments overlapping the block range in order"""
+        ranges = self.segment_ranges()
+        start = max(bisect.bisect_right(ranges, (from_block,)) - 1, 0)
+        for first, last in ranges[start:]:
+            if last < from_block:
+                continue
+            if first > to_block:
+                return
+            yield Segment(os.path.join(self.directory, segment_name(first, last)))
+
+    def iterate_logs(self, from_block, to_block) -> Iterator[StoredLog]:
+        """iterate over the stored logs in the block range in order"""
+        for segment in self.iterate_segments(from_block, to_block):
+            yield from segment.iterate_logs(from_block, to_block)
+
+
+def iterate_events(
+    logs: Iterable[StoredLog], topic_index: logdecode.TopicIndex
+) -> Iterator[logdecode.Event]:
+    """decode the stored logs with topic_index"""
+    for log in logs:
+        event = topic_index.decode_log(log)
+        if event is not None:
+            event.timestamp = log.timestamp
+            yield event
@@ -1,7 +1,8 @@
-"""import ethereum events into postgres
+"""import ethereum events into postgres or SQLite
 """
 import binascii
-import copy
+import concurrent.futures
+import itertools
 import json
 import logging
 import sys
@@ -11,12 +12,20 @@ from typing import Iterable, List, Union
 import click
 import psycopg2
 import psycopg2.extras
-from hexbytes import HexBytes
 from psycopg2 import sql
 from tlbin import load_packaged_contracts, load_packaged_merged_abis
-from web3 import Web3
 
-from ethindex import logdecode, util
+from ethindex import (
+    density,
+    follow,
+    logdecode,
+    logstore,
+    retry,
+    rpc,
+    serialize,
+    sqlite,
+    util,
+)
 from ethindex.logdecode import Event, GraphUpdate
 
 logger = logging.getLogger(__name__)
@@ -27,49 +36,159 @@ TRUSTLINE_UPDATE_EVENT_NAME = "TrustlineUpdate"
 NETWORK_FREEZE_EVENT_NAME = "NetworkFreeze"
 NETWORK_UNFREEZE_EVENT_NAME = "NetworkUnfreeze"
 
+DEFAULT_GETLOGS_WORKERS = 4
+# with --unconfirmed-table, the events of unconfirmed blocks are kept in this
+# unlogged table, the all_events view combines it with the events table
+UNCONFIRMED_EVENTS_TABLE = "events_unconfirmed"
+# channel notified when a sync job commits new blocks
+SYNC_NOTIFY_CHANNEL = "ethindex_sync"
+
+
+def topic_index_from_db(conn, addresses=None, event_names=None):
+    """create a logdecode.TopicIndex from the ABIs stored in the database
 
-def topic_index_from_db(conn, addresses=None):
-    """create a logdecode.TopicIndex from the ABIs stored in the abis table"""
+    Every distinct ABI is only loaded once, no matter how many contracts use it.
+    If event_names is given, the TopicIndex only decodes events with those names.
+    """
     with conn.cursor() as cur:
         if addresses is None:
-            cur.execute("select * from abis")
+            cur.execute("select contract_address, abi_hash from contract_abis")
         else:
             cur.execute(
-                "select * from abis where contract_address in %s", (tuple(addresses),)
+                """select contract_address, abi_hash from contract_abis
+                   where contract_address in %s""",
+                (tuple(addresses),),
             )
-        rows = cur.fetchall()
-        return logdecode.TopicIndex({r["contract_address"]: r["abi"] for r in rows})
+        address2abi_hash = {r["contract_address"]: r["abi_hash"] for r in cur}
+        if not address2abi_hash:
+            return logdecode.TopicIndex({}, event_names=event_names)
+        cur.execute(
+            "select abi_hash, abi from abi_contents where abi_hash in %s",
+            (tuple(set(address2abi_hash.values())),),
+        )
+        abi_hash2abi = {r["abi_hash"]: r["abi"] for r in cur}
+        return logdecode.TopicIndex.from_abi_hashes(
+            address2abi_hash, abi_hash2abi, event_names=event_names
+        )
+
 
+def get_logs(web3, addresses, fromBlock, toBlock, topics=None, raw_client=None):
+    """fetch the logs emitted by addresses
 
-def get_logs(web3, addresses, fromBlock, toBlock):
+    If topics is given, only logs with one of those topics as first topic are
+    returned. If raw_client is given, it is used instead of web3."""
     fromBlock = hex(fromBlock)
     if toBlock != "latest":
         toBlock = hex(toBlock)
 
-    return web3.eth.getLogs(
-        {"fromBlock": fromBlock, "toBlock": toBlock, "address": addresses}
-    )
+    log_filter = {"fromBlock": fromBlock, "toBlock": toBlock, "address": addresses}
+    if topics is not None:
+        log_filter["topics"] = [topics]
+    if raw_client is not None:
+        return raw_client.get_logs(log_filter)
+    return web3.eth.getLogs(log_filter)
+
+
+def get_sharded_logs(
+    web3,
+    addresses,
+    fromBlock,
+    toBlock,
+    topics=None,
+    addresses_per_shard=None,
+    max_workers=DEFAULT_GETLOGS_WORKERS,
+    retrier=retry.no_retry,
+    raw_client=None,
+):
+    """fetch the logs emitted by addresses with one eth_getLogs call per shard
+
+    addresses is split into shards of at most addresses_per_shard addresses,
+    which are fetched concurrently. The logs are returned ordered by block
+    number and log index. Every eth_getLogs call is made through retrier, so a
+    failing call doesn't throw away the logs of the other shards.
+    """
+
+    def get_shard_logs(shard):
+        return retrier(
+            get_logs,
+            web3,
+            shard,
+            fromBlock,
+            toBlock,
+            topics=topics,
+            raw_client=raw_client,
+        )
 
+    if not addresses_per_shard or len(addresses) <= addresses_per_shard:
+        return get_shard_logs(addresses)
 
-def get_events(web3, topic_index, fromBlock, toBlock) -> Iterable[logdecode.Event]:
-    logs = get_logs(web3, topic_index.addresses, fromBlock, toBlock)
+    shards = util.chunks(list(addresses), addresses_per_shard)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # the requests keep the priority of the caller
+        futures = [
+            rpc.submit_with_context(executor, get_shard_logs, shard) for shard in shards
+        ]
+        logs = list(
+            itertools.chain.from_iterable(future.result() for future in futures)
+        )
+    return sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"]))
+
+
+def get_events(
+    web3,
+    topic_index,
+    fromBlock,
+    toBlock,
+    addresses_per_shard=None,
+    max_workers=DEFAULT_GETLOGS_WORKERS,
+    retrier=retry.no_retry,
+    raw_client=None,
+) -> Iterable[logdecode.Event]:
+    logs = get_topic_index_logs(
+        web3,
+        topic_index,
+        fromBlock,
+        toBlock,
+        addresses_per_shard=addresses_per_shard,
+        max_workers=max_workers,
+        retrier=retrier,
+        raw_client=raw_client,
+    )
     return topic_index.decode_logs(logs)
 
 
-def hexlify(d):
-    return "0x" + binascii.hexlify(d).decode()
+def get_topic_index_logs(
+    web3,
+    topic_index,
+    fromBlock,
+    toBlock,
+    addresses_per_shard=None,
+    max_workers=DEFAULT_GETLOGS_WORKERS,
+    retrier=retry.no_retry,
+    raw_client=None,
+):
+    """fetch the logs of the addresses of topic_index, which it can decode"""
+    if not topic_index.topics:
+        # there is no event we could decode
+        return []
+    return get_sharded_logs(
+        web3,
+        topic_index.addresses,
+        fromBlock,
+        toBlock,
+        topics=topic_index.topics,
+        addresses_per_shard=addresses_per_shard,
+        max_workers=max_workers,
+        retrier=retrier,
+        raw_client=raw_client,
+    )
 
 
-def bytesArgsToHex(args):
-    for key in args:
-        if type(args[key]) is bytes:
-            args[key] = hexlify(args[key])
-    return args
+def hexlify(d):
+    return "0x" + binascii.hexlify(d).decode()
 
 
 def insert_event(cur, event: logdecode.Event) -> None:
-    event.args = bytesArgsToHex(event.args)
-
     cur.execute(
         sql.SQL(
             """INSERT INTO events (
@@ -90,7 +209,42 @@ def insert_event(cur, event: logdecode.Event) -> None:
             event.blocknumber,
             event.address,
             event.name,
-            json.dumps(event.args),
+            serialize.encode_args(event.args),
+            hexlify(event.blockhash),
+            event.transactionindex,
+            event.logindex,
+            event.timestamp,
+        ],
+    )
+
+
+def insert_graph_feed_outbox(
+    cur, syncid, event: logdecode.Event, removed: bool
+) -> None:
+    """insert an added or removed event into the graph feed outbox"""
+    cur.execute(
+        """INSERT INTO graphfeed_outbox (
+            syncid,
+            removed,
+            transactionHash,
+            blockNumber,
+            address,
+            eventName,
+            args,
+            blockHash,
+            transactionIndex,
+            logIndex,
+            timestamp
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+        [
+            syncid,
+            removed,
+            hexlify(event.transactionhash),
+            event.blocknumber,
+            event.address,
+            event.name,
+            serialize.encode_args(event.args),
             hexlify(event.blockhash),
             event.transactionindex,
             event.logindex,
@@ -103,29 +257,62 @@ def insert_graph_feed_updates(
     cur, feed_updates: Iterable[Union[Event, GraphUpdate]]
 ) -> None:
     for feed_update in feed_updates:
-        feed_update.args = bytesArgsToHex(feed_update.args)
-
         cur.execute(
             """INSERT INTO graphfeed (
                 address,
                 eventName,
                 args,
-                timestamp
+                timestamp,
+                blockNumber
             )
-            VALUES (%s, %s, %s, %s)""",
+            VALUES (%s, %s, %s, %s, %s)""",
             (
                 feed_update.address,
                 feed_update.name,
-                json.dumps(feed_update.args),
+                serialize.encode_args(feed_update.args),
                 feed_update.timestamp,
+                feed_update.blocknumber,
             ),
         )
 
 
 def insert_events(conn, events: Iterable[logdecode.Event]) -> None:
     with conn.cursor() as cur:
-        for event in events:
-            insert_event(cur, event)
+        serialize.copy_events(cur, events)
+
+
+def insert_events_split(
+    conn, events: Iterable[logdecode.Event], last_confirmed_block_number
+) -> None:
+    """insert the events of confirmed blocks into the events table and the
+    events of unconfirmed blocks into the unconfirmed events table"""
+    events = list(events)
+    with conn.cursor() as cur:
+        serialize.copy_events(
+            cur, [e for e in events if e.blocknumber <= last_confirmed_block_number]
+        )
+        serialize.copy_events(
+            cur,
+            [e for e in events if e.blocknumber > last_confirmed_block_number],
+            table=UNCONFIRMED_EVENTS_TABLE,
+        )
+
+
+def move_confirmed_events(conn, addresses, last_confirmed_block_number) -> int:
+    """move the events of blocks, which have been confirmed, from the
+    unconfirmed events table into the events table"""
+    columns = ", ".join(serialize.EVENT_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""WITH moved AS (
+                  DELETE FROM {UNCONFIRMED_EVENTS_TABLE}
+                  WHERE blockNumber<=%s AND address IN %s
+                  RETURNING {columns}
+                )
+                INSERT INTO events ({columns}) SELECT {columns} FROM moved""",
+            (last_confirmed_block_number, tuple(addresses)),
+        )
+        return cur.rowcount
 
 
 def event_blocknumbers(events):
@@ -137,6 +324,62 @@ def connect(dsn):
     return psycopg2.connect(dsn, cursor_factory=psycopg2.extras.RealDictCursor)
 
 
+def connect_storage(sqlite_path=None):
+    """connect to the SQLite database in sqlite_path if given, otherwise to
+    the postgres database given by the PG* environment variables"""
+    if sqlite_path is not None:
+        return sqlite.connect(sqlite_path)
+    return connect("")
+
+
+class PostgresStorage:
+    """the postgres specific parts of storing events
+
+    ethindex.sqlite.SQLiteStorage implements them for SQLite. All other
+    queries are written in the SQL understood by both databases.
+    """
+
+    name = "postgres"
+    # appended to queries selecting the rows we are going to update
+    lock_rows = "FOR UPDATE"
+    # the tables events of a sync job may be stored in
+    event_tables = ("events", UNCONFIRMED_EVENTS_TABLE)
+    supports_unconfirmed_table = True
+
+    def insert_events(self, conn, events: Iterable[logdecode.Event]) -> None:
+        insert_events(conn, events)
+
+    def notify_sync(
+        self,
+        cur,
+        syncid,
+        last_block_number,
+        last_confirmed_block_number,
+        rewritten=False,
+    ):
+        notify_sync(
+            cur,
+            syncid,
+            last_block_number,
+            last_confirmed_block_number,
+            rewritten=rewritten,
+        )
+
+    def create_tables(self, conn):
+        do_createtables(conn)
+
+    def drop_tables(self, conn, force):
+        do_droptables(conn, force)
+
+
+POSTGRES_STORAGE = PostgresStorage()
+
+
+def get_storage(conn):
+    """return the storage of the connection, SQLite connections bring their own"""
+    return getattr(conn, "storage", POSTGRES_STORAGE)
+
+
 def enrich_events(events: Iterable[logdecode.Event], blocks) -> None:
     block_by_number = {b["number"]: b for b in blocks}
     for e in events:
@@ -146,8 +389,14 @@ def enrich_events(events: Iterable[logdecode.Event], blocks) -> None:
         e.timestamp = block["timestamp"]
 
 
-def insert_sync_entry(conn, syncid, addresses, start_block=-1):
-    """make sure we have at least one entry in the sync table"""
+def insert_sync_entry(
+    conn, syncid, addresses, start_block=-1, event_names=None, end_block=None
+):
+    """make sure we have at least one entry in the sync table
+
+    If event_names is given, the sync job only imports events with those names.
+    If end_block is given, the sync job stops syncing at that block.
+    """
 
     with conn.cursor() as cur:
         cur.execute(
@@ -155,50 +404,134 @@ def insert_sync_entry(conn, syncid, addresses, start_block=-1):
                                  last_block_number,
                                  addresses,
                                  last_confirmed_block_number,
-                                 latest_block_hash)
-               VALUES (%s, %s, %s, %s, %s)""",
-            (syncid, start_block, list(addresses), start_block, ""),
+                                 latest_block_hash,
+                                 event_names,
+                                 end_block)
+               VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+            (
+                syncid,
+                start_block,
+                list(addresses),
+                start_block,
+                "",
+                None if event_names is None else list(event_names),
+                end_block,
+            ),
+        )
+        # a sync row with that syncid may have existed before
+        density.delete_event_density(cur, syncid)
+
+
+def find_unsynced_addresses(cur):
+    """return the addresses of the contracts not being synced by any sync job"""
+    cur.execute("""select addresses from sync""")
+    rows = cur.fetchall()
+    other_addresses = set().union(*[r["addresses"] for r in rows])
+    cur.execute("""select address from sync_onboarding""")
+    other_addresses.update(r["address"] for r in cur.fetchall())
+
+    cur.execute("""select contract_address from contract_abis""")
+    contract_addresses = set([x["contract_address"] for x in cur.fetchall()])
+
+    logger.info(
+        "found %s contracts, %s already being synced",
+        len(contract_addresses),
+        len(other_addresses),
+    )
+    addresses = contract_addresses - other_addresses
+    if not addresses:
+        raise RuntimeError(
+            "No ABIs found. Please add some ABIs first with 'ethindex importabi'"
         )
+    return addresses
 
 
-def ensure_sync_entry(conn, syncid, start_block=-1):
+def add_onboarding_addresses(conn, syncid, addresses, start_block=-1) -> None:
+    """let the sync job syncid sync the events of addresses from start_block on
+
+    The addresses are synced separately up to the last confirmed block of the
+    sync job, then they are added to its addresses.
+    """
+    with conn.cursor() as cur:
+        cur.executemany(
+            """INSERT INTO sync_onboarding (syncid, address, last_block_number)
+               VALUES (%s, %s, %s) ON CONFLICT DO NOTHING""",
+            [(syncid, address, start_block) for address in sorted(addresses)],
+        )
+
+
+def find_new_addresses(cur):
+    """return the addresses of imported contracts, which are neither synced nor
+    onboarded by any sync job"""
+    cur.execute("""select addresses from sync""")
+    other_addresses = set().union(*[r["addresses"] for r in cur.fetchall()])
+    cur.execute("""select address from sync_onboarding""")
+    other_addresses.update(r["address"] for r in cur.fetchall())
+    cur.execute("""select contract_address from contract_abis""")
+    return {r["contract_address"] for r in cur.fetchall()} - other_addresses
+
+
+def ensure_sync_entry(conn, syncid, start_block=-1, event_names=None):
     with conn.cursor() as cur:
         cur.execute("""select * from sync where syncid=%s""", (syncid,))
         if cur.fetchall():
             return
-        cur.execute("""select addresses from sync""")
-        rows = cur.fetchall()
-        other_addresses = set().union(*[r["addresses"] for r in rows])
-
-        cur.execute("""select contract_address from abis""")
-        contract_addresses = set([x["contract_address"] for x in cur.fetchall()])
-
-        addresses = contract_addresses - other_addresses
-        logger.info(
-            "found %s contracts, %s already being synced",
-            len(contract_addresses),
-            len(other_addresses),
+        addresses = find_unsynced_addresses(cur)
+        insert_sync_entry(
+            conn, syncid, addresses, start_block=start_block, event_names=event_names
         )
-        if not addresses:
-            raise RuntimeError(
-                "No ABIs found. Please add some ABIs first with 'ethindex importabi'"
-            )
-        insert_sync_entry(conn, syncid, addresses, start_block=start_block)
 
 
 def ensure_default_entry(conn, start_block=-1):
     ensure_sync_entry(conn, "default", start_block=start_block)
 
 
-def delete_events(conn, fromBlock, addresses) -> List[Event]:
+def notify_sync(
+    cur, syncid, last_block_number, last_confirmed_block_number, rewritten=False
+):
+    """notify listeners on SYNC_NOTIFY_CHANNEL when the transaction commits
+
+    rewritten tells them, that events of confirmed blocks have changed, e.g.
+    because addresses have been onboarded.
+    """
+    cur.execute(
+        "SELECT pg_notify(%s, %s)",
+        (
+            SYNC_NOTIFY_CHANNEL,
+            json.dumps(
+                {
+                    "syncid": syncid,
+                    "last_block_number": last_block_number,
+                    "last_confirmed_block_number": last_confirmed_block_number,
+                    "rewritten": rewritten,
+                }
+            ),
+        ),
+    )
+
+
+def delete_events(conn, fromBlock, addresses, toBlock=None) -> List[Event]:
+    """delete the events of addresses from fromBlock up to toBlock from the
+    events table as well as the unconfirmed events table, if the storage has
+    one"""
+    deleted_rows = []
     with conn.cursor() as cur:
-        cur.execute(
-            """DELETE FROM events
-               WHERE blocknumber>=%s
-                     AND address in %s RETURNING *""",
-            (fromBlock, tuple(addresses)),
-        )
-        deleted_rows = cur.fetchall()
+        for table in get_storage(conn).event_tables:
+            if toBlock is None:
+                cur.execute(
+                    f"""DELETE FROM {table}
+                        WHERE blocknumber>=%s
+                              AND address in %s RETURNING *""",
+                    (fromBlock, tuple(addresses)),
+                )
+            else:
+                cur.execute(
+                    f"""DELETE FROM {table}
+                        WHERE blocknumber>=%s AND blocknumber<=%s
+                              AND address in %s RETURNING *""",
+                    (fromBlock, toBlock, tuple(addresses)),
+                )
+            deleted_rows.extend(cur.fetchall())
     return [build_event_from_row(row) for row in deleted_rows]
 
 
@@ -229,14 +562,12 @@ def build_event_from_row(row):
     return Event(
         name=row["eventname"],
         args=row["args"],
-        log={
-            "blockNumber": row["blocknumber"],
-            "blockHash": HexBytes(row["blockhash"]),
-            "transactionHash": HexBytes(row["transactionhash"]),
-            "address": row["address"],
-            "transactionIndex": row["transactionindex"],
-            "logIndex": row["logindex"],
-        },
+        address=row["address"],
+        blocknumber=row["blocknumber"],
+        blockhash=logdecode.to_bytes(row["blockhash"]),
+        transactionhash=logdecode.to_bytes(row["transactionhash"]),
+        transactionindex=row["transactionindex"],
+        logindex=row["logindex"],
         timestamp=row["timestamp"],
     )
 
@@ -244,8 +575,7 @@ def build_event_from_row(row):
 def null_replacing_graph_update(event: Event) -> GraphUpdate:
 
     if event.name == BALANCE_UPDATE_EVENT_NAME:
-        null_event_args = copy.deepcopy(event.args)
-        null_event_args["_value"] = 0
+        null_event_args = dict(event.args, _value=0)
         null_event_name = BALANCE_UPDATE_EVENT_NAME
     elif event.name == TRUSTLINE_UPDATE_EVENT_NAME:
         null_event_args = {
@@ -276,22 +606,85 @@ def null_replacing_graph_update(event: Event) -> GraphUpdate:
         args=null_event_args,
         address=event.address,
         timestamp=event.timestamp,
+        blocknumber=event.blocknumber,
     )
 
 
 class Synchronizer:
     blocks_per_round = 50000
+    # rounds are sized to contain about that many events according to the
+    # event density statistics, but at most blocks_per_round blocks
+    events_per_round = 20000
+    # confirmed blocks are committed in checkpoints of that many blocks
+    blocks_per_checkpoint = 5000
+    # when following the head, fall back to a normal sync_round if there are
+    # more new blocks
+    follow_head_max_blocks = 10
+    # number of graph feed outbox rows processed in one transaction
+    graph_feed_batch_size = 1000
+    # when following the head, skip eth_getLogs for blocks whose logs bloom
+    # shows they contain no relevant logs
+    check_logs_bloom = True
 
     def __init__(
-        self, conn, web3, syncid, required_confirmations=10, merge_with_syncid=None
+        self,
+        conn,
+        web3,
+        syncid,
+        required_confirmations=10,
+        merge_with_syncid=None,
+        addresses_per_shard=None,
+        getlogs_workers=DEFAULT_GETLOGS_WORKERS,
+        feed_graph=True,
+        follow_head=False,
+        log_store=None,
+        unconfirmed_table=False,
+        onboard_new_addresses=False,
     ):
         self.conn = conn
+        self.storage = get_storage(conn)
+        if unconfirmed_table and not self.storage.supports_unconfirmed_table:
+            raise ValueError(
+                f"the {self.storage.name} storage has no unconfirmed events table"
+            )
         self.web3 = web3
+        # used for eth_getLogs and fetching blocks, if we talk to the nodes over
+        # http
+        self.raw_client = rpc.make_raw_client(web3)
         self.syncid = syncid
         self.required_confirmations = required_confirmations
         self.merge_with_syncid = merge_with_syncid
+        self.addresses_per_shard = addresses_per_shard
+        self.getlogs_workers = getlogs_workers
+        self.feed_graph = feed_graph
+        self.follow_head = follow_head
+        # the raw logs of confirmed blocks are appended to log_store, if given
+        self.log_store = log_store
+        # keep the events of unconfirmed blocks in the unconfirmed events table
+        self.unconfirmed_table = unconfirmed_table
+        # onboard the addresses of newly imported contracts
+        self.onboard_new_addresses = onboard_new_addresses
+        self.head_window = None
+        self.head_latency = follow.LatencyStats()
+        self.bloom_stats = follow.BloomStats()
+        # loaded from the event_density table when needed
+        self.event_density = None
+        self.forecast = density.Forecast()
+        # the bloom filter and the topic index it was built from
+        self._bloom_filter = None
         self.last_fully_synced_block = -1
         self.unfinalized_graph_events = []
+        self.rpc_breaker = retry.CircuitBreaker("json-rpc")
+        self.rpc_retrier = retry.Retrier(
+            "json-rpc request", retry_on=rpc.TRANSIENT_ERRORS, breaker=self.rpc_breaker
+        )
+        self.db_breaker = retry.CircuitBreaker("database")
+        # events fetched for a range, which have not been committed yet. They are
+        # kept, so we don't have to fetch them again, if writing them fails.
+        self._fetched = None
+        # (fromBlock, toBlock, logs, blocks) of the unconfirmed blocks we
+        # synced, appended to log_store when following the head confirms them
+        self._unconfirmed_logs = None
 
     def _load_data_from_sync(self):
         """load the current sync status for this job from the sync table
@@ -301,20 +694,85 @@ class Synchronizer:
         """
         with self.conn.cursor() as cur:
             cur.execute(
-                """SELECT * FROM sync WHERE syncid=%s FOR UPDATE""", (self.syncid,)
+                f"""SELECT * FROM sync WHERE syncid=%s {self.storage.lock_rows}""",
+                (self.syncid,),
             )
             row = cur.fetchone()
             self.topic_index = topic_index_from_db(
-                self.conn, addresses=row["addresses"]
+                self.conn, addresses=row["addresses"], event_names=row["event_names"]
             )
             self.last_block_number = row["last_block_number"]
             self.last_confirmed_block_number = row["last_confirmed_block_number"]
             self.latest_block_hash = row["latest_block_hash"]
+            self.end_block = row["end_block"]
+            if (
+                self.unconfirmed_table
+                and self.last_block_number > self.last_confirmed_block_number
+            ):
+                self._check_unconfirmed_events(cur)
+
+    def _check_unconfirmed_events(self, cur):
+        """make sure the unconfirmed events table still holds our events
+
+        Postgres empties unlogged tables after a crash. The marker row in the
+        unlogged sync_unconfirmed table is lost together with our events, in
+        that case we have to sync the unconfirmed blocks again.
+        """
+        cur.execute("SELECT 1 FROM sync_unconfirmed WHERE syncid=%s", (self.syncid,))
+        if cur.fetchone() is None:
+            logger.warning(
+                "the unconfirmed events of %s are gone, syncing them again",
+                self.syncid,
+            )
+            # make sync_round resync the unconfirmed blocks
+            self.latest_block_hash = ""
+            self.head_window = None
 
-    def _sync_blocks(
+    def _insert_events(self, events, last_confirmed_block_number):
+        if not self.unconfirmed_table:
+            self.storage.insert_events(self.conn, events)
+            return
+        insert_events_split(self.conn, events, last_confirmed_block_number)
+        move_confirmed_events(
+            self.conn, self.topic_index.addresses, last_confirmed_block_number
+        )
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """INSERT INTO sync_unconfirmed (syncid) VALUES (%s)
+                   ON CONFLICT DO NOTHING""",
+                (self.syncid,),
+            )
+
+    def _fetch_events(
         self, fromBlock, toBlock, last_confirmed_block_number, latest_block_hash
     ):
-        events = get_events(self.web3, self.topic_index, fromBlock, toBlock)
+        """fetch and enrich the events in the given range
+
+        The events of the last call are kept until they are committed and reused
+        if we are asked for the same range again.
+        """
+        key = (
+            fromBlock,
+            toBlock,
+            tuple(self.topic_index.addresses),
+            # unconfirmed blocks may have changed if there is a new latest block
+            latest_block_hash if toBlock > last_confirmed_block_number else None,
+        )
+        if self._fetched is not None and self._fetched[0] == key:
+            logger.info("reusing events fetched for (%s -> %s)", fromBlock, toBlock)
+            return self._fetched[1]
+
+        logs = get_topic_index_logs(
+            self.web3,
+            self.topic_index,
+            fromBlock,
+            toBlock,
+            addresses_per_shard=self.addresses_per_shard,
+            max_workers=self.getlogs_workers,
+            retrier=self.rpc_retrier,
+            raw_client=self.raw_client,
+        )
+        events = self.topic_index.decode_logs(logs)
         blocknumbers = event_blocknumbers(events)
         logger.info(
             "got %s events in %s out of %s blocks (%s -> %s)",
@@ -324,11 +782,169 @@ class Synchronizer:
             fromBlock,
             toBlock,
         )
-        blocks = [self.web3.eth.getBlock(x) for x in blocknumbers]
+        if self.log_store is not None:
+            # the store needs the timestamps of all blocks with logs
+            blocknumbers |= {log["blockNumber"] for log in logs}
+        blocks = [self.rpc_retrier(self._get_block, x) for x in blocknumbers]
         enrich_events(events, blocks)
-        deleted_events = delete_events(self.conn, fromBlock, self.topic_index.addresses)
-        insert_events(self.conn, events)
-        self.update_graph_feed(events, deleted_events)
+        self._ensure_block_hash_agreement(
+            toBlock, latest_block_hash if toBlock == self.latest_block_number else None
+        )
+        if self.log_store is not None:
+            if fromBlock <= last_confirmed_block_number:
+                self.log_store.append(
+                    fromBlock,
+                    min(toBlock, last_confirmed_block_number),
+                    logs,
+                    blocks,
+                    addresses=self.topic_index.addresses,
+                )
+            first = max(fromBlock, last_confirmed_block_number + 1)
+            self._unconfirmed_logs = (
+                (
+                    first,
+                    toBlock,
+                    [log for log in logs if log["blockNumber"] >= first],
+                    blocks,
+                )
+                if first <= toBlock
+                else None
+            )
+        self._fetched = (key, events)
+        return events
+
+    def _append_confirmed_logs(self, fromBlock, toBlock):
+        """append the logs of the newly confirmed blocks to log_store
+
+        They are taken from the unconfirmed blocks we synced, if we have them,
+        or fetched again.
+        """
+        if self.log_store is None or fromBlock > toBlock:
+            return
+        kept = self._unconfirmed_logs
+        if kept is not None and kept[0] <= fromBlock and toBlock <= kept[1]:
+            logs, blocks = kept[2], kept[3]
+            self._unconfirmed_logs = (
+                toBlock + 1,
+                kept[1],
+                [log for log in logs if log["blockNumber"] > toBlock],
+                [block for block in blocks if block["number"] > toBlock],
+            )
+        else:
+            logs = get_topic_index_logs(
+                self.web3,
+                self.topic_index,
+                fromBlock,
+                toBlock,
+                addresses_per_shard=self.addresses_per_shard,
+                max_workers=self.getlogs_workers,
+                retrier=self.rpc_retrier,
+                raw_client=self.raw_client,
+            )
+            blocks = [
+                self.rpc_retrier(self._get_block, x)
+                for x in {log["blockNumber"] for log in logs}
+            ]
+        self.log_store.append(
+            fromBlock, toBlock, logs, blocks, addresses=self.topic_index.addresses
+        )
+
+    def _commit(self):
+        """commit the current transaction
+
+        The log store is flushed first, so it never lags behind the confirmed
+        blocks of the sync row, even if we crash right after the commit.
+        """
+        if self.log_store is not None:
+            self.log_store.flush()
+        self.conn.commit()
+
+    def _get_block(self, block_identifier):
+        """return the block with the given number or the 'latest' block
+
+        Only number, hash, parentHash, timestamp and logsBloom of the block are
+        used.
+        """
+        if self.raw_client is not None:
+            return self.raw_client.get_block_header(block_identifier)
+        return self.web3.eth.getBlock(block_identifier)
+
+    def _get_block_number(self):
+        if self.raw_client is not None:
+            return self.raw_client.block_number()
+        return self.web3.eth.blockNumber
+
+    def _sync_checkpoints(
+        self, fromBlock, toBlock, last_confirmed_block_number, latest_block_hash
+    ):
+        """sync the given range, committing confirmed blocks in checkpoints
+
+        Every checkpoint of blocks_per_checkpoint confirmed blocks is committed
+        and the sync row is advanced, so we don't have to sync them again if we
+        crash later in the round. The last part of the range, which may contain
+        unconfirmed blocks, is committed by sync_round.
+        """
+        checkpoint = fromBlock + self.blocks_per_checkpoint - 1
+        while checkpoint < toBlock and checkpoint <= last_confirmed_block_number:
+            self._sync_blocks(
+                fromBlock, checkpoint, checkpoint, latest_block_hash, checkpoint=True
+            )
+            self.db_breaker.call(self._commit)
+            self._fetched = None
+            logger.info("committed checkpoint at block %s", checkpoint)
+            # lock the sync row again
+            self.db_breaker.call(self._load_data_from_sync)
+            if self.last_confirmed_block_number != checkpoint:
+                raise RuntimeError(
+                    f"sync row for {self.syncid} has been changed by another job"
+                )
+            fromBlock = checkpoint + 1
+            checkpoint = fromBlock + self.blocks_per_checkpoint - 1
+        self._sync_blocks(
+            fromBlock, toBlock, last_confirmed_block_number, latest_block_hash
+        )
+
+    def _sync_blocks(
+        self,
+        fromBlock,
+        toBlock,
+        last_confirmed_block_number,
+        latest_block_hash,
+        checkpoint=False,
+    ):
+        events = self._fetch_events(
+            fromBlock, toBlock, last_confirmed_block_number, latest_block_hash
+        )
+        self.db_breaker.call(
+            self._write_events,
+            events,
+            fromBlock,
+            toBlock,
+            last_confirmed_block_number,
+            latest_block_hash,
+            checkpoint=checkpoint,
+        )
+
+    def _write_events(
+        self,
+        events,
+        fromBlock,
+        toBlock,
+        last_confirmed_block_number,
+        latest_block_hash,
+        checkpoint=False,
+    ):
+        # a checkpoint must leave the events behind it alone, they are
+        # replaced when the rest of the round is written
+        deleted_events = delete_events(
+            self.conn,
+            fromBlock,
+            self.topic_index.addresses,
+            toBlock=toBlock if checkpoint else self.end_block,
+        )
+        self._insert_events(events, last_confirmed_block_number)
+        if self.feed_graph:
+            self.update_graph_feed(events, deleted_events)
 
         with self.conn.cursor() as cur:
             cur.execute(
@@ -337,18 +953,99 @@ class Synchronizer:
                    WHERE syncid=%s""",
                 (toBlock, last_confirmed_block_number, latest_block_hash, self.syncid),
             )
+            self.storage.notify_sync(
+                cur, self.syncid, toBlock, last_confirmed_block_number
+            )
+            self._record_event_density(
+                cur, events, fromBlock, min(toBlock, last_confirmed_block_number)
+            )
+
+    def _record_event_density(self, cur, events, fromBlock, toBlock):
+        """record the statistics of the newly confirmed blocks"""
+        if fromBlock > toBlock:
+            return
+        stats = density.count_events(events, fromBlock, toBlock)
+        density.record_event_density(cur, self.syncid, stats)
+        if self.event_density is not None:
+            self.event_density.add(self.syncid, stats)
+
+    def _get_event_density(self):
+        if self.event_density is None:
+            with self.conn.cursor() as cur:
+                self.event_density = density.load_event_density(cur)
+        return self.event_density
+
+    def _ensure_block_hash_agreement(self, block_number, expected_hash=None):
+        """make sure all json-rpc endpoints agree on the hash of a block
+
+        This is only checked when syncing from multiple endpoints. It makes sure
+        we don't commit the results of endpoints seeing a different chain.
+        """
+        provider = self.web3.provider
+        if isinstance(provider, rpc.MultiEndpointProvider):
+            self.rpc_retrier(
+                provider.ensure_block_hash_agreement,
+                block_number,
+                expected_hash=expected_hash,
+            )
 
     def update_graph_feed(self, new_events, old_events):
+        """write the changed graph events into the graph feed outbox
+
+        The graph updates for these changes are computed and inserted into the
+        graph feed by feed_graph_from_outbox in a separate transaction, so
+        looking up the replacements of removed events doesn't slow down writing
+        the events.
+        """
         new_events = filter_events_for_graph(new_events)
         old_events = filter_events_for_graph(old_events)
 
         missing_events = [event for event in old_events if event not in new_events]
         added_events = [event for event in new_events if event not in old_events]
 
-        graph_updates = added_events + self.get_graph_update_for_missing_events(
-            missing_events
-        )
-        self.feed_graph_updates(graph_updates)
+        with self.conn.cursor() as cur:
+            for event in added_events:
+                insert_graph_feed_outbox(cur, self.syncid, event, removed=False)
+            for event in missing_events:
+                insert_graph_feed_outbox(cur, self.syncid, event, removed=True)
+
+    def feed_graph_from_outbox(self):
+        """compute the graph updates for the event changes in the outbox and
+        insert them into the graph feed
+
+        The outbox rows are processed in order and deleted in the same
+        transaction the graph updates are inserted in.
+        """
+        fed = 0
+        while True:
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    cur.execute(
+                        f"""SELECT * FROM graphfeed_outbox WHERE syncid=%s
+                            ORDER BY id LIMIT %s {self.storage.lock_rows}""",
+                        (self.syncid, self.graph_feed_batch_size),
+                    )
+                    rows = cur.fetchall()
+                    if not rows:
+                        break
+                    graph_updates = []
+                    for row in rows:
+                        event = build_event_from_row(row)
+                        if row["removed"]:
+                            graph_updates.append(
+                                self.find_replacing_graph_update_for_missing(event)
+                            )
+                        else:
+                            graph_updates.append(event)
+                    insert_graph_feed_updates(cur, graph_updates)
+                    cur.execute(
+                        """DELETE FROM graphfeed_outbox WHERE id IN %s""",
+                        (tuple(row["id"] for row in rows),),
+                    )
+            fed += len(rows)
+        if fed:
+            logger.info("fed %s graph updates", fed)
+        return fed
 
     def remove_finalized_events(self, events: Iterable[Event]):
         return [
@@ -376,6 +1073,7 @@ class Synchronizer:
         elif event.name in [BALANCE_UPDATE_EVENT_NAME, TRUSTLINE_UPDATE_EVENT_NAME]:
             previous_graph_update = self.find_previous_trustline_graph_update(event)
             if previous_graph_update is not None:
+                previous_graph_update.blocknumber = event.blocknumber
                 return previous_graph_update
             return null_replacing_graph_update(event)
 
@@ -395,7 +1093,7 @@ class Synchronizer:
               eventName "event",
               args,
               timestamp
-             FROM events
+             FROM all_events
         """
 
         query_order = """
@@ -410,31 +1108,35 @@ class Synchronizer:
             from_ = "_creditor"
             to = "_debtor"
 
-        query = sql.SQL(
-            query_select + "WHERE ((args->>{from_}=%s AND args->>{to}=%s) OR "
-            "(args->>{from_}=%s AND args->>{to}=%s)) "
+        # psycopg2 inlines the keys, so postgres can use the indexes on them
+        query = (
+            query_select + "WHERE ((args->>%s=%s AND args->>%s=%s) OR "
+            "(args->>%s=%s AND args->>%s=%s)) "
             "AND eventName=%s AND address=%s" + query_order
-        ).format(from_=sql.Literal(from_), to=sql.Literal(to))
+        )
         query_params = [
+            from_,
             event.args[from_],
+            to,
             event.args[to],
+            from_,
             event.args[to],
+            to,
             event.args[from_],
             event.name,
             event.address,
         ]
 
-        with self.conn as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, query_params)
-                rows = cur.fetchall()
-                assert (
-                    len(rows) <= 1
-                ), "Found multiple rows when querying database for single previous event"
-                if len(rows) == 1:
-                    return build_graph_update_from_row(rows[0])
-                else:
-                    return None
+        with self.conn.cursor() as cur:
+            cur.execute(query, query_params)
+            rows = cur.fetchall()
+            assert (
+                len(rows) <= 1
+            ), "Found multiple rows when querying database for single previous event"
+            if len(rows) == 1:
+                return build_graph_update_from_row(rows[0])
+            else:
+                return None
 
     def feed_graph_updates(
         self, graph_feed_updates: Iterable[Union[Event, GraphUpdate]]
@@ -444,7 +1146,7 @@ class Synchronizer:
 
     def _try_merge(self, cur):
         cur.execute(
-            """SELECT * FROM sync WHERE syncid in %s FOR UPDATE""",
+            f"""SELECT * FROM sync WHERE syncid in %s {self.storage.lock_rows}""",
             ((self.merge_with_syncid, self.syncid),),
         )
         rows = cur.fetchall()
@@ -457,6 +1159,12 @@ class Synchronizer:
 
         block_diff = dst["last_block_number"] - src["last_block_number"]
 
+        if src["event_names"] != dst["event_names"]:
+            logger.info(
+                "cannot merge runsync jobs, because they import different events"
+            )
+            return False
+
         if block_diff == 0:
             if dst["latest_block_hash"] != src["latest_block_hash"]:
                 logger.info(
@@ -474,6 +1182,15 @@ class Synchronizer:
                 (dst["addresses"] + src["addresses"], self.merge_with_syncid),
             )
             cur.execute("delete from sync where syncid=%s", (self.syncid,))
+            cur.execute(
+                """UPDATE graphfeed_outbox SET syncid=%s WHERE syncid=%s""",
+                (self.merge_with_syncid, self.syncid),
+            )
+            # the merged job continues onboarding our addresses
+            cur.execute(
+                """UPDATE sync_onboarding SET syncid=%s WHERE syncid=%s""",
+                (self.merge_with_syncid, self.syncid),
+            )
             return True
         elif block_diff < 0:
             logger.info(
@@ -495,25 +1212,43 @@ class Synchronizer:
                 return self._try_merge(cur)
 
     def sync_round(self):
-        self._load_data_from_sync()
-        latest_block = self.web3.eth.getBlock("latest")
+        start_time = time.monotonic()
+        self.db_breaker.call(self._load_data_from_sync)
+        latest_block = self.rpc_retrier(self._get_block, "latest")
         latest_block_hash = hexlify(latest_block["hash"])
         latest_block_number = latest_block["number"]
+        self.latest_block_number = latest_block_number
         fromBlock = self.last_confirmed_block_number + 1
-        toBlock = min(
-            latest_block_number,
-            self.last_confirmed_block_number + self.blocks_per_round,
-        )
+        toBlock = min(latest_block_number, self._plan_round(fromBlock))
+        if self.end_block is not None:
+            toBlock = min(toBlock, self.end_block)
         last_confirmed_block_number = max(
             min(toBlock, latest_block_number - self.required_confirmations), -1
         )
         if fromBlock <= toBlock and (
-            self.last_block_number != latest_block_number
+            self.last_block_number != toBlock
             or self.latest_block_hash != latest_block_hash
         ):
-            self._sync_blocks(
-                fromBlock, toBlock, last_confirmed_block_number, latest_block_hash
+            # syncing confirmed blocks must not hold up following the head
+            priority = (
+                rpc.PRIORITY_BACKFILL
+                if toBlock <= last_confirmed_block_number
+                else rpc.PRIORITY_CONFIRMATIONS
             )
+            try:
+                with rpc.request_priority(priority):
+                    self._sync_checkpoints(
+                        fromBlock,
+                        toBlock,
+                        last_confirmed_block_number,
+                        latest_block_hash,
+                    )
+            except rpc.BlockHashMismatch as e:
+                # rpc_retrier already backed off, the endpoints will most
+                # probably agree again in the next round
+                logger.warning("%s, will retry", e)
+                self.conn.rollback()
+                return False
             finished = False
         else:
             if self.last_fully_synced_block != toBlock:
@@ -521,24 +1256,455 @@ class Synchronizer:
                 logger.info("already synced up to latest block %s", toBlock)
             finished = True
 
-        self.conn.commit()
+        self.db_breaker.call(self._commit)
+        self._fetched = None
+        if not finished:
+            self._log_forecast(
+                fromBlock,
+                toBlock,
+                latest_block_number
+                if self.end_block is None
+                else min(latest_block_number, self.end_block),
+                time.monotonic() - start_time,
+            )
         return finished
 
+    def _plan_round(self, fromBlock):
+        """return the last block of the round starting at fromBlock
+
+        Far behind the head, rounds are sized by the event density statistics.
+        """
+        if self.latest_block_number - fromBlock < self.blocks_per_round:
+            return fromBlock + self.blocks_per_round - 1
+        return self.db_breaker.call(self._get_event_density).plan_round(
+            fromBlock, self.events_per_round, self.blocks_per_round
+        )
+
+    def _log_forecast(self, fromBlock, toBlock, head_block_number, seconds):
+        """log the expected time to reach head_block_number from the duration
+        of the last round"""
+        if self.event_density is None or toBlock >= head_block_number:
+            return
+        self.forecast.record(
+            self.event_density.cost(
+                fromBlock, toBlock, self.events_per_round, self.blocks_per_round
+            ),
+            seconds,
+        )
+        events, event_blocks = self.event_density.estimate(
+            toBlock + 1, head_block_number
+        )
+        eta = self.forecast.eta(
+            self.event_density.cost(
+                toBlock + 1,
+                head_block_number,
+                self.events_per_round,
+                self.blocks_per_round,
+            )
+        )
+        logger.info(
+            "%s blocks to go with about %.0f events in %.0f blocks, ETA %s",
+            head_block_number - toBlock,
+            events,
+            event_blocks,
+            eta,
+        )
+
+    def follow_head_round(self):
+        """import the events of new blocks extending the chain we synced
+
+        This only fetches the new blocks and writes their events, it does not
+        reload the sync data or touch the unconfirmed events we already
+        imported. Returns False, if the new blocks do not extend our chain and
+        a normal sync_round is needed.
+        """
+        with rpc.request_priority(rpc.PRIORITY_HEAD):
+            return self._follow_head_round()
+
+    def _follow_head_round(self):
+        if self.head_window is None or self.end_block is not None:
+            return False
+        head = self.head_window.head
+        latest_block_number = self.rpc_retrier(self._get_block_number)
+        if latest_block_number <= head.number:
+            return True
+        if latest_block_number - head.number > self.follow_head_max_blocks:
+            logger.info("%s new blocks, syncing", latest_block_number - head.number)
+            self.head_window = None
+            return False
+
+        seen_time = time.monotonic()
+        blocks = [
+            self.rpc_retrier(self._get_block, number)
+            for number in range(head.number + 1, latest_block_number + 1)
+        ]
+        headers = [
+            follow.BlockHeader(
+                block["number"], hexlify(block["hash"]), hexlify(block["parentHash"])
+            )
+            for block in blocks
+        ]
+        if not self.head_window.extends_head(headers):
+            logger.info("new blocks do not extend our chain, syncing")
+            self.head_window = None
+            return False
+        # eth_getLogs for the range of the new blocks, which may contain
+        # relevant logs, the block hashes of the logs are checked against the
+        # new headers by enrich_events
+        fromBlock, toBlock = self._get_logs_range(blocks)
+        if fromBlock is None:
+            logs = []
+        else:
+            logs = get_topic_index_logs(
+                self.web3,
+                self.topic_index,
+                fromBlock,
+                toBlock,
+                addresses_per_shard=self.addresses_per_shard,
+                max_workers=self.getlogs_workers,
+                retrier=self.rpc_retrier,
+                raw_client=self.raw_client,
+            )
+        events = self.topic_index.decode_logs(logs)
+        try:
+            enrich_events(events, blocks)
+        except RuntimeError:
+            logger.info("logs do not match the new blocks, syncing")
+            self.head_window = None
+            return False
+
+        last_confirmed_block_number = max(
+            self.last_confirmed_block_number,
+            latest_block_number - self.required_confirmations,
+        )
+        if self.log_store is not None:
+            kept = self._unconfirmed_logs
+            if kept is not None and kept[1] == head.number:
+                self._unconfirmed_logs = (
+                    kept[0],
+                    latest_block_number,
+                    kept[2] + logs,
+                    kept[3] + blocks,
+                )
+            else:
+                self._unconfirmed_logs = None
+            self._append_confirmed_logs(
+                self.last_confirmed_block_number + 1, last_confirmed_block_number
+            )
+        if not self.db_breaker.call(
+            self._write_head_events,
+            events,
+            head,
+            headers[-1],
+            last_confirmed_block_number,
+        ):
+            logger.info("sync row has been changed by another job, syncing")
+            self.head_window = None
+            return False
+
+        self.last_block_number = latest_block_number
+        self.last_confirmed_block_number = last_confirmed_block_number
+        self.latest_block_hash = headers[-1].hash
+        self.head_window.append(headers)
+        self.head_window.prune(last_confirmed_block_number)
+        latency = time.monotonic() - seen_time
+        self.head_latency.record(latency, num_blocks=len(headers))
+        logger.info(
+            "followed head to block %s with %s events in %.0f ms",
+            latest_block_number,
+            len(events),
+            latency * 1000,
+        )
+        return True
+
+    def _get_logs_range(self, blocks):
+        """return the range of the given consecutive blocks, for which we need
+        to fetch the logs, or (None, None) if there is none
+
+        Blocks at the start and the end of the range, whose logs bloom shows
+        they contain no relevant logs, are left out.
+        """
+        if not self.check_logs_bloom:
+            return blocks[0]["number"], blocks[-1]["number"]
+        if self._bloom_filter is None or self._bloom_filter[0] is not self.topic_index:
+            self._bloom_filter = (
+                self.topic_index,
+                follow.LogsBloomFilter(
+                    self.topic_index.addresses, self.topic_index.topics
+                ),
+            )
+        bloom_filter = self._bloom_filter[1]
+        matching = [
+            block["number"]
+            for block in blocks
+            if bloom_filter.may_contain(block.get("logsBloom"))
+        ]
+        if not matching:
+            self.bloom_stats.record(len(blocks), len(blocks))
+            return None, None
+        self.bloom_stats.record(
+            len(blocks), len(blocks) - (matching[-1] - matching[0] + 1)
+        )
+        return matching[0], matching[-1]
+
+    def _write_head_events(
+        self, events, head, new_head, last_confirmed_block_number
+    ) -> bool:
+        """write the events of new blocks on top of head and advance the sync row
+
+        The sync row is only updated, if it still points to head. Returns
+        False, if it does not, i.e. if another job changed it in the meantime.
+        """
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    """UPDATE sync
+                       SET last_block_number=%s, last_confirmed_block_number=%s, latest_block_hash=%s
+                       WHERE syncid=%s AND last_block_number=%s AND latest_block_hash=%s""",
+                    (
+                        new_head.number,
+                        last_confirmed_block_number,
+                        new_head.hash,
+                        self.syncid,
+                        head.number,
+                        head.hash,
+                    ),
+                )
+                if cur.rowcount != 1:
+                    self.conn.rollback()
+                    return False
+                self.storage.notify_sync(
+                    cur, self.syncid, new_head.number, last_confirmed_block_number
+                )
+            self._insert_events(events, last_confirmed_block_number)
+            if self.feed_graph:
+                self.update_graph_feed(events, [])
+            self._commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return True
+
+    def onboard_round(self) -> bool:
+        """sync the events of the onboarding addresses for one round
+
+        Onboarding addresses are synced in groups of addresses with the same
+        progress, starting with the group furthest behind, up to the last
+        confirmed block of the sync row. When they get there, they are added to
+        the addresses of the sync row and its unconfirmed blocks are synced
+        again. Returns True, if there are addresses left to onboard.
+
+        The events are fetched before the sync row is locked. If the progress
+        of the onboarding addresses changed in the meantime, they are dropped
+        and fetched again in the next round.
+        """
+        try:
+            with rpc.request_priority(rpc.PRIORITY_BACKFILL):
+                return self._onboard_round()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def _onboard_round(self) -> bool:
+        with self.conn.cursor() as cur:
+            if self.onboard_new_addresses:
+                new_addresses = find_new_addresses(cur)
+                if new_addresses:
+                    logger.info("onboarding %s new addresses", len(new_addresses))
+                    add_onboarding_addresses(self.conn, self.syncid, new_addresses)
+            row, progress, plan = self._plan_onboarding(cur, lock_rows="")
+        # don't keep the database locked while fetching the events
+        self.conn.commit()
+        if plan is None:
+            return False
+        addresses, fromBlock, toBlock, event_names = plan
+        if fromBlock <= toBlock:
+            events = self._fetch_onboarding_events(
+                addresses, fromBlock, toBlock, event_names
+            )
+
+        with self.conn.cursor() as cur:
+            row, progress, locked_plan = self._plan_onboarding(
+                cur, lock_rows=self.storage.lock_rows
+            )
+            if locked_plan != plan:
+                logger.info("onboarding progress has changed, fetching again")
+                self.conn.rollback()
+                return True
+            if fromBlock <= toBlock:
+                self._write_onboarding_events(addresses, fromBlock, toBlock, events)
+                self.storage.notify_sync(
+                    cur,
+                    self.syncid,
+                    row["last_block_number"],
+                    row["last_confirmed_block_number"],
+                    rewritten=True,
+                )
+            if toBlock < row["last_confirmed_block_number"]:
+                more = True
+            else:
+                more = self._join_onboarded_addresses(cur, row, addresses, progress)
+        self.conn.commit()
+        return more
+
+    def _plan_onboarding(self, cur, lock_rows):
+        """return the sync row, the progress of the onboarding addresses and
+        the plan for the next round
+
+        The plan is a tuple of the addresses furthest behind and the range of
+        blocks to sync for them, which is empty if they caught up, and the
+        event names of the sync row. It is None if there are no onboarding
+        addresses.
+        """
+        cur.execute(
+            f"""SELECT * FROM sync WHERE syncid=%s {lock_rows}""",
+            (self.syncid,),
+        )
+        row = cur.fetchone()
+        cur.execute(
+            """SELECT address, last_block_number FROM sync_onboarding
+               WHERE syncid=%s""",
+            (self.syncid,),
+        )
+        progress = {r["address"]: r["last_block_number"] for r in cur.fetchall()}
+        if not progress:
+            return row, progress, None
+        last_confirmed_block_number = row["last_confirmed_block_number"]
+        last_block_number = min(progress.values())
+        addresses = sorted(a for a, n in progress.items() if n == last_block_number)
+        # stop at the progress of the next group, so the groups merge
+        toBlock = min(
+            [last_confirmed_block_number, last_block_number + self.blocks_per_round]
+            + [n for n in progress.values() if n > last_block_number]
+        )
+        return (
+            row,
+            progress,
+            (
+                tuple(addresses),
+                last_block_number + 1,
+                max(toBlock, last_block_number),
+                row["event_names"],
+            ),
+        )
+
+    def _join_onboarded_addresses(self, cur, row, addresses, progress) -> bool:
+        """add the addresses, which caught up with the sync row, to its
+        addresses"""
+        cur.execute(
+            """UPDATE sync SET addresses=%s, latest_block_hash=''
+               WHERE syncid=%s""",
+            (row["addresses"] + list(addresses), self.syncid),
+        )
+        cur.execute(
+            """DELETE FROM sync_onboarding WHERE address IN %s""", (tuple(addresses),)
+        )
+        logger.info("%s onboarded addresses joined %s", len(addresses), self.syncid)
+        # sync the unconfirmed blocks for all addresses
+        self.head_window = None
+        return len(addresses) < len(progress)
+
+    def _fetch_onboarding_events(self, addresses, fromBlock, toBlock, event_names):
+        """fetch the events of the onboarding addresses in the confirmed range"""
+        topic_index = topic_index_from_db(
+            self.conn, addresses=addresses, event_names=event_names
+        )
+        # topic_index_from_db may have started a transaction
+        self.conn.commit()
+        events = get_events(
+            self.web3,
+            topic_index,
+            fromBlock,
+            toBlock,
+            addresses_per_shard=self.addresses_per_shard,
+            max_workers=self.getlogs_workers,
+            retrier=self.rpc_retrier,
+            raw_client=self.raw_client,
+        )
+        blocks = [
+            self.rpc_retrier(self._get_block, x) for x in event_blocknumbers(events)
+        ]
+        enrich_events(events, blocks)
+        logger.info(
+            "onboarding %s addresses: got %s events (%s -> %s)",
+            len(addresses),
+            len(events),
+            fromBlock,
+            toBlock,
+        )
+        return events
+
+    def _write_onboarding_events(self, addresses, fromBlock, toBlock, events):
+        deleted_events = delete_events(self.conn, fromBlock, addresses, toBlock)
+        self.storage.insert_events(self.conn, events)
+        if self.feed_graph:
+            self.update_graph_feed(events, deleted_events)
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """UPDATE sync_onboarding SET last_block_number=%s
+                   WHERE syncid=%s AND address IN %s""",
+                (toBlock, self.syncid, tuple(addresses)),
+            )
+
     def sync_loop(self, waittime):
         while 1:
-            self.sync_until_current()
+            if not self.follow_head or not self.follow_head_round():
+                self.sync_until_current()
+            self.db_breaker.call(self.feed_graph_from_outbox)
             if self.merge_with_syncid and self.try_merge():
                 return
+            # keep onboarding without waiting, while there is work left
+            if self.onboard_round():
+                continue
 
             time.sleep(waittime)
 
     def sync_until_current(self):
         while not self.sync_round():
             pass
+        if self.follow_head:
+            self.head_window = follow.UnconfirmedWindow(
+                self.last_block_number, self.latest_block_hash
+            )
+
+
+sqlite_option = click.option(
+    "--sqlite",
+    "sqlite_path",
+    help="use the SQLite database in this file instead of postgres",
+    type=click.Path(dir_okay=False),
+    default=None,
+)
 
 
 @click.command()
-@click.option("--jsonrpc", help="jsonrpc URL to use", default="http://127.0.0.1:8545")
+@click.option(
+    "--jsonrpc",
+    help="jsonrpc URL to use, can be given multiple times to spread the requests "
+    "over multiple endpoints",
+    default=["http://127.0.0.1:8545"],
+    multiple=True,
+)
+@click.option(
+    "--hedge-delay",
+    help="time in milliseconds after which a duplicate request is sent to another "
+    "endpoint for slow requests, only used with multiple jsonrpc URLs",
+    default=int(rpc.DEFAULT_HEDGE_DELAY * 1000),
+)
+@click.option(
+    "--rpc-rate",
+    help="maximum number of requests per second to every jsonrpc URL, requests "
+    "for new blocks are preferred over requests for older blocks",
+    type=float,
+    default=None,
+)
+@click.option(
+    "--rpc-burst",
+    help="number of requests, which may be sent at once before --rpc-rate applies, "
+    "defaults to the rate",
+    type=float,
+    default=None,
+)
 @click.option(
     "--required-confirmations",
     help="number of confirmations until we consider a block final",
@@ -554,34 +1720,174 @@ class Synchronizer:
 )
 @click.option("--syncid", help="syncid to use", default="default")
 @click.option("--merge-with-syncid", help="syncid to merge with")
+@click.option(
+    "--event-name",
+    "event_names",
+    help="only import events with this name, can be given multiple times. "
+    "Only used when the sync entry for syncid is created.",
+    multiple=True,
+)
+@click.option(
+    "--addresses-per-request",
+    help="split the addresses into shards of this size, fetching the logs of "
+    "each shard with a separate eth_getLogs request",
+    type=int,
+    default=None,
+)
+@click.option(
+    "--getlogs-workers",
+    help="number of eth_getLogs requests to run concurrently",
+    default=DEFAULT_GETLOGS_WORKERS,
+)
+@click.option(
+    "--follow-head",
+    help="when caught up, only import the events of new blocks extending the "
+    "synced chain instead of resyncing all unconfirmed blocks",
+    is_flag=True,
+)
+@click.option(
+    "--unconfirmed-table",
+    help="keep the events of unconfirmed blocks in the unlogged "
+    "events_unconfirmed table and only move them into the events table, when "
+    "they are confirmed. Read the all_events view to see both.",
+    is_flag=True,
+)
+@click.option(
+    "--onboard-new-addresses",
+    help="sync the events of contracts imported with `ethindex importabi` "
+    "while running and add them to this sync job, once they caught up",
+    is_flag=True,
+)
+@click.option(
+    "--log-dir",
+    help="append the raw logs of confirmed blocks to the log store in this "
+    "directory, see `ethindex reproject`",
+    type=click.Path(exists=True, file_okay=False, writable=True),
+    default=None,
+)
+@sqlite_option
 def runsync(
-    jsonrpc, waittime, startblock, required_confirmations, syncid, merge_with_syncid
+    jsonrpc,
+    hedge_delay,
+    rpc_rate,
+    rpc_burst,
+    waittime,
+    startblock,
+    required_confirmations,
+    syncid,
+    merge_with_syncid,
+    event_names,
+    addresses_per_request,
+    getlogs_workers,
+    follow_head,
+    unconfirmed_table,
+    onboard_new_addresses,
+    log_dir,
+    sqlite_path,
 ):
     logging.basicConfig(level=logging.INFO)
     logger.info("version %s starting", util.get_version())
 
-    # we like to survive a postgresql restart, so we need to catch errors here,
-    # since we must create a new connection in that case.
+    web3 = rpc.make_web3(
+        list(jsonrpc),
+        hedge_delay=hedge_delay * 0.001,
+        requests_per_second=rpc_rate,
+        burst=rpc_burst,
+    )
+    synchronizer = None
+    conn = None
+    backoff = retry.Backoff()
+    # we like to survive a postgresql restart or a flaky json-rpc endpoint, so
+    # we need to catch errors here. The synchronizer is kept, so events it
+    # already fetched are not lost. The database connection is only replaced,
+    # if it is dead.
     while 1:
         try:
-            web3 = Web3(Web3.HTTPProvider(jsonrpc, request_kwargs={"timeout": 60}))
-            with connect("") as conn:
-                ensure_sync_entry(conn, syncid)
-                s = Synchronizer(
-                    conn,
-                    web3,
-                    syncid,
-                    required_confirmations=required_confirmations,
-                    merge_with_syncid=merge_with_syncid,
-                )
-                s.sync_loop(waittime * 0.001)
-                break
+            if conn is None or conn.closed:
+                conn = connect_storage(sqlite_path)
+                if synchronizer is None:
+                    ensure_sync_entry(
+                        conn, syncid, event_names=list(event_names) or None
+                    )
+                    conn.commit()
+                    synchronizer = Synchronizer(
+                        conn,
+                        web3,
+                        syncid,
+                        required_confirmations=required_confirmations,
+                        merge_with_syncid=merge_with_syncid,
+                        addresses_per_shard=addresses_per_request,
+                        getlogs_workers=getlogs_workers,
+                        follow_head=follow_head,
+                        log_store=(
+                            logstore.LogStore(log_dir) if log_dir is not None else None
+                        ),
+                        unconfirmed_table=unconfirmed_table,
+                        onboard_new_addresses=onboard_new_addresses,
+                    )
+                else:
+                    synchronizer.conn = conn
+            synchronizer.sync_loop(waittime * 0.001)
+            break
         except Exception:
+            delay = backoff.next_delay()
             logger.error(
-                "An error occured in runsync. Will restart runsync in 10 seconds",
+                "An error occured in runsync. Will retry in %.1f seconds",
+                delay,
                 exc_info=sys.exc_info(),
             )
-            time.sleep(10)
+            rollback_if_alive(conn)
+            if synchronizer is not None:
+                # don't follow the head without resyncing, our view of the
+                # database may be outdated, e.g. postgres empties unlogged
+                # tables when it crashes
+                synchronizer.head_window = None
+                # the statistics recorded in memory may have been rolled back
+                synchronizer.event_density = None
+            time.sleep(delay)
+
+
+def rollback_if_alive(conn):
+    """roll back the current transaction, close the connection if that fails"""
+    if conn is None or conn.closed:
+        return
+    try:
+        conn.rollback()
+    except (psycopg2.Error, sqlite.Error):
+        logger.warning("could not roll back, closing the database connection")
+        conn.close()
+
+
+def store_abis(cur, a2abi) -> None:
+    """store a contract address to ABI mapping in the database
+
+    ABIs are stored content-addressed: abi_contents holds every distinct ABI
+    once, contract_abis maps the contract addresses to the ABI hashes.
+    """
+    hash_by_abi_id = {}
+    for contract_address, abi in a2abi.items():
+        if id(abi) not in hash_by_abi_id:
+            abi_hash = logdecode.abi_hash(abi)
+            hash_by_abi_id[id(abi)] = abi_hash
+            cur.execute(
+                """INSERT INTO abi_contents (abi_hash, abi)
+                   VALUES (%s, %s)
+                   ON CONFLICT(abi_hash) DO NOTHING
+                """,
+                (abi_hash, json.dumps(abi)),
+            )
+        cur.execute(
+            """INSERT INTO contract_abis (contract_address, abi_hash)
+               VALUES (%s, %s)
+               ON CONFLICT(contract_address) DO UPDATE SET abi_hash = EXCLUDED.abi_hash
+            """,
+            (contract_address, hash_by_abi_id[id(abi)]),
+        )
+    # remove ABIs no longer used by any contract
+    cur.execute(
+        """DELETE FROM abi_contents
+           WHERE abi_hash NOT IN (SELECT abi_hash FROM contract_abis)"""
+    )
 
 
 def do_importabi(conn, addresses, contracts=None):
@@ -596,14 +1902,7 @@ def do_importabi(conn, addresses, contracts=None):
     logger.info("importing %s abis", len(a2abi))
     with conn:
         with conn.cursor() as cur:
-            for contract_address, abi in a2abi.items():
-                cur.execute(
-                    """INSERT INTO abis (contract_address, abi)
-                       VALUES (%s, %s)
-                       ON CONFLICT(contract_address) DO UPDATE SET abi = EXCLUDED.abi
-                    """,
-                    (contract_address, json.dumps(abi)),
-                )
+            store_abis(cur, a2abi)
 
 
 @click.command()
@@ -621,16 +1920,28 @@ def do_importabi(conn, addresses, contracts=None):
     show_default=True,
     type=click.Path(exists=True, dir_okay=False),
 )
-def importabi(addresses, contracts):
+@sqlite_option
+def importabi(addresses, contracts, sqlite_path):
     logging.basicConfig(level=logging.INFO)
     logger.info("version %s starting", util.get_version())
-    do_importabi(connect(""), addresses, contracts)
+    do_importabi(connect_storage(sqlite_path), addresses, contracts)
 
 
 def do_createtables(conn):
     with conn:
         with conn.cursor() as cur:
-            for table_name in ("events", "sync", "abis", "graphfeed"):
+            for table_name in (
+                "events",
+                "sync",
+                "abi_contents",
+                "contract_abis",
+                "graphfeed",
+                "graphfeed_outbox",
+                UNCONFIRMED_EVENTS_TABLE,
+                "sync_unconfirmed",
+                "event_density",
+                "sync_onboarding",
+            ):
                 warn_if_table_exists(cur, table_name)
             cur.execute(
                 """
@@ -647,26 +1958,124 @@ def do_createtables(conn):
                     PRIMARY KEY(transactionHash, address, blockHash, transactionIndex, logIndex)
                   );
 
+                  -- indexes for the queries in ethindex.query, the results
+                  -- are ordered by (blockNumber, logIndex)
+                  CREATE INDEX IF NOT EXISTS events_block_idx
+                    ON events (blockNumber, logIndex);
+                  CREATE INDEX IF NOT EXISTS events_address_idx
+                    ON events (address, blockNumber, logIndex);
+                  CREATE INDEX IF NOT EXISTS events_eventname_idx
+                    ON events (eventName, blockNumber, logIndex);
+                  CREATE INDEX IF NOT EXISTS events_timestamp_idx
+                    ON events (timestamp);
+                  CREATE INDEX IF NOT EXISTS events_from_idx
+                    ON events ((args->>'_from'), blockNumber, logIndex);
+                  CREATE INDEX IF NOT EXISTS events_to_idx
+                    ON events ((args->>'_to'), blockNumber, logIndex);
+                  CREATE INDEX IF NOT EXISTS events_creditor_idx
+                    ON events ((args->>'_creditor'), blockNumber, logIndex);
+                  CREATE INDEX IF NOT EXISTS events_debtor_idx
+                    ON events ((args->>'_debtor'), blockNumber, logIndex);
+
                   CREATE TABLE IF NOT EXISTS sync (
                     syncid TEXT NOT NULL PRIMARY KEY,
                     last_block_number INTEGER NOT NULL,
                     addresses TEXT[] NOT NULL,
                     last_confirmed_block_number INTEGER NOT NULL,
-                    latest_block_hash TEXT NOT NULL
+                    latest_block_hash TEXT NOT NULL,
+                    event_names TEXT[],
+                    end_block INTEGER
                   );
 
-                  CREATE TABLE IF NOT EXISTS abis (
-                    contract_address TEXT NOT NULL PRIMARY KEY,
+                  ALTER TABLE sync ADD COLUMN IF NOT EXISTS event_names TEXT[];
+                  ALTER TABLE sync ADD COLUMN IF NOT EXISTS end_block INTEGER;
+
+                  CREATE TABLE IF NOT EXISTS abi_contents (
+                    abi_hash TEXT NOT NULL PRIMARY KEY,
                     abi JSONB NOT NULL
                   );
 
+                  CREATE TABLE IF NOT EXISTS contract_abis (
+                    contract_address TEXT NOT NULL PRIMARY KEY,
+                    abi_hash TEXT NOT NULL REFERENCES abi_contents(abi_hash)
+                  );
+
                   CREATE TABLE IF NOT EXISTS graphfeed (
                     address TEXT NOT NULL,
                     eventName TEXT NOT NULL,
                     args JSONB,
                     timestamp INTEGER NOT NULL,
-                    id SERIAL
+                    id SERIAL,
+                    blockNumber INTEGER
+                  );
+
+                  ALTER TABLE graphfeed ADD COLUMN IF NOT EXISTS blockNumber INTEGER;
+                  CREATE INDEX IF NOT EXISTS graphfeed_id_idx ON graphfeed (id);
+
+                  CREATE TABLE IF NOT EXISTS graphfeed_outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    syncid TEXT NOT NULL,
+                    removed BOOLEAN NOT NULL,
+                    transactionHash TEXT NOT NULL,
+                    blockNumber INTEGER NOT NULL,
+                    address TEXT NOT NULL,
+                    eventName TEXT NOT NULL,
+                    args JSONB,
+                    blockHash TEXT NOT NULL,
+                    transactionIndex INTEGER NOT NULL,
+                    logIndex INTEGER NOT NULL,
+                    timestamp INTEGER NOT NULL
+                  );
+
+                  CREATE INDEX IF NOT EXISTS graphfeed_outbox_syncid_idx
+                    ON graphfeed_outbox (syncid, id);
+
+                  -- only used with runsync --unconfirmed-table, unlogged
+                  -- tables are not written to the WAL, but emptied after a
+                  -- crash
+                  CREATE UNLOGGED TABLE IF NOT EXISTS events_unconfirmed (
+                    LIKE events INCLUDING DEFAULTS
+                  );
+                  CREATE INDEX IF NOT EXISTS events_unconfirmed_block_idx
+                    ON events_unconfirmed (blockNumber, logIndex);
+                  CREATE INDEX IF NOT EXISTS events_unconfirmed_address_idx
+                    ON events_unconfirmed (address, blockNumber);
+
+                  CREATE UNLOGGED TABLE IF NOT EXISTS sync_unconfirmed (
+                    syncid TEXT NOT NULL PRIMARY KEY
+                  );
+
+                  -- addresses synced separately by a sync job, until they
+                  -- catch up with it
+                  CREATE TABLE IF NOT EXISTS sync_onboarding (
+                    address TEXT NOT NULL PRIMARY KEY,
+                    syncid TEXT NOT NULL,
+                    last_block_number INTEGER NOT NULL
                   );
+
+                  -- statistics of the events per bucket of blocks, see
+                  -- ethindex.density
+                  CREATE TABLE IF NOT EXISTS event_density (
+                    syncid TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    blocks INTEGER NOT NULL,
+                    events INTEGER NOT NULL,
+                    event_blocks INTEGER NOT NULL,
+                    PRIMARY KEY(syncid, bucket)
+                  );
+
+                  CREATE OR REPLACE VIEW all_events AS
+                    SELECT * FROM events
+                    UNION ALL
+                    SELECT * FROM events_unconfirmed;
+                  """
+            )
+            migrate_abis_table(cur)
+            cur.execute(
+                """
+                  CREATE OR REPLACE VIEW abis AS
+                    SELECT contract_address, abi
+                    FROM contract_abis JOIN abi_contents USING (abi_hash);
                   """
             )
 
@@ -685,19 +2094,65 @@ def warn_if_table_exists(cur, table_name):
         )
 
 
+def get_abis_table_type(cur):
+    """return the type of the abis relation, i.e. 'BASE TABLE', 'VIEW' or None"""
+    cur.execute(
+        """SELECT table_type FROM information_schema.tables
+           WHERE table_schema = current_schema() AND table_name = 'abis'"""
+    )
+    row = cur.fetchone()
+    return row["table_type"] if row else None
+
+
+def migrate_abis_table(cur):
+    """migrate the abis table of older versions to content-addressed storage
+
+    Older versions stored the full ABI for every contract address in the abis
+    table. abis is now a view on the abi_contents and contract_abis tables.
+    """
+    if get_abis_table_type(cur) != "BASE TABLE":
+        return
+    cur.execute("SELECT contract_address, abi FROM abis")
+    a2abi = {r["contract_address"]: r["abi"] for r in cur.fetchall()}
+    logger.info("migrating %s abis to content-addressed storage", len(a2abi))
+    store_abis(cur, a2abi)
+    cur.execute("DROP TABLE abis")
+
+
 @click.command()
-def createtables():
+@sqlite_option
+def createtables(sqlite_path):
     logging.basicConfig(level=logging.INFO)
     logger.info("version %s starting", util.get_version())
     logger.info("creating tables")
-    do_createtables(connect(""))
+    conn = connect_storage(sqlite_path)
+    get_storage(conn).create_tables(conn)
 
 
 def do_droptables(conn, force):
     with conn:
         with conn.cursor() as cur:
-            for table in ["events", "sync", "abis", "graphfeed"]:
-                stmt = "DROP TABLE IF EXISTS {}".format(table)
+            if get_abis_table_type(cur) == "BASE TABLE":
+                stmts = ["DROP TABLE IF EXISTS abis"]
+            else:
+                stmts = ["DROP VIEW IF EXISTS abis"]
+            stmts.append("DROP VIEW IF EXISTS all_events")
+            stmts += [
+                "DROP TABLE IF EXISTS {}".format(table)
+                for table in [
+                    "events",
+                    "sync",
+                    "contract_abis",
+                    "abi_contents",
+                    "graphfeed",
+                    "graphfeed_outbox",
+                    UNCONFIRMED_EVENTS_TABLE,
+                    "sync_unconfirmed",
+                    "event_density",
+                    "sync_onboarding",
+                ]
+            ]
+            for stmt in stmts:
                 logger.info("executing %r", stmt)
                 if force:
                     cur.execute(stmt)
@@ -705,13 +2160,15 @@ def do_droptables(conn, force):
 
 @click.command()
 @click.option("--force", help="really delete the tables", is_flag=True)
-def droptables(force):
+@sqlite_option
+def droptables(force, sqlite_path):
     """drop database tables"""
     logging.basicConfig(level=logging.INFO)
     logger.info("version %s starting", util.get_version())
     if not force:
         logger.warn("dry-run, please specify --force to really delete the tables")
 
-    do_droptables(connect(""), force)
+    conn = connect_storage(sqlite_path)
+    get_storage(conn).drop_tables(conn, force)
 
     sys.exit(0 if force else 1)  # just in case we forget to add --force
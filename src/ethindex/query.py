@@ -0,0 +1,198 @@
+"""query the events table
+
+Results are ordered by (blockNumber, logIndex) and paginated with keyset
+pagination: every page returns a cursor pointing after its last event, which
+is passed to get the next page. Unlike OFFSET, fetching a page doesn't need to
+skip over all events of the previous pages. `ethindex createtables` creates the
+indexes needed for the filters supported here. Events are read from the
+all_events view, so the events of unconfirmed blocks kept in a separate table
+by `ethindex runsync --unconfirmed-table` are found as well.
+"""
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+import attr
+import click
+import eth_utils
+from psycopg2 import sql
+
+from ethindex import logdecode, pgimport
+
+# event arguments holding the address of a user
+USER_ADDRESS_ARGS = ("_from", "_to", "_creditor", "_debtor")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10000
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class EventQuery:
+    """filters for events, None means don't filter"""
+
+    addresses: Optional[List[str]] = None
+    event_names: Optional[List[str]] = None
+    user_address: Optional[str] = None
+    from_block: Optional[int] = None
+    to_block: Optional[int] = None
+    from_timestamp: Optional[int] = None
+    to_timestamp: Optional[int] = None
+
+
+@attr.s(auto_attribs=True)
+class Page:
+    events: List[Dict[str, Any]]
+    # cursor for the next page, None if this is the last page
+    next_cursor: Optional[str]
+
+
+def encode_cursor(row) -> str:
+    return "{}:{}".format(row["blocknumber"], row["logindex"])
+
+
+def decode_cursor(cursor):
+    try:
+        blocknumber, logindex = cursor.split(":")
+        return int(blocknumber), int(logindex)
+    except ValueError:
+        raise ValueError(f"invalid cursor {cursor!r}")
+
+
+def normalize_address(address):
+    """addresses are stored checksummed"""
+    if eth_utils.is_address(address):
+        return logdecode.to_checksum_address(address)
+    return address
+
+
+def build_conditions(query: EventQuery, cursor=None):
+    conditions = []
+    params: List[Any] = []
+    if query.addresses is not None:
+        conditions.append(sql.SQL("address IN %s"))
+        params.append(tuple(normalize_address(a) for a in query.addresses))
+    if query.event_names is not None:
+        conditions.append(sql.SQL("eventName IN %s"))
+        params.append(tuple(query.event_names))
+    if query.user_address is not None:
+        user_address = normalize_address(query.user_address)
+        conditions.append(
+            sql.SQL("({})").format(
+                sql.SQL(" OR ").join(
+                    sql.SQL("args->>{}=%s").format(sql.Literal(arg))
+                    for arg in USER_ADDRESS_ARGS
+                )
+            )
+        )
+        params.extend([user_address] * len(USER_ADDRESS_ARGS))
+    if query.from_block is not None:
+        conditions.append(sql.SQL("blockNumber>=%s"))
+        params.append(query.from_block)
+    if query.to_block is not None:
+        conditions.append(sql.SQL("blockNumber<=%s"))
+        params.append(query.to_block)
+    if query.from_timestamp is not None:
+        conditions.append(sql.SQL("timestamp>=%s"))
+        params.append(query.from_timestamp)
+    if query.to_timestamp is not None:
+        conditions.append(sql.SQL("timestamp<=%s"))
+        params.append(query.to_timestamp)
+    if cursor is not None:
+        conditions.append(sql.SQL("(blockNumber, logIndex)>(%s, %s)"))
+        params.extend(decode_cursor(cursor))
+    return conditions, params
+
+
+def query_events(conn, query: EventQuery, limit=DEFAULT_PAGE_SIZE, cursor=None) -> Page:
+    """return a page of at most limit events matching query
+
+    cursor is the next_cursor of the previous page."""
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    conditions, params = build_conditions(query, cursor=cursor)
+    where = (
+        sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions)
+        if conditions
+        else sql.SQL("")
+    )
+    statement = sql.SQL(
+        """SELECT * FROM all_events {}
+           ORDER BY blockNumber, logIndex
+           LIMIT %s"""
+    ).format(where)
+    with conn.cursor() as cur:
+        # fetch one more to know whether there is a next page
+        cur.execute(statement, params + [limit + 1])
+        rows = cur.fetchall()
+    events = rows[:limit]
+    next_cursor = encode_cursor(events[-1]) if len(rows) > limit else None
+    return Page(events=events, next_cursor=next_cursor)
+
+
+def iterate_events(
+    conn, query: EventQuery, page_size=DEFAULT_PAGE_SIZE
+) -> Iterator[Dict[str, Any]]:
+    """iterate over all events matching query, fetching them page by page"""
+    cursor = None
+    while True:
+        page = query_events(conn, query, limit=page_size, cursor=cursor)
+        yield from page.events
+        if page.next_cursor is None:
+            return
+        cursor = page.next_cursor
+
+
+@click.command()
+@click.option(
+    "--address",
+    "addresses",
+    help="address of the contract, can be given multiple times",
+    multiple=True,
+)
+@click.option(
+    "--event-name",
+    "event_names",
+    help="name of the event, can be given multiple times",
+    multiple=True,
+)
+@click.option("--user", help="address of a user sending or receiving")
+@click.option("--from-block", type=int, default=None)
+@click.option("--to-block", type=int, default=None)
+@click.option("--from-timestamp", type=int, default=None)
+@click.option("--to-timestamp", type=int, default=None)
+@click.option(
+    "--limit",
+    help="maximum number of events to print",
+    default=DEFAULT_PAGE_SIZE,
+    show_default=True,
+)
+@click.option("--cursor", help="cursor printed by the previous query")
+def query(
+    addresses,
+    event_names,
+    user,
+    from_block,
+    to_block,
+    from_timestamp,
+    to_timestamp,
+    limit,
+    cursor,
+):
+    """print events as json lines"""
+    event_query = EventQuery(
+        addresses=list(addresses) or None,
+        event_names=list(event_names) or None,
+        user_address=user,
+        from_block=from_block,
+        to_block=to_block,
+        from_timestamp=from_timestamp,
+        to_timestamp=to_timestamp,
+    )
+    try:
+        page = query_events(
+            pgimport.connect(""), event_query, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    for event in page.events:
+        click.echo(json.dumps(event))
+    if page.next_cursor is not None:
+        click.echo(f"next cursor: {page.next_cursor}", err=True)
@@ -0,0 +1,88 @@
+"""reimport events from the log store
+
+When the way events are decoded or imported changes, the events of already
+synced blocks can be decoded again from the logs written by `ethindex runsync
+--log-dir`, without fetching them from the node. Only logs fetched by the sync
+job are in the store, see ethindex.logstore. The events of addresses, which a
+segment does not cover, e.g. because they were onboarded later, are left alone.
+"""
+import logging
+
+import click
+
+from ethindex import logstore, pgimport, serialize, util
+
+logger = logging.getLogger(__name__)
+
+
+def reproject_events(
+    conn, store: logstore.LogStore, syncid, from_block, to_block
+) -> int:
+    """replace the events of syncid in the block range with the events decoded
+    from the store with the current ABIs, return the number of events
+
+    Only the events of the addresses covered by the segments are replaced. The
+    graph feed is not touched.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("""SELECT * FROM sync WHERE syncid=%s FOR UPDATE""", (syncid,))
+            row = cur.fetchone()
+            if row is None:
+                raise RuntimeError(f"no sync row for {syncid}")
+            if to_block > row["last_confirmed_block_number"]:
+                raise RuntimeError(
+                    f"block {to_block} is not confirmed for {syncid} yet"
+                )
+            missing = store.missing_ranges(from_block, to_block)
+            if missing:
+                raise RuntimeError(f"the log store is missing the blocks {missing}")
+            topic_index = pgimport.topic_index_from_db(
+                conn, addresses=row["addresses"], event_names=row["event_names"]
+            )
+            count = 0
+            for segment in store.iterate_segments(from_block, to_block):
+                addresses = set(segment.addresses) & set(topic_index.addresses)
+                if not addresses:
+                    continue
+                first = max(from_block, segment.first_block)
+                last = min(to_block, segment.last_block)
+                cur.execute(
+                    """DELETE FROM events
+                       WHERE blockNumber>=%s AND blockNumber<=%s AND address IN %s""",
+                    (first, last, tuple(addresses)),
+                )
+                count += serialize.copy_events(
+                    cur,
+                    logstore.iterate_events(
+                        segment.iterate_logs(first, last), topic_index
+                    ),
+                )
+            pgimport.notify_sync(
+                cur,
+                syncid,
+                row["last_block_number"],
+                row["last_confirmed_block_number"],
+                rewritten=True,
+            )
+    return count
+
+
+@click.command()
+@click.option(
+    "--log-dir",
+    help="directory of the log store written by `ethindex runsync --log-dir`",
+    required=True,
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option("--syncid", help="syncid to use", default="default")
+@click.option("--from-block", type=int, required=True)
+@click.option("--to-block", type=int, required=True)
+def reproject(log_dir, syncid, from_block, to_block):
+    """reimport the events of a block range from the log store"""
+    logging.basicConfig(level=logging.INFO)
+    logger.info("version %s starting", util.get_version())
+    count = reproject_events(
+        pgimport.connect(""), logstore.LogStore(log_dir), syncid, from_block, to_block
+    )
+    logger.info("imported %s events of blocks %s -> %s", count, from_block, to_block)
@@ -0,0 +1,180 @@
+"""retry operations with jittered exponential backoff
+
+A Retrier calls an operation and retries it on transient errors. A
+CircuitBreaker stops calling an operation, which failed too often, so we don't
+hammer an endpoint or database that is down.
+"""
+
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """raised instead of calling an operation while the circuit breaker is open"""
+
+
+def jittered_delay(attempt, base_delay, max_delay):
+    """return the delay before retrying for the given attempt
+
+    This uses 'full jitter', i.e. a random delay between 0 and the exponential
+    backoff, so that retrying clients don't all come back at the same time."""
+    return random.uniform(0, min(max_delay, base_delay * pow(2, attempt)))
+
+
+def no_retry(func, *args, **kwargs):
+    """call func without retrying, can be used in place of a Retrier"""
+    return func(*args, **kwargs)
+
+
+class CircuitBreaker:
+    """stops calling an operation, which failed too often
+
+    After failure_threshold consecutive failures the breaker opens and calls
+    fail immediately with CircuitOpenError. After reset_timeout seconds the
+    breaker is half open and a single trial call is let through, concurrent
+    calls still fail. If the trial call succeeds, the breaker is closed again,
+    otherwise it stays open for another reset_timeout seconds.
+
+    The breaker can be shared by multiple threads.
+    """
+
+    def __init__(
+        self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """True, if calls fail without even a trial call being let through"""
+        with self._lock:
+            return self.opened_at is not None and (
+                self._trial_running
+                or self.clock() - self.opened_at < self.reset_timeout
+            )
+
+    def _enter(self) -> bool:
+        """check if a call may go through, return True for a trial call"""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if (
+                self._trial_running
+                or self.clock() - self.opened_at < self.reset_timeout
+            ):
+                raise CircuitOpenError(f"circuit breaker for {self.name} is open")
+            self._trial_running = True
+            return True
+
+    def call(self, func, *args, **kwargs):
+        trial = self._enter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.consecutive_failures += 1
+                if (
+                    self.opened_at is not None
+                    or self.consecutive_failures >= self.failure_threshold
+                ):
+                    if self.opened_at is None:
+                        logger.warning("opening circuit breaker for %s", self.name)
+                    self.opened_at = self.clock()
+            raise
+        else:
+            with self._lock:
+                if self.opened_at is not None:
+                    logger.info("closing circuit breaker for %s", self.name)
+                self.consecutive_failures = 0
+                self.opened_at = None
+            return result
+        finally:
+            if trial:
+                with self._lock:
+                    self._trial_running = False
+
+
+class Retrier:
+    """calls operations, retrying them with jittered exponential backoff
+
+    Only exceptions listed in retry_on are retried. If a circuit breaker is
+    given, the calls go through that breaker and we stop retrying once it is
+    open.
+    """
+
+    def __init__(
+        self,
+        name,
+        attempts=5,
+        base_delay=0.5,
+        max_delay=30.0,
+        retry_on=(Exception,),
+        breaker=None,
+        sleep=time.sleep,
+    ):
+        self.name = name
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.breaker = breaker
+        self.sleep = sleep
+
+    def __call__(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                if self.breaker is not None:
+                    return self.breaker.call(func, *args, **kwargs)
+                return func(*args, **kwargs)
+            except CircuitOpenError:
+                raise
+            except self.retry_on as e:
+                attempt += 1
+                if attempt >= self.attempts:
+                    raise
+                delay = jittered_delay(attempt, self.base_delay, self.max_delay)
+                logger.warning(
+                    "%s failed (%s), retrying in %.1f seconds", self.name, e, delay
+                )
+                self.sleep(delay)
+
+
+class Backoff:
+    """computes jittered exponential delays for repeated failures
+
+    The delay grows with every failure. If there was no failure for
+    reset_after seconds, we start again with a short delay.
+    """
+
+    def __init__(
+        self, base_delay=1.0, max_delay=60.0, reset_after=300.0, clock=time.monotonic
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.last_failure_time = None
+
+    def next_delay(self):
+        now = self.clock()
+        if (
+            self.last_failure_time is not None
+            and now - self.last_failure_time > self.reset_after
+        ):
+            self.failures = 0
+        self.last_failure_time = now
+        delay = jittered_delay(self.failures, self.base_delay, self.max_delay)
+        self.failures += 1
+        return delay
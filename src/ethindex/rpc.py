@@ -0,0 +1,574 @@
+"""json-rpc client talking to multiple ethereum nodes
+
+This module provides a web3 provider, which spreads requests over several
+json-rpc endpoints. It keeps track of the latency and error rate of every
+endpoint and prefers the fast and healthy ones. Requests, which are prone to
+high tail latency like eth_getLogs, are hedged: if the first endpoint does not
+answer within a short delay, a duplicate request is sent to a second endpoint
+and the first answer wins.
+
+RawClient makes the requests syncing needs most often, i.e. eth_getLogs,
+eth_getBlockByNumber and eth_blockNumber, without web3's middlewares and result
+formatters. It turns the json responses directly into the flat records used by
+ethindex.logdecode, instead of converting every field to HexBytes first.
+orjson is used to parse the responses, if it is installed.
+
+Every endpoint may have a RequestBudget, a token bucket limiting the requests
+per second sent to it. Requests waiting for the budget are served in the order
+of their priority: following the head comes before syncing unconfirmed blocks,
+which comes before syncing confirmed blocks. The priority of the requests made
+by a piece of code is set with request_priority.
+"""
+
+import concurrent.futures
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import attr
+import requests
+from web3 import Web3
+from web3.exceptions import BlockNotFound
+from web3.providers.base import JSONBaseProvider
+
+from ethindex import logdecode
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+HEDGED_METHODS = frozenset(
+    [
+        "eth_getLogs",
+        "eth_getBlockByNumber",
+        "eth_getBlockByHash",
+        "eth_blockNumber",
+    ]
+)
+DEFAULT_HEDGE_DELAY = 0.5
+# responses larger than this are results, error responses are small
+MAX_ERROR_RESPONSE_SIZE = 65536
+# weight of the latest measurement in the moving average of the latency
+LATENCY_SMOOTHING = 0.2
+# penalty in seconds added to the latency of an endpoint failing every request
+ERROR_PENALTY = 1.0
+# an endpoint is considered unhealthy after that many errors in a row ...
+MAX_CONSECUTIVE_ERRORS = 3
+# ... until it had a rest for that many seconds
+ERROR_COOLDOWN = 30.0
+STATS_LOG_INTERVAL = 300.0
+# request priorities, lower is more important
+PRIORITY_HEAD = 0
+PRIORITY_CONFIRMATIONS = 1
+PRIORITY_BACKFILL = 2
+PRIORITY_NAMES = ("head", "confirmations", "backfill")
+
+_request_priority = contextvars.ContextVar(
+    "request_priority", default=PRIORITY_CONFIRMATIONS
+)
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    """make the requests of the current context use the given priority"""
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def submit_with_context(executor, fn, *args):
+    """submit fn to executor, it runs with the priority of the caller"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+class BlockHashMismatch(RuntimeError):
+    """raised when the endpoints do not agree on the hash of a block"""
+
+
+class NodeError(ValueError):
+    """raised for an error returned by a json-rpc endpoint, e.g. by a node
+    lagging behind or rate limiting us"""
+
+
+# errors worth retrying a request for. Endpoints may not know the latest block
+# another endpoint told us about yet or may not have agreed on it yet.
+TRANSIENT_ERRORS = (
+    requests.exceptions.RequestException,
+    BlockNotFound,
+    BlockHashMismatch,
+    NodeError,
+)
+
+
+def node_error(content: bytes):
+    """return the error of a json-rpc response, None if there is none"""
+    if len(content) > MAX_ERROR_RESPONSE_SIZE:
+        return None
+    try:
+        response = json_loads(content)
+    except ValueError:
+        return None
+    if isinstance(response, dict):
+        return response.get("error")
+    return None
+
+
+@attr.s(auto_attribs=True)
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    hedged: int = 0
+    consecutive_errors: int = 0
+    last_error_time: float = 0.0
+    latency: Optional[float] = None
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+
+class RequestBudget:
+    """token bucket limiting the requests per second to an endpoint
+
+    Up to burst requests can be sent at once, afterwards the budget is refilled
+    with rate requests per second. A request only gets the budget, if no
+    request with a higher priority is waiting for it.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError("the rate of a request budget must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.clock = clock
+        self.tokens = self.burst
+        self._updated = clock()
+        # statistics per priority
+        self.waiting = [0] * len(PRIORITY_NAMES)
+        self.throttled = [0] * len(PRIORITY_NAMES)
+        self.wait_time = [0.0] * len(PRIORITY_NAMES)
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self, priority) -> bool:
+        self._refill()
+        if self.tokens >= 1 and not any(self.waiting[:priority]):
+            self.tokens -= 1
+            return True
+        return False
+
+    def acquire(self, priority=None):
+        """wait until the budget allows another request"""
+        if priority is None:
+            priority = _request_priority.get()
+        with self._condition:
+            if not any(self.waiting[priority:]) and self._try_take(priority):
+                return
+            self.waiting[priority] += 1
+            self.throttled[priority] += 1
+            start = self.clock()
+            try:
+                while not self._try_take(priority):
+                    # woken up early, when a request with a higher priority
+                    # got the budget
+                    self._condition.wait(
+                        (1 - self.tokens) / self.rate if self.tokens < 1 else None
+                    )
+            finally:
+                self.waiting[priority] -= 1
+                self.wait_time[priority] += self.clock() - start
+                self._condition.notify_all()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self.waiting)
+
+    def describe(self) -> str:
+        return ", ".join(
+            f"{name}: {waiting} waiting, {throttled} throttled for {wait_time:.1f} s"
+            for name, waiting, throttled, wait_time in zip(
+                PRIORITY_NAMES, self.waiting, self.throttled, self.wait_time
+            )
+        )
+
+
+class Endpoint:
+    """a single json-rpc endpoint using a keep-alive http session"""
+
+    def __init__(self, uri, timeout=60, budget=None):
+        self.uri = uri
+        self.timeout = timeout
+        self.budget = budget
+        self.session = requests.Session()
+        self.stats = EndpointStats()
+        self._lock = threading.Lock()
+
+    def post(self, request_data: bytes) -> bytes:
+        """post the request and return the response
+
+        An error returned by the node is raised as NodeError and counts as a
+        failure of the endpoint, so the request is sent to another one."""
+        if self.budget is not None:
+            self.budget.acquire()
+        start = time.monotonic()
+        try:
+            response = self.session.post(
+                self.uri,
+                data=request_data,
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            error = node_error(response.content)
+            if error is not None:
+                raise NodeError(error)
+        except Exception:
+            self._record_error()
+            raise
+        self._record_success(time.monotonic() - start)
+        return response.content
+
+    def _record_success(self, latency):
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.consecutive_errors = 0
+            if self.stats.latency is None:
+                self.stats.latency = latency
+            else:
+                self.stats.latency += LATENCY_SMOOTHING * (latency - self.stats.latency)
+
+    def _record_error(self):
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.errors += 1
+            self.stats.consecutive_errors += 1
+            self.stats.last_error_time = time.monotonic()
+
+    def is_healthy(self) -> bool:
+        return (
+            self.stats.consecutive_errors < MAX_CONSECUTIVE_ERRORS
+            or time.monotonic() - self.stats.last_error_time > ERROR_COOLDOWN
+        )
+
+    def score(self) -> float:
+        """return the score of this endpoint, lower is better
+
+        The score is the average latency in seconds plus a penalty of
+        ERROR_PENALTY seconds scaled by the error rate. Endpoints without latency
+        measurements have a latency of 0, so they are tried early on."""
+        latency = self.stats.latency or 0.0
+        return latency + ERROR_PENALTY * self.stats.error_rate
+
+
+class MultiEndpointProvider(JSONBaseProvider):
+    """web3 provider spreading requests over multiple json-rpc endpoints
+
+    Endpoints are picked with the 'power of two choices' strategy: we choose two
+    endpoints at random and use the one with the better score. Failed requests,
+    including requests the node answered with an error, are retried on the
+    other endpoints. Requests for methods in hedged_methods
+    are sent to a second endpoint if the first one does not answer within
+    hedge_delay seconds. If requests_per_second is given, every endpoint gets a
+    RequestBudget of that rate.
+    """
+
+    def __init__(
+        self,
+        endpoint_uris,
+        timeout=60,
+        hedge_delay=DEFAULT_HEDGE_DELAY,
+        hedged_methods=HEDGED_METHODS,
+        requests_per_second=None,
+        burst=None,
+    ):
+        super().__init__()
+        if not endpoint_uris:
+            raise ValueError("MultiEndpointProvider needs at least one endpoint")
+        self.endpoints = [
+            Endpoint(
+                uri,
+                timeout=timeout,
+                budget=(
+                    RequestBudget(requests_per_second, burst=burst)
+                    if requests_per_second is not None
+                    else None
+                ),
+            )
+            for uri in endpoint_uris
+        ]
+        self.hedge_delay = hedge_delay
+        self.hedged_methods = hedged_methods
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=4 * len(self.endpoints)
+        )
+        self._last_stats_log_time = time.monotonic()
+
+    def __str__(self):
+        return "MultiEndpointProvider({})".format(
+            ", ".join(endpoint.uri for endpoint in self.endpoints)
+        )
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        raw_response = self.send(request_data, hedge=method in self.hedged_methods)
+        self._maybe_log_stats()
+        return self.decode_rpc_response(raw_response)
+
+    def choose_endpoints(self) -> List[Endpoint]:
+        """return the endpoints in the order they should be tried"""
+        healthy = [e for e in self.endpoints if e.is_healthy()]
+        unhealthy = [e for e in self.endpoints if not e.is_healthy()]
+        if len(healthy) >= 2:
+            first, second = random.sample(healthy, 2)
+            if second.score() < first.score():
+                first = second
+            healthy.remove(first)
+            healthy.sort(key=Endpoint.score)
+            healthy.insert(0, first)
+        return healthy + unhealthy
+
+    def send(self, request_data: bytes, hedge=False) -> bytes:
+        endpoints = self.choose_endpoints()
+        if hedge and len(endpoints) > 1:
+            return self._send_hedged(request_data, endpoints)
+        return self._send_with_failover(request_data, endpoints)
+
+    def _send_with_failover(self, request_data, endpoints) -> bytes:
+        last_error = None
+        for endpoint in endpoints:
+            try:
+                return endpoint.post(request_data)
+            except Exception as e:
+                logger.warning("request to %s failed: %s", endpoint.uri, e)
+                last_error = e
+        assert last_error is not None
+        raise last_error
+
+    def _send_hedged(self, request_data, endpoints) -> bytes:
+        remaining = list(endpoints)
+        pending = set()
+        hedged = False
+        last_error = None
+
+        def send_to_next_endpoint():
+            endpoint = remaining.pop(0)
+            pending.add(
+                submit_with_context(self._executor, endpoint.post, request_data)
+            )
+            return endpoint
+
+        send_to_next_endpoint()
+        while pending:
+            timeout = self.hedge_delay if remaining and not hedged else None
+            done, pending = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                # the request takes too long, send a duplicate request
+                hedged = True
+                send_to_next_endpoint().stats.hedged += 1
+                continue
+            for future in done:
+                if future.exception() is None:
+                    # slower duplicates finish in the background
+                    return future.result()
+                logger.warning("request failed: %s", future.exception())
+                last_error = future.exception()
+            if remaining:
+                send_to_next_endpoint()
+        assert last_error is not None
+        raise last_error
+
+    def get_block_hashes(self, block_number) -> Dict[str, str]:
+        """ask all healthy endpoints for the hash of the block with the given number
+
+        Returns a endpoint uri to block hash mapping. Endpoints that fail or
+        don't know the block yet are left out.
+        """
+        request_data = self.encode_rpc_request(
+            "eth_getBlockByNumber", [hex(block_number), False]
+        )
+        endpoints = [e for e in self.endpoints if e.is_healthy()]
+        futures = {
+            submit_with_context(self._executor, endpoint.post, request_data): endpoint
+            for endpoint in endpoints
+        }
+        block_hashes = {}
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is not None:
+                continue
+            block = json.loads(future.result()).get("result")
+            if block:
+                block_hashes[futures[future].uri] = block["hash"].lower()
+        return block_hashes
+
+    def ensure_block_hash_agreement(self, block_number, expected_hash=None):
+        """make sure all endpoints agree on the hash of a block
+
+        raises BlockHashMismatch if they don't or if expected_hash is given and
+        differs from the hash reported by the endpoints.
+        """
+        block_hashes = self.get_block_hashes(block_number)
+        distinct_hashes = set(block_hashes.values())
+        if expected_hash is not None:
+            distinct_hashes.add(expected_hash.lower())
+        if len(distinct_hashes) > 1:
+            raise BlockHashMismatch(
+                f"endpoints disagree on the hash of block {block_number}: "
+                f"{block_hashes}, expected {expected_hash}"
+            )
+
+    def log_stats(self):
+        for endpoint in self.endpoints:
+            stats = endpoint.stats
+            logger.info(
+                "endpoint %s: %s requests, %s errors, %s hedged, latency %s ms",
+                endpoint.uri,
+                stats.requests,
+                stats.errors,
+                stats.hedged,
+                None if stats.latency is None else round(stats.latency * 1000),
+            )
+            if endpoint.budget is not None:
+                logger.info(
+                    "endpoint %s budget: %s", endpoint.uri, endpoint.budget.describe()
+                )
+
+    def _maybe_log_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_log_time > STATS_LOG_INTERVAL:
+            self._last_stats_log_time = now
+            self.log_stats()
+
+
+class RawClient:
+    """minimal json-rpc client for the hot calls of a sync job
+
+    send posts an encoded json-rpc request and returns the raw response.
+    Errors returned by the node are raised as NodeError, a ValueError like web3
+    raises.
+    """
+
+    def __init__(self, send: Callable[[bytes, str], bytes]):
+        self.send = send
+        self._request_id = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, params) -> Any:
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+        request_data = json.dumps(
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}
+        ).encode()
+        response = json_loads(self.send(request_data, method))
+        if "error" in response:
+            raise NodeError(response["error"])
+        return response["result"]
+
+    def get_logs(self, log_filter) -> List[Dict[str, Any]]:
+        return [parse_log(log) for log in self.request("eth_getLogs", [log_filter])]
+
+    def get_block_header(self, block_identifier) -> Dict[str, Any]:
+        """return number, hash, parentHash, timestamp and logsBloom of a block
+
+        block_identifier is a block number or 'latest'. Raises BlockNotFound
+        like web3, if the endpoint doesn't know the block."""
+        if isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+        block = self.request("eth_getBlockByNumber", [block_identifier, False])
+        if block is None:
+            raise BlockNotFound(f"block {block_identifier} not found")
+        return {
+            "number": int(block["number"], 16),
+            "hash": hex_to_bytes(block["hash"]),
+            "parentHash": hex_to_bytes(block["parentHash"]),
+            "timestamp": int(block["timestamp"], 16),
+            "logsBloom": (
+                hex_to_bytes(block["logsBloom"]) if block.get("logsBloom") else None
+            ),
+        }
+
+    def block_number(self) -> int:
+        return int(self.request("eth_blockNumber", []), 16)
+
+
+def hex_to_bytes(value: str) -> bytes:
+    return bytes.fromhex(value[2:])
+
+
+def parse_log(log) -> Dict[str, Any]:
+    """turn a log of a json-rpc response into the record used by logdecode"""
+    return {
+        "address": logdecode.to_checksum_address(log["address"]),
+        "blockNumber": int(log["blockNumber"], 16),
+        "blockHash": hex_to_bytes(log["blockHash"]),
+        "transactionHash": hex_to_bytes(log["transactionHash"]),
+        "transactionIndex": int(log["transactionIndex"], 16),
+        "logIndex": int(log["logIndex"], 16),
+        "topics": [hex_to_bytes(topic) for topic in log["topics"]],
+        "data": hex_to_bytes(log["data"]),
+    }
+
+
+def make_raw_client(web3) -> Optional[RawClient]:
+    """return a RawClient talking to the endpoints of web3
+
+    Returns None if web3 does not talk json over http, e.g. in tests.
+    """
+    provider = web3.provider
+    if isinstance(provider, MultiEndpointProvider):
+        return RawClient(
+            lambda request_data, method: provider.send(
+                request_data, hedge=method in provider.hedged_methods
+            )
+        )
+    if isinstance(provider, Web3.HTTPProvider):
+        endpoint = Endpoint(
+            provider.endpoint_uri,
+            timeout=provider.get_request_kwargs().get("timeout", 60),
+        )
+        return RawClient(lambda request_data, method: endpoint.post(request_data))
+    return None
+
+
+def make_web3(
+    jsonrpc_urls,
+    timeout=60,
+    hedge_delay=DEFAULT_HEDGE_DELAY,
+    requests_per_second=None,
+    burst=None,
+) -> Web3:
+    """create a Web3 instance talking to the given json-rpc endpoints
+
+    If requests_per_second is given, the requests to every endpoint are limited
+    to that rate."""
+    if len(jsonrpc_urls) == 1 and requests_per_second is None:
+        return Web3(
+            Web3.HTTPProvider(jsonrpc_urls[0], request_kwargs={"timeout": timeout})
+        )
+    return Web3(
+        MultiEndpointProvider(
+            jsonrpc_urls,
+            timeout=timeout,
+            hedge_delay=hedge_delay,
+            requests_per_second=requests_per_second,
+            burst=burst,
+        )
+    )
@@ -0,0 +1,97 @@
+"""encode events for postgres
+
+Event args are encoded to json in a single pass, bytes values are written as
+0x prefixed hex strings. The args are neither copied nor modified. Python's
+json module writes integers of any size exactly, so uint256 values survive the
+round trip through a jsonb column.
+
+Many events are written with COPY in text format instead of one INSERT per
+event.
+"""
+import io
+import itertools
+import json
+from typing import Iterable
+
+from ethindex import logdecode
+
+COPY_BATCH_SIZE = 10000
+EVENT_COLUMNS = (
+    "transactionHash",
+    "blockNumber",
+    "address",
+    "eventName",
+    "args",
+    "blockHash",
+    "transactionIndex",
+    "logIndex",
+    "timestamp",
+)
+
+
+def hexlify(value) -> str:
+    return "0x" + bytes(value).hex()
+
+
+def _encode_bytes(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return hexlify(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_args_encoder = json.JSONEncoder(default=_encode_bytes)
+
+
+def encode_args(args) -> str:
+    """encode the args of an event as json"""
+    return _args_encoder.encode(args)
+
+
+# characters with a special meaning in the COPY text format
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def copy_field(value) -> str:
+    """encode a value as a field of the COPY text format"""
+    if value is None:
+        return "\\N"
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def event_copy_line(event: logdecode.Event) -> str:
+    return (
+        "\t".join(
+            [
+                hexlify(event.transactionhash),
+                str(event.blocknumber),
+                copy_field(event.address),
+                copy_field(event.name),
+                copy_field(encode_args(event.args)),
+                hexlify(event.blockhash),
+                str(event.transactionindex),
+                str(event.logindex),
+                copy_field(event.timestamp),
+            ]
+        )
+        + "\n"
+    )
+
+
+def copy_events(cur, events: Iterable[logdecode.Event], table="events") -> int:
+    """write events into table with COPY, return their number
+
+    The events are written in batches of COPY_BATCH_SIZE, so events can be an
+    iterator over more events than fit into memory.
+    """
+    statement = "COPY {} ({}) FROM STDIN".format(table, ", ".join(EVENT_COLUMNS))
+    events = iter(events)
+    count = 0
+    while True:
+        batch = list(itertools.islice(events, COPY_BATCH_SIZE))
+        if not batch:
+            return count
+        logdecode.decode_events(batch)
+        cur.copy_expert(
+            statement, io.StringIO("".join(event_copy_line(e) for e in batch))
+        )
+        count += len(batch)
@@ -0,0 +1,362 @@
+"""read-only http service for events and the graph feed
+
+The service answers the following GET requests with json:
+
+- /events: events matching the filters of ethindex.query, the query
+  parameters are address, event_name (both can be given multiple times), user,
+  from_block, to_block, from_timestamp, to_timestamp, limit and cursor
+- /graphfeed: graph feed rows with an id greater than after_id, at most limit
+- /status: the sync rows
+
+Responses are cached. Responses, which only depend on confirmed blocks, are
+immutable and are kept until they are evicted. All other responses expire
+after a short time and are dropped whenever a sync job commits new blocks,
+which the service is notified about with postgres' LISTEN/NOTIFY. Onboarding
+addresses and ethindex reproject change the events of confirmed blocks, their
+notifications drop all responses.
+"""
+import collections
+import contextlib
+import http.server
+import json
+import logging
+import select
+import threading
+import time
+import urllib.parse
+
+import click
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+
+from ethindex import pgimport, query, util
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 5.0
+DEFAULT_POOL_SIZE = 10
+DEFAULT_GRAPHFEED_LIMIT = 1000
+MAX_GRAPHFEED_LIMIT = 10000
+# seconds to wait for notifications before checking if we should stop
+LISTEN_TIMEOUT = 5.0
+
+
+class ResponseCache:
+    """thread-safe LRU cache, entries are either immutable or expire after ttl"""
+
+    def __init__(
+        self,
+        max_entries=DEFAULT_CACHE_SIZE,
+        ttl=DEFAULT_CACHE_TTL,
+        clock=time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # incremented by clear
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, immutable=False, generation=None):
+        """cache value for key
+
+        If the cache has been cleared since generation, value may be outdated
+        already and is not kept as immutable."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                immutable = False
+            expires_at = None if immutable else self.clock() + self.ttl
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_mutable(self):
+        """drop all entries, which are not immutable"""
+        with self._lock:
+            for key in [k for k, (e, v) in self._entries.items() if e is not None]:
+                del self._entries[key]
+
+    def clear(self):
+        """drop all entries"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def get_single_param(params, name, type=str, default=None):
+    values = params.get(name)
+    if not values:
+        return default
+    if len(values) > 1:
+        raise BadRequest(f"{name} can only be given once")
+    try:
+        return type(values[0])
+    except ValueError:
+        raise BadRequest(f"invalid value for {name}: {values[0]!r}")
+
+
+class QueryService:
+    """answers queries using a connection pool and a response cache"""
+
+    def __init__(self, pool, cache):
+        self.pool = pool
+        self.cache = cache
+        self.confirmed_block_number = None
+        self._stop = threading.Event()
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.pool.getconn()
+        if not conn.autocommit:
+            # every request runs a single read-only statement
+            conn.set_session(readonly=True, autocommit=True)
+        close = False
+        try:
+            yield conn
+        except psycopg2.OperationalError:
+            # the connection is most probably dead, don't reuse it
+            close = True
+            raise
+        finally:
+            self.pool.putconn(conn, close=close)
+
+    def refresh_confirmed_block_number(self):
+        """fetch the last block confirmed by all sync jobs"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT min(last_confirmed_block_number) AS n FROM sync")
+                self.confirmed_block_number = cur.fetchone()["n"]
+
+    def on_sync_committed(self, rewritten=False):
+        """drop the cached responses, which may have changed, rewritten tells
+        that the events of confirmed blocks have changed"""
+        if rewritten:
+            self.cache.clear()
+        else:
+            self.cache.invalidate_mutable()
+        self.refresh_confirmed_block_number()
+
+    def is_confirmed(self, block_number):
+        return (
+            block_number is not None
+            and self.confirmed_block_number is not None
+            and block_number <= self.confirmed_block_number
+        )
+
+    def handle(self, path, params):
+        """return the json response for path and the parsed query params"""
+        handlers = {
+            "/events": self.get_events,
+            "/graphfeed": self.get_graphfeed,
+            "/status": self.get_status,
+        }
+        if path not in handlers:
+            raise NotFound(f"unknown path {path}")
+        key = (path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        body = self.cache.get(key)
+        if body is None:
+            generation = self.cache.generation
+            result, immutable = handlers[path](params)
+            body = json.dumps(result).encode()
+            self.cache.put(key, body, immutable=immutable, generation=generation)
+        return body
+
+    def get_events(self, params):
+        event_query = query.EventQuery(
+            addresses=params.get("address"),
+            event_names=params.get("event_name"),
+            user_address=get_single_param(params, "user"),
+            from_block=get_single_param(params, "from_block", int),
+            to_block=get_single_param(params, "to_block", int),
+            from_timestamp=get_single_param(params, "from_timestamp", int),
+            to_timestamp=get_single_param(params, "to_timestamp", int),
+        )
+        limit = get_single_param(params, "limit", int, query.DEFAULT_PAGE_SIZE)
+        cursor = get_single_param(params, "cursor")
+        with self.connection() as conn:
+            try:
+                page = query.query_events(conn, event_query, limit=limit, cursor=cursor)
+            except ValueError as e:
+                raise BadRequest(str(e))
+        # no event can be added before the last event of a full page or the end
+        # of the block range
+        if page.next_cursor is not None:
+            last_block_number = page.events[-1]["blocknumber"]
+        else:
+            last_block_number = event_query.to_block
+        return (
+            {"events": page.events, "next_cursor": page.next_cursor},
+            self.is_confirmed(last_block_number),
+        )
+
+    def get_graphfeed(self, params):
+        after_id = get_single_param(params, "after_id", int, 0)
+        limit = get_single_param(params, "limit", int, DEFAULT_GRAPHFEED_LIMIT)
+        if not 1 <= limit <= MAX_GRAPHFEED_LIMIT:
+            raise BadRequest(f"limit must be between 1 and {MAX_GRAPHFEED_LIMIT}")
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """SELECT id, address, eventName, args, timestamp FROM graphfeed
+                       WHERE id>%s ORDER BY id LIMIT %s""",
+                    (after_id, limit),
+                )
+                rows = cur.fetchall()
+        # concurrent sync jobs may commit graph feed rows out of id order, so
+        # even a full page may still change
+        return rows, False
+
+    def get_status(self, params):
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """SELECT syncid, last_block_number, last_confirmed_block_number
+                       FROM sync ORDER BY syncid"""
+                )
+                return cur.fetchall(), False
+
+    def listen_for_syncs(self, dsn):
+        """invalidate the cache whenever a sync job commits new blocks
+
+        This blocks until stop is called, run it in a separate thread.
+        """
+        while not self._stop.is_set():
+            try:
+                self._listen_for_syncs(dsn)
+            except psycopg2.Error:
+                logger.exception("error listening for sync notifications")
+                # we may have missed notifications
+                self.cache.clear()
+                self._stop.wait(LISTEN_TIMEOUT)
+
+    def _listen_for_syncs(self, dsn):
+        conn = psycopg2.connect(dsn, cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {pgimport.SYNC_NOTIFY_CHANNEL}")
+            # we may have missed notifications before listening
+            self.on_sync_committed(rewritten=True)
+            while not self._stop.is_set():
+                if select.select([conn], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    rewritten = any(
+                        json.loads(notify.payload).get("rewritten")
+                        for notify in conn.notifies
+                    )
+                    conn.notifies.clear()
+                    self.on_sync_committed(rewritten=rewritten)
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop.set()
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        try:
+            body = self.server.service.handle(url.path, params)
+        except NotFound as e:
+            self.send_json(404, {"error": str(e)})
+        except BadRequest as e:
+            self.send_json(400, {"error": str(e)})
+        except Exception:
+            logger.exception("error handling %s", self.path)
+            self.send_json(500, {"error": "internal server error"})
+        else:
+            self.send_body(200, body)
+
+    def send_json(self, status, result):
+        self.send_body(status, json.dumps(result).encode())
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class QueryServer(http.server.ThreadingHTTPServer):
+    def __init__(self, address, service):
+        super().__init__(address, RequestHandler)
+        self.service = service
+
+
+def make_pool(dsn, pool_size=DEFAULT_POOL_SIZE):
+    return psycopg2.pool.ThreadedConnectionPool(
+        1, pool_size, dsn, cursor_factory=psycopg2.extras.RealDictCursor
+    )
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8000, show_default=True)
+@click.option(
+    "--pool-size",
+    help="maximum number of database connections",
+    default=DEFAULT_POOL_SIZE,
+    show_default=True,
+)
+@click.option(
+    "--cache-size",
+    help="maximum number of cached responses",
+    default=DEFAULT_CACHE_SIZE,
+    show_default=True,
+)
+@click.option(
+    "--cache-ttl",
+    help="seconds after which cached responses for unconfirmed blocks expire",
+    default=DEFAULT_CACHE_TTL,
+    show_default=True,
+)
+def serve(host, port, pool_size, cache_size, cache_ttl):
+    """serve events and the graph feed over http"""
+    logging.basicConfig(level=logging.INFO)
+    logger.info("version %s starting", util.get_version())
+    service = QueryService(
+        make_pool("", pool_size=pool_size),
+        ResponseCache(max_entries=cache_size, ttl=cache_ttl),
+    )
+    threading.Thread(target=service.listen_for_syncs, args=("",), daemon=True).start()
+    server = QueryServer((host, port), service)
+    logger.info("serving on http://%s:%s", host, port)
+    server.serve_forever()
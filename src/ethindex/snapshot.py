@@ -0,0 +1,216 @@
+"""snapshots of the graph state for graph feed consumers
+
+A snapshot holds the latest graph feed row for every trustline, balance and
+the frozen status of a network up to a graph feed id. A new consumer loads the
+latest snapshot of a network and then only has to apply the graph feed rows
+with a greater id.
+
+Snapshots are gzipped json files. The rows are stored per event name in
+columns, i.e. one list per field, which compresses well. The positions of the
+rows without an arg are listed in missing, so args with a null value are kept:
+
+    {
+      "format": 1,
+      "network": "0x...",
+      "graphfeed_id": 1234,
+      "block_number": 5678,
+      "events": {
+        "BalanceUpdate": {
+          "id": [...], "timestamp": [...],
+          "args": {"_from": [...], "_to": [...], "_value": [...]},
+          "missing": {}
+        },
+        ...
+      }
+    }
+"""
+import collections
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, Optional
+
+import click
+
+from ethindex import compaction, pgimport, util
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+DEFAULT_KEEP = 3
+
+
+def snapshot_path(snapshot_dir, network, graphfeed_id):
+    # zero padded, so the file names sort by graph feed id
+    return os.path.join(
+        snapshot_dir, "snapshot-{}-{:012d}.json.gz".format(network, graphfeed_id)
+    )
+
+
+def list_snapshots(snapshot_dir, network):
+    """return the paths of the snapshots of network, oldest first"""
+    return sorted(
+        glob.glob(os.path.join(snapshot_dir, f"snapshot-{network}-*.json.gz"))
+    )
+
+
+def build_snapshot(network, graphfeed_id, block_number, rows) -> Dict[str, Any]:
+    """build a snapshot from the graph feed rows of network ordered by id"""
+    events: Dict[str, Any] = {}
+    for row in rows:
+        columns = events.setdefault(
+            row["eventname"], {"id": [], "timestamp": [], "args": {}, "missing": {}}
+        )
+        position = len(columns["id"])
+        columns["id"].append(row["id"])
+        columns["timestamp"].append(row["timestamp"])
+        for name, value in row["args"].items():
+            if name not in columns["args"]:
+                columns["args"][name] = [None] * position
+                if position:
+                    columns["missing"][name] = list(range(position))
+            columns["args"][name].append(value)
+        for name, values in columns["args"].items():
+            if len(values) == position:
+                values.append(None)
+                columns["missing"].setdefault(name, []).append(position)
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "network": network,
+        "graphfeed_id": graphfeed_id,
+        "block_number": block_number,
+        "events": events,
+    }
+
+
+def iterate_snapshot_rows(snapshot) -> Iterator[Dict[str, Any]]:
+    """iterate over the graph feed rows of a snapshot ordered by id
+
+    The rows look like the rows of the graph feed, so consumers can apply them
+    like any other graph feed row.
+    """
+    rows = []
+    for event_name, columns in snapshot["events"].items():
+        missing = {
+            name: set(positions)
+            for name, positions in columns.get("missing", {}).items()
+        }
+        for i, (id_, timestamp) in enumerate(zip(columns["id"], columns["timestamp"])):
+            rows.append(
+                {
+                    "id": id_,
+                    "address": snapshot["network"],
+                    "eventname": event_name,
+                    "timestamp": timestamp,
+                    "args": {
+                        name: values[i]
+                        for name, values in columns["args"].items()
+                        if i not in missing.get(name, ())
+                    },
+                }
+            )
+    rows.sort(key=lambda row: row["id"])
+    return iter(rows)
+
+
+def write_snapshot(snapshot_dir, snapshot) -> str:
+    path = snapshot_path(snapshot_dir, snapshot["network"], snapshot["graphfeed_id"])
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_snapshot(path) -> Dict[str, Any]:
+    with gzip.open(path, "rt") as f:
+        snapshot = json.load(f)
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"unsupported snapshot format in {path}")
+    return snapshot
+
+
+def load_latest_snapshot(snapshot_dir, network) -> Optional[Dict[str, Any]]:
+    paths = list_snapshots(snapshot_dir, network)
+    if not paths:
+        return None
+    return read_snapshot(paths[-1])
+
+
+def prune_snapshots(snapshot_dir, network, keep=DEFAULT_KEEP):
+    for path in list_snapshots(snapshot_dir, network)[:-keep]:
+        os.remove(path)
+
+
+def take_snapshots(conn, snapshot_dir, keep=DEFAULT_KEEP):
+    """write a snapshot for every network and return their paths
+
+    The snapshots contain the graph feed up to the last id caused by blocks
+    confirmed by all sync jobs. They are read in a single repeatable read
+    transaction, so all snapshots are consistent.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            graphfeed_id = compaction.safe_watermark(cur)
+            cur.execute("SELECT min(last_confirmed_block_number) AS n FROM sync")
+            block_number = cur.fetchone()["n"]
+            cur.execute(
+                f"""SELECT DISTINCT ON (address, {compaction.GRAPHFEED_KEY})
+                      id, address, eventName, args, timestamp
+                    FROM graphfeed WHERE id<=%s
+                    ORDER BY address, {compaction.GRAPHFEED_KEY}, id DESC""",
+                (graphfeed_id,),
+            )
+            rows_by_network = collections.defaultdict(list)
+            for row in cur.fetchall():
+                rows_by_network[row["address"]].append(row)
+
+    paths = []
+    for network, rows in sorted(rows_by_network.items()):
+        rows.sort(key=lambda row: row["id"])
+        snapshot = build_snapshot(network, graphfeed_id, block_number, rows)
+        paths.append(write_snapshot(snapshot_dir, snapshot))
+        prune_snapshots(snapshot_dir, network, keep=keep)
+    logger.info(
+        "wrote %s snapshots up to graph feed id %s, block %s",
+        len(paths),
+        graphfeed_id,
+        block_number,
+    )
+    return paths
+
+
+@click.command()
+@click.option(
+    "--snapshot-dir",
+    help="directory to write the snapshots to",
+    default=".",
+    show_default=True,
+    type=click.Path(exists=True, file_okay=False, writable=True),
+)
+@click.option(
+    "--interval",
+    help="take snapshots every that many seconds, only once if not given",
+    type=float,
+    default=None,
+)
+@click.option(
+    "--keep",
+    help="number of snapshots to keep per network",
+    default=DEFAULT_KEEP,
+    show_default=True,
+)
+def snapshot(snapshot_dir, interval, keep):
+    """write snapshots of the graph state for graph feed consumers"""
+    logging.basicConfig(level=logging.INFO)
+    logger.info("version %s starting", util.get_version())
+    conn = pgimport.connect("")
+    while True:
+        take_snapshots(conn, snapshot_dir, keep=keep)
+        if interval is None:
+            return
+        time.sleep(interval)
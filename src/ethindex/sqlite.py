@@ -0,0 +1,366 @@
+"""store events in an embedded SQLite database
+
+SQLite is an alternative to postgres for light deployments on a single node
+and for tests, which shouldn't need a database server. connect returns a
+connection, which behaves like the psycopg2 connections used with postgres:
+
+- cursors are context managers and return rows as dicts with lower case keys,
+  like postgres folds unquoted identifiers to lower case
+- queries use %s placeholders, tuples are expanded for IN, lists and dicts are
+  stored as json and read back by the declared type of their column
+- a transaction is started by the first query after a commit or rollback
+
+Transactions are started with BEGIN IMMEDIATE, which takes the write lock of
+the database, so two sync jobs can't write the same sync row at the same time.
+The database runs in WAL mode, readers are not blocked by a sync job writing
+a round. A round is written in one transaction, events are inserted in batches
+of BATCH_SIZE.
+
+There is no unconfirmed events table and no notification channel. Commands
+like ethindex backfill and ethindex serve still need postgres.
+
+The queries shared with postgres use the ->> operator and DELETE ... RETURNING,
+which need SQLite 3.38 or newer.
+"""
+import itertools
+import json
+import logging
+import re
+import sqlite3
+from typing import Iterable
+
+from ethindex import logdecode, serialize
+
+logger = logging.getLogger(__name__)
+
+# number of events inserted with one executemany
+BATCH_SIZE = 10000
+# seconds to wait for the write lock held by another connection
+BUSY_TIMEOUT = 30.0
+# needed for the ->> operator
+MIN_SQLITE_VERSION = (3, 38, 0)
+
+Error = sqlite3.Error
+
+# columns of these declared types are read back from json
+sqlite3.register_converter("JSONTEXT", json.loads)
+sqlite3.register_converter("TEXTARRAY", json.loads)
+
+TABLES = (
+    "events",
+    "sync",
+    "abi_contents",
+    "contract_abis",
+    "graphfeed",
+    "graphfeed_outbox",
+    "event_density",
+    "sync_onboarding",
+)
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS events (
+         transactionHash TEXT NOT NULL,
+         blockNumber INTEGER NOT NULL,
+         address TEXT NOT NULL,
+         eventName TEXT NOT NULL,
+         args JSONTEXT,
+         blockHash TEXT NOT NULL,
+         transactionIndex INTEGER NOT NULL,
+         logIndex INTEGER NOT NULL,
+         timestamp INTEGER NOT NULL,
+         PRIMARY KEY(transactionHash, address, blockHash, transactionIndex, logIndex)
+       )""",
+    "CREATE INDEX IF NOT EXISTS events_block_idx ON events (blockNumber, logIndex)",
+    """CREATE INDEX IF NOT EXISTS events_address_idx
+         ON events (address, blockNumber, logIndex)""",
+    """CREATE INDEX IF NOT EXISTS events_eventname_idx
+         ON events (eventName, blockNumber, logIndex)""",
+    "CREATE INDEX IF NOT EXISTS events_timestamp_idx ON events (timestamp)",
+    """CREATE TABLE IF NOT EXISTS sync (
+         syncid TEXT NOT NULL PRIMARY KEY,
+         last_block_number INTEGER NOT NULL,
+         addresses TEXTARRAY NOT NULL,
+         last_confirmed_block_number INTEGER NOT NULL,
+         latest_block_hash TEXT NOT NULL,
+         event_names TEXTARRAY,
+         end_block INTEGER
+       )""",
+    """CREATE TABLE IF NOT EXISTS abi_contents (
+         abi_hash TEXT NOT NULL PRIMARY KEY,
+         abi JSONTEXT NOT NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS contract_abis (
+         contract_address TEXT NOT NULL PRIMARY KEY,
+         abi_hash TEXT NOT NULL REFERENCES abi_contents(abi_hash)
+       )""",
+    """CREATE TABLE IF NOT EXISTS graphfeed (
+         address TEXT NOT NULL,
+         eventName TEXT NOT NULL,
+         args JSONTEXT,
+         timestamp INTEGER NOT NULL,
+         id INTEGER PRIMARY KEY AUTOINCREMENT,
+         blockNumber INTEGER
+       )""",
+    """CREATE TABLE IF NOT EXISTS graphfeed_outbox (
+         id INTEGER PRIMARY KEY AUTOINCREMENT,
+         syncid TEXT NOT NULL,
+         removed BOOLEAN NOT NULL,
+         transactionHash TEXT NOT NULL,
+         blockNumber INTEGER NOT NULL,
+         address TEXT NOT NULL,
+         eventName TEXT NOT NULL,
+         args JSONTEXT,
+         blockHash TEXT NOT NULL,
+         transactionIndex INTEGER NOT NULL,
+         logIndex INTEGER NOT NULL,
+         timestamp INTEGER NOT NULL
+       )""",
+    """CREATE INDEX IF NOT EXISTS graphfeed_outbox_syncid_idx
+         ON graphfeed_outbox (syncid, id)""",
+    """CREATE TABLE IF NOT EXISTS sync_onboarding (
+         address TEXT NOT NULL PRIMARY KEY,
+         syncid TEXT NOT NULL,
+         last_block_number INTEGER NOT NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS event_density (
+         syncid TEXT NOT NULL,
+         bucket INTEGER NOT NULL,
+         blocks INTEGER NOT NULL,
+         events INTEGER NOT NULL,
+         event_blocks INTEGER NOT NULL,
+         PRIMARY KEY(syncid, bucket)
+       )""",
+    # there is no unconfirmed events table, queries of all_events work anyway
+    "CREATE VIEW IF NOT EXISTS all_events AS SELECT * FROM events",
+    """CREATE VIEW IF NOT EXISTS abis AS
+         SELECT contract_address, abi
+         FROM contract_abis JOIN abi_contents USING (abi_hash)""",
+)
+
+_PLACEHOLDER = re.compile("%s|%%")
+_INSERT_EVENT = "INSERT INTO events ({}) VALUES ({})".format(
+    ", ".join(serialize.EVENT_COLUMNS), ", ".join(["%s"] * len(serialize.EVENT_COLUMNS))
+)
+
+
+def adapt(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def translate(query, params):
+    """translate a query with psycopg2 placeholders into a query with SQLite
+    placeholders and its parameters"""
+    if params is None:
+        return query, ()
+    params = iter(params)
+    values = []
+
+    def replace(match):
+        if match.group() == "%%":
+            return "%"
+        value = next(params)
+        if isinstance(value, tuple):
+            values.extend(adapt(v) for v in value)
+            return "(" + ", ".join(["?"] * len(value)) + ")"
+        values.append(adapt(value))
+        return "?"
+
+    return _PLACEHOLDER.sub(replace, query), values
+
+
+def _dict_row(cursor, row):
+    return {column[0].lower(): value for column, value in zip(cursor.description, row)}
+
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+
+    def execute(self, query, params=None):
+        self.connection.begin()
+        self._cursor.execute(*translate(query, params))
+
+    def executemany(self, query, seq_of_params):
+        """execute query for every item of seq_of_params, the placeholders
+        are translated once, so tuples can't be expanded"""
+        seq_of_params = iter(seq_of_params)
+        first = next(seq_of_params, None)
+        if first is None:
+            return
+        self.connection.begin()
+        statement, values = translate(query, first)
+        self._cursor.executemany(
+            statement,
+            itertools.chain(
+                [values], ([adapt(v) for v in params] for params in seq_of_params)
+            ),
+        )
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SQLiteStorage:
+    """the SQLite specific parts of storing events, see
+    pgimport.PostgresStorage"""
+
+    name = "sqlite"
+    # BEGIN IMMEDIATE already locked the whole database
+    lock_rows = ""
+    event_tables = ("events",)
+    supports_unconfirmed_table = False
+
+    def insert_events(self, conn, events: Iterable[logdecode.Event]) -> int:
+        """insert the events in batches of BATCH_SIZE, return their number"""
+        events = iter(events)
+        count = 0
+        with conn.cursor() as cur:
+            while True:
+                batch = list(itertools.islice(events, BATCH_SIZE))
+                if not batch:
+                    return count
+                logdecode.decode_events(batch)
+                cur.executemany(_INSERT_EVENT, (event_row(e) for e in batch))
+                count += len(batch)
+
+    def notify_sync(
+        self,
+        cur,
+        syncid,
+        last_block_number,
+        last_confirmed_block_number,
+        rewritten=False,
+    ):
+        """there is no ethindex serve to notify"""
+
+    def create_tables(self, conn):
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                existing = {row["name"] for row in cur.fetchall()}
+                for table_name in TABLES:
+                    if table_name in existing:
+                        logger.warning(
+                            f"Table {table_name} already exists, drop the tables first if you wish to recreate"
+                        )
+                for statement in SCHEMA:
+                    cur.execute(statement)
+
+    def drop_tables(self, conn, force):
+        stmts = ["DROP VIEW IF EXISTS abis", "DROP VIEW IF EXISTS all_events"]
+        stmts += [f"DROP TABLE IF EXISTS {table}" for table in TABLES]
+        with conn:
+            with conn.cursor() as cur:
+                for stmt in stmts:
+                    logger.info("executing %r", stmt)
+                    if force:
+                        cur.execute(stmt)
+
+
+def event_row(event: logdecode.Event):
+    return (
+        serialize.hexlify(event.transactionhash),
+        event.blocknumber,
+        event.address,
+        event.name,
+        serialize.encode_args(event.args),
+        serialize.hexlify(event.blockhash),
+        event.transactionindex,
+        event.logindex,
+        event.timestamp,
+    )
+
+
+class Connection:
+    """a SQLite connection behaving like a psycopg2 connection"""
+
+    storage = SQLiteStorage()
+
+    def __init__(self, path):
+        self.path = path
+        # transactions are started by begin, not by the sqlite3 module
+        self.raw = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        self.raw.row_factory = _dict_row
+        self.raw.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode, a crash may lose the last transactions, but never
+        # leaves the database inconsistent
+        self.raw.execute("PRAGMA synchronous=NORMAL")
+        self.closed = False
+
+    def begin(self):
+        if not self.raw.in_transaction:
+            self.raw.execute("BEGIN IMMEDIATE")
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def close(self):
+        self.raw.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+def check_sqlite_version(version_info=sqlite3.sqlite_version_info):
+    """raise a RuntimeError, if the SQLite library is too old for our queries"""
+    if tuple(version_info) < MIN_SQLITE_VERSION:
+        raise RuntimeError(
+            "the SQLite storage needs SQLite {} or newer, python uses SQLite {}".format(
+                ".".join(map(str, MIN_SQLITE_VERSION)),
+                ".".join(map(str, version_info)),
+            )
+        )
+
+
+def connect(path) -> Connection:
+    check_sqlite_version()
+    return Connection(path)
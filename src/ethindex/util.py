@@ -1,5 +1,12 @@
+import itertools
 from importlib.metadata import version
 
 
 def get_version():
     return version("eth-index")
+
+
+def chunks(seq, size):
+    """split the sequence seq into lists of at most size elements"""
+    it = iter(seq)
+    return list(iter(lambda: list(itertools.islice(it, size)), []))
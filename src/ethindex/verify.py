@@ -0,0 +1,299 @@
+"""check that the stored events match the chain
+
+The events of a sync job in a range of confirmed blocks are compared by their
+digests. The digest of an event is the md5 hash of its transaction hash, log
+index, block hash, address and args, the digest of a range is the md5 hash of
+the digests of its events ordered by block number and log index. Postgres
+computes the digests of the stored events, so only the digests are read from
+the database. The events on the chain are fetched with eth_getLogs like a sync
+job fetches them.
+
+If the digests of a range differ, the range is bisected with further digest
+queries, until the mismatching blocks are found. The events fetched from the
+chain are kept in memory for that. Ranges are checked in parallel and are sized
+by the event density statistics like the rounds of a sync job.
+"""
+import bisect
+import concurrent.futures
+import hashlib
+import json
+import logging
+import sys
+from typing import Any, List, Optional, Tuple
+
+import click
+import psycopg2.extras
+import psycopg2.pool
+
+from ethindex import density, logdecode, pgimport, retry, rpc, serialize, util
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+
+Digest = Tuple[int, Optional[str]]
+
+
+def jsonb_text(value: Any) -> str:
+    """format value like postgres formats a jsonb value as text
+
+    jsonb stores the keys of objects ordered by length and then bytewise."""
+    if isinstance(value, dict):
+        items = sorted(
+            value.items(), key=lambda item: (len(item[0].encode()), item[0].encode())
+        )
+        return (
+            "{"
+            + ", ".join(f"{jsonb_text(key)}: {jsonb_text(v)}" for key, v in items)
+            + "}"
+        )
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(jsonb_text(v) for v in value) + "]"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = serialize.hexlify(value)
+    return json.dumps(value, ensure_ascii=False)
+
+
+def event_digest(event: logdecode.Event) -> str:
+    return hashlib.md5(
+        ":".join(
+            [
+                serialize.hexlify(event.transactionhash),
+                str(event.logindex),
+                serialize.hexlify(event.blockhash),
+                event.address,
+                jsonb_text(event.args),
+            ]
+        ).encode()
+    ).hexdigest()
+
+
+def combine_digests(digests: List[str]) -> Digest:
+    if not digests:
+        return 0, None
+    return len(digests), hashlib.md5("".join(digests).encode()).hexdigest()
+
+
+def stored_digest(cur, addresses, from_block, to_block) -> Digest:
+    """return the number and the digest of the stored events in the range"""
+    cur.execute(
+        """SELECT count(*) AS n,
+                  md5(string_agg(
+                    md5(transactionHash || ':' || logIndex || ':' || blockHash
+                        || ':' || address || ':' || coalesce(args::text, 'null')),
+                    '' ORDER BY blockNumber, logIndex)) AS digest
+           FROM events
+           WHERE blockNumber>=%s AND blockNumber<=%s AND address=ANY(%s)""",
+        (from_block, to_block, list(addresses)),
+    )
+    row = cur.fetchone()
+    return row["n"], row["digest"]
+
+
+class ChainEvents:
+    """the digests of the events fetched from the chain for a range"""
+
+    def __init__(self, events):
+        events = sorted(events, key=lambda event: (event.blocknumber, event.logindex))
+        self.block_numbers = [event.blocknumber for event in events]
+        self.digests = [event_digest(event) for event in events]
+
+    def digest(self, from_block, to_block) -> Digest:
+        start = bisect.bisect_left(self.block_numbers, from_block)
+        end = bisect.bisect_right(self.block_numbers, to_block)
+        return combine_digests(self.digests[start:end])
+
+
+def find_mismatches(
+    cur, addresses, chain_events: ChainEvents, from_block, to_block
+) -> List[Tuple[int, int]]:
+    """return the mismatching blocks of the range as ranges of blocks"""
+    if stored_digest(cur, addresses, from_block, to_block) == chain_events.digest(
+        from_block, to_block
+    ):
+        return []
+    if from_block == to_block:
+        return [(from_block, to_block)]
+    middle = (from_block + to_block) // 2
+    mismatches = find_mismatches(cur, addresses, chain_events, from_block, middle)
+    mismatches += find_mismatches(cur, addresses, chain_events, middle + 1, to_block)
+    return merge_ranges(mismatches)
+
+
+def merge_ranges(ranges) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for first, last in ranges:
+        if merged and merged[-1][1] + 1 == first:
+            merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+class Verifier:
+    """compares the events of a sync job with the chain"""
+
+    def __init__(
+        self,
+        pool,
+        web3,
+        topic_index: logdecode.TopicIndex,
+        addresses_per_shard=None,
+    ):
+        self.pool = pool
+        self.web3 = web3
+        self.raw_client = rpc.make_raw_client(web3)
+        self.topic_index = topic_index
+        self.addresses_per_shard = addresses_per_shard
+        self.retrier = retry.Retrier("json-rpc request", retry_on=rpc.TRANSIENT_ERRORS)
+
+    def verify_range(self, from_block, to_block) -> List[Tuple[int, int]]:
+        """return the mismatching blocks of the range"""
+        events = pgimport.get_events(
+            self.web3,
+            self.topic_index,
+            from_block,
+            to_block,
+            addresses_per_shard=self.addresses_per_shard,
+            retrier=self.retrier,
+            raw_client=self.raw_client,
+        )
+        chain_events = ChainEvents(events)
+        conn = self.pool.getconn()
+        try:
+            if not conn.autocommit:
+                conn.set_session(readonly=True, autocommit=True)
+            with conn.cursor() as cur:
+                mismatches = find_mismatches(
+                    cur, self.topic_index.addresses, chain_events, from_block, to_block
+                )
+        finally:
+            self.pool.putconn(conn)
+        logger.info(
+            "checked %s events of blocks %s -> %s, %s",
+            len(chain_events.digests),
+            from_block,
+            to_block,
+            f"mismatches in {mismatches}" if mismatches else "ok",
+        )
+        return mismatches
+
+    def verify(self, ranges, workers=DEFAULT_WORKERS) -> List[Tuple[int, int]]:
+        """check the ranges in parallel, return the mismatching blocks"""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda r: self.verify_range(*r), ranges)
+            return merge_ranges(
+                [mismatch for mismatches in results for mismatch in mismatches]
+            )
+
+
+def plan_ranges(cur, from_block, to_block) -> List[Tuple[int, int]]:
+    """split the block range into ranges of about the size of a sync round"""
+    event_density = density.load_event_density(cur)
+    ranges = []
+    while from_block <= to_block:
+        last = min(
+            to_block,
+            event_density.plan_round(
+                from_block,
+                pgimport.Synchronizer.events_per_round,
+                pgimport.Synchronizer.blocks_per_round,
+            ),
+        )
+        ranges.append((from_block, last))
+        from_block = last + 1
+    return ranges
+
+
+def verify_events(
+    pool,
+    web3,
+    syncid,
+    from_block=0,
+    to_block=None,
+    workers=DEFAULT_WORKERS,
+    addresses_per_shard=None,
+) -> List[Tuple[int, int]]:
+    """compare the events of syncid in the block range with the chain and
+    return the mismatching blocks
+
+    to_block defaults to and is capped at the last confirmed block of syncid.
+    """
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""SELECT * FROM sync WHERE syncid=%s""", (syncid,))
+                row = cur.fetchone()
+                if row is None:
+                    raise RuntimeError(f"no sync row for {syncid}")
+                if to_block is None or to_block > row["last_confirmed_block_number"]:
+                    to_block = row["last_confirmed_block_number"]
+                topic_index = pgimport.topic_index_from_db(
+                    conn, addresses=row["addresses"], event_names=row["event_names"]
+                )
+                ranges = plan_ranges(cur, from_block, to_block)
+    finally:
+        pool.putconn(conn)
+    logger.info(
+        "verifying blocks %s -> %s of %s in %s ranges",
+        from_block,
+        to_block,
+        syncid,
+        len(ranges),
+    )
+    verifier = Verifier(
+        pool, web3, topic_index, addresses_per_shard=addresses_per_shard
+    )
+    return verifier.verify(ranges, workers=workers)
+
+
+@click.command()
+@click.option(
+    "--jsonrpc",
+    help="jsonrpc URL to use, can be given multiple times to spread the requests "
+    "over multiple endpoints",
+    default=["http://127.0.0.1:8545"],
+    multiple=True,
+)
+@click.option("--syncid", help="syncid of the sync job to check", default="default")
+@click.option("--from-block", default=0, show_default=True)
+@click.option(
+    "--to-block",
+    help="defaults to the last confirmed block of the sync job",
+    type=int,
+    default=None,
+)
+@click.option(
+    "--workers",
+    help="number of ranges to check in parallel",
+    default=DEFAULT_WORKERS,
+    show_default=True,
+)
+@click.option(
+    "--addresses-per-request",
+    help="split the addresses into shards of this size, fetching the logs of "
+    "each shard with a separate eth_getLogs request",
+    type=int,
+    default=None,
+)
+def verify(jsonrpc, syncid, from_block, to_block, workers, addresses_per_request):
+    """check that the stored events match the chain"""
+    logging.basicConfig(level=logging.INFO)
+    logger.info("version %s starting", util.get_version())
+    pool = psycopg2.pool.ThreadedConnectionPool(
+        1, workers + 1, "", cursor_factory=psycopg2.extras.RealDictCursor
+    )
+    mismatches = verify_events(
+        pool,
+        rpc.make_web3(list(jsonrpc)),
+        syncid,
+        from_block=from_block,
+        to_block=to_block,
+        workers=workers,
+        addresses_per_shard=addresses_per_request,
+    )
+    if mismatches:
+        logger.error("the events of the blocks %s do not match the chain", mismatches)
+        sys.exit(1)
+    logger.info("all events match the chain")
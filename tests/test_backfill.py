@@ -0,0 +1,121 @@
+"""test the parallel backfill of a block range"""
+
+import pytest
+
+from ethindex import backfill, pgimport, rpc
+
+
+def fetch_table(conn, query):
+    with conn.cursor() as cur:
+        cur.execute(query)
+        return cur.fetchall()
+
+
+def fetch_events(conn):
+    return fetch_table(
+        conn, "select * from events order by blocknumber, transactionindex, logindex"
+    )
+
+
+def fetch_sync_rows(conn):
+    return fetch_table(conn, "select * from sync order by syncid")
+
+
+@pytest.fixture
+def tables(testenv, conn):
+    pgimport.do_createtables(conn)
+    pgimport.do_importabi(
+        conn, testenv.addresses_json_path, testenv.contracts_json_path
+    )
+
+
+def test_split_range():
+    assert backfill.split_range(0, 9, 3) == [(0, 2), (3, 5), (6, 9)]
+    assert backfill.split_range(5, 6, 4) == [(5, 5), (6, 6)]
+
+
+def test_is_worker_syncid():
+    assert backfill.is_worker_syncid("default", "default/backfill/3")
+    assert not backfill.is_worker_syncid("default", "other/backfill/3")
+    assert not backfill.is_worker_syncid("default", "default")
+
+
+def test_backfill_equals_sequential_sync(testenv, event_emitter, conn, tables):
+    for i in range(5):
+        event_emitter.add_some_tranfer_events()
+    end_block = testenv.web3.eth.blockNumber
+
+    worker_syncids = backfill.plan_backfill(conn, "default", 0, end_block, workers=3)
+    assert len(worker_syncids) == 3
+    for syncid in worker_syncids:
+        backfill.sync_worker(conn, testenv.web3, syncid, required_confirmations=0)
+    backfill.finish_backfill(conn, "default")
+
+    sync_rows = fetch_sync_rows(conn)
+    assert [row["syncid"] for row in sync_rows] == ["default"]
+    assert sync_rows[0]["last_confirmed_block_number"] == end_block
+    backfilled_events = fetch_events(conn)
+    assert len(backfilled_events) == 15
+
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("delete from events")
+            cur.execute("delete from sync")
+    pgimport.ensure_default_entry(conn)
+    pgimport.Synchronizer(
+        conn, testenv.web3, "default", required_confirmations=0
+    ).sync_until_current()
+    assert fetch_events(conn) == backfilled_events
+
+
+def test_backfill_is_resumable(testenv, event_emitter, conn, tables):
+    for i in range(2):
+        event_emitter.add_some_tranfer_events()
+    end_block = testenv.web3.eth.blockNumber
+
+    worker_syncids = backfill.plan_backfill(conn, "default", 0, end_block, workers=2)
+    backfill.sync_worker(
+        conn, testenv.web3, worker_syncids[0], required_confirmations=0
+    )
+    with pytest.raises(RuntimeError):
+        backfill.finish_backfill(conn, "default")
+
+    # planning again returns the existing workers
+    assert (
+        backfill.plan_backfill(conn, "default", 0, end_block, workers=5)
+        == worker_syncids
+    )
+    backfill.sync_worker(
+        conn, testenv.web3, worker_syncids[1], required_confirmations=0
+    )
+    backfill.finish_backfill(conn, "default")
+    assert len(fetch_events(conn)) == 6
+    with pytest.raises(RuntimeError):
+        backfill.plan_backfill(conn, "default", 0, end_block)
+
+
+def test_backfill_worker_retries_block_hash_mismatch(
+    testenv, event_emitter, conn, tables, monkeypatch
+):
+    event_emitter.add_some_tranfer_events()
+    end_block = testenv.web3.eth.blockNumber
+    worker_syncids = backfill.plan_backfill(conn, "default", 0, end_block, workers=1)
+
+    mismatches = []
+
+    def ensure_block_hash_agreement(self, block_number, expected_hash=None):
+        if not mismatches:
+            mismatches.append(block_number)
+            raise rpc.BlockHashMismatch(f"endpoints disagree on block {block_number}")
+
+    monkeypatch.setattr(
+        pgimport.Synchronizer,
+        "_ensure_block_hash_agreement",
+        ensure_block_hash_agreement,
+    )
+    backfill.sync_worker(
+        conn, testenv.web3, worker_syncids[0], required_confirmations=0
+    )
+    assert len(mismatches) == 1
+    backfill.finish_backfill(conn, "default")
+    assert len(fetch_events(conn)) == 3
@@ -76,3 +76,92 @@ def test_sync_until_current(testenv, event_emitter, conn, synchronizer, caplog):
     values = fetch_events(conn)
     print(values)
     assert len(values) == 33
+
+
+def test_checkpoints_are_committed(testenv, event_emitter, conn, synchronizer):
+    for _ in range(4):
+        event_emitter.add_some_tranfer_events()  # add events with values 0 to 11
+    synchronizer.required_confirmations = 0
+    synchronizer.blocks_per_checkpoint = 3
+
+    fetch_events_in_range = synchronizer._fetch_events
+    calls = []
+
+    def crash_on_third_checkpoint(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise ConnectionError("json-rpc endpoint went away")
+        return fetch_events_in_range(*args)
+
+    synchronizer._fetch_events = crash_on_third_checkpoint
+    with pytest.raises(ConnectionError):
+        synchronizer.sync_round()
+    conn.rollback()
+
+    # the first two checkpoints have been committed
+    with conn.cursor() as cur:
+        cur.execute("select last_confirmed_block_number from sync")
+        assert cur.fetchone()["last_confirmed_block_number"] == 5
+
+    del synchronizer._fetch_events
+    synchronizer.sync_until_current()
+    assert fetch_events(conn) == list(range(12))
+
+
+def fetch_values(conn, table, condition="true"):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""select * from {table} where {condition}
+                order by blocknumber, logindex"""
+        )
+        return [event["args"]["_value"] for event in cur.fetchall()]
+
+
+def assert_unconfirmed_events_separated(conn, synchronizer):
+    last_confirmed = synchronizer.last_confirmed_block_number
+    assert fetch_values(conn, "events", f"blocknumber>{last_confirmed}") == []
+    assert (
+        fetch_values(conn, "events_unconfirmed", f"blocknumber<={last_confirmed}") == []
+    )
+
+
+def test_reorg_with_unconfirmed_table(testenv, event_emitter, conn, synchronizer):
+    synchronizer.unconfirmed_table = True
+    event_emitter.add_some_tranfer_events()  # add events with values 0, 1, 2
+    snapshot = testenv.ethereum_tester.take_snapshot()
+    event_emitter.add_some_tranfer_events()  # add events with values 3, 4, 5
+    synchronizer.sync_until_current()
+    assert fetch_values(conn, "all_events") == [0, 1, 2, 3, 4, 5]
+    assert fetch_values(conn, "events_unconfirmed") != []
+    assert_unconfirmed_events_separated(conn, synchronizer)
+
+    testenv.ethereum_tester.revert_to_snapshot(snapshot)
+    event_emitter.add_some_tranfer_events()  # add events with values 6, 7, 8
+    event_emitter.add_some_tranfer_events()  # add events with values 9, 10, 11
+    synchronizer.sync_until_current()
+    assert fetch_values(conn, "all_events") == [0, 1, 2, 6, 7, 8, 9, 10, 11]
+    assert_unconfirmed_events_separated(conn, synchronizer)
+
+    # confirm all these events
+    for i in range(4):
+        event_emitter.add_some_tranfer_events()
+    synchronizer.sync_until_current()
+    assert fetch_values(conn, "events")[:9] == [0, 1, 2, 6, 7, 8, 9, 10, 11]
+    assert len(fetch_values(conn, "all_events")) == 21
+    assert_unconfirmed_events_separated(conn, synchronizer)
+
+
+def test_lost_unconfirmed_events_are_resynced(
+    testenv, event_emitter, conn, synchronizer
+):
+    synchronizer.unconfirmed_table = True
+    event_emitter.add_some_tranfer_events()
+    synchronizer.sync_until_current()
+    assert fetch_values(conn, "all_events") == [0, 1, 2]
+
+    # this is what a crash of postgres does to unlogged tables
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("truncate events_unconfirmed, sync_unconfirmed")
+    synchronizer.sync_until_current()
+    assert fetch_values(conn, "all_events") == [0, 1, 2]
@@ -52,6 +52,27 @@ def test_importabi(conn, testenv):
         assert len(abis) == len(testenv.contract_addresses)
 
 
+def test_importabi_stores_abi_once(conn, testenv):
+    err = subprocess.call(["ethindex", "createtables"])
+    assert err == 0
+    err = subprocess.call(
+        [
+            "ethindex",
+            "importabi",
+            "--addresses",
+            testenv.addresses_json_path,
+            "--contracts",
+            testenv.contracts_json_path,
+        ]
+    )
+    assert err == 0
+    with conn.cursor() as cur:
+        cur.execute("select * from abi_contents")
+        assert len(cur.fetchall()) == 1
+        cur.execute("select * from contract_abis")
+        assert len(cur.fetchall()) == len(testenv.contract_addresses)
+
+
 def test_importabi_replaces_abi(conn, testenv):
     err = subprocess.call(["ethindex", "createtables"])
     assert err == 0
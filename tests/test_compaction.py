@@ -0,0 +1,72 @@
+"""test compacting the graph feed"""
+
+import gzip
+import json
+
+from ethindex import compaction, pgimport
+from ethindex.logdecode import GraphUpdate
+
+NETWORK = "0x" + "11" * 20
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+CAROL = "0x" + "cc" * 20
+
+
+def balance_update(from_, to, value, blocknumber):
+    return GraphUpdate(
+        name=pgimport.BALANCE_UPDATE_EVENT_NAME,
+        args={"_from": from_, "_to": to, "_value": value},
+        address=NETWORK,
+        timestamp=1000 + blocknumber,
+        blocknumber=blocknumber,
+    )
+
+
+def trustline_update(creditor, debtor, blocknumber):
+    return GraphUpdate(
+        name=pgimport.TRUSTLINE_UPDATE_EVENT_NAME,
+        args={"_creditor": creditor, "_debtor": debtor, "_creditlineGiven": 1},
+        address=NETWORK,
+        timestamp=1000 + blocknumber,
+        blocknumber=blocknumber,
+    )
+
+
+def fetch_graphfeed_ids(conn):
+    with conn.cursor() as cur:
+        cur.execute("select id from graphfeed order by id")
+        return [row["id"] for row in cur.fetchall()]
+
+
+def test_compact_graphfeed(conn, synchronizer, tmpdir):
+    with conn.cursor() as cur:
+        cur.execute("update sync set last_confirmed_block_number=10")
+        pgimport.insert_graph_feed_updates(
+            cur,
+            [
+                balance_update(ALICE, BOB, 1, 1),
+                balance_update(BOB, ALICE, 2, 2),
+                trustline_update(ALICE, BOB, 3),
+                balance_update(ALICE, CAROL, 3, 4),
+                # not confirmed yet
+                balance_update(ALICE, BOB, 4, 20),
+            ],
+        )
+    conn.commit()
+    ids = fetch_graphfeed_ids(conn)
+    with conn.cursor() as cur:
+        assert compaction.safe_watermark(cur) == ids[3]
+
+    assert compaction.compact_graphfeed(conn, str(tmpdir)) == 1
+    assert fetch_graphfeed_ids(conn) == ids[1:]
+
+    archives = tmpdir.listdir()
+    assert len(archives) == 1
+    with gzip.open(str(archives[0]), "rt") as archive:
+        rows = [json.loads(line) for line in archive]
+    assert [row["id"] for row in rows] == ids[:1]
+    assert rows[0]["args"]["_value"] == 1
+
+    # nothing left to compact
+    assert compaction.compact_graphfeed(conn, str(tmpdir)) == 0
+    assert len(tmpdir.listdir()) == 1
@@ -0,0 +1,109 @@
+"""test the event density statistics"""
+
+import types
+
+from ethindex import density
+from ethindex.density import BUCKET_BLOCKS, BucketStats
+
+
+def make_events(*block_numbers):
+    return [types.SimpleNamespace(blocknumber=n) for n in block_numbers]
+
+
+def test_count_events():
+    events = make_events(5, 5, 7, BUCKET_BLOCKS + 1, 2 * BUCKET_BLOCKS)
+    assert density.count_events(events, 6, BUCKET_BLOCKS + 9) == {
+        0: BucketStats(BUCKET_BLOCKS - 6, 1, 1),
+        1: BucketStats(10, 1, 1),
+    }
+    assert density.count_events(events, 0, 9) == {0: BucketStats(10, 3, 2)}
+
+
+def test_event_density_uses_closest_bucket():
+    event_density = density.EventDensity(
+        [
+            ("a", 2, BucketStats(100, 10, 5)),
+            ("b", 2, BucketStats(100, 50, 5)),
+            ("a", 5, BucketStats(10, 1, 1)),
+        ]
+    )
+    assert event_density.events_per_block(2) == 0.5
+    assert event_density.events_per_block(0) == 0.5
+    assert event_density.events_per_block(4) == 0.5
+    assert event_density.events_per_block(7) == 0.1
+    assert density.EventDensity().events_per_block(3) == 0.0
+
+
+def test_event_density_add():
+    event_density = density.EventDensity([("a", 0, BucketStats(10, 0, 0))])
+    assert event_density.events_per_block(0) == 0.0
+    event_density.add("a", {0: BucketStats(10, 20, 10)})
+    assert event_density.stats[("a", 0)] == BucketStats(20, 20, 10)
+    assert event_density.events_per_block(0) == 1.0
+
+
+def test_plan_round():
+    event_density = density.EventDensity(
+        [("a", 0, BucketStats(BUCKET_BLOCKS, 0, 0)), ("a", 1, BucketStats(100, 50, 10))]
+    )
+    # no events, the round has max_blocks blocks
+    assert event_density.plan_round(0, 1000, 5000) == 4999
+    assert density.EventDensity().plan_round(7, 1000, 50000) == 50006
+    # the empty bucket costs 0.2 rounds, the rest is made of the dense bucket
+    last = event_density.plan_round(0, 1000, 50000)
+    assert BUCKET_BLOCKS + 1500 < last < BUCKET_BLOCKS + 1600
+    # half an event per block, about 2000 blocks are a round of 1000 events
+    last = event_density.plan_round(BUCKET_BLOCKS, 1000, 50000)
+    assert BUCKET_BLOCKS + 1900 < last < BUCKET_BLOCKS + 2000
+    events, event_blocks = event_density.estimate(BUCKET_BLOCKS, last)
+    assert 950 < events < 1000
+    assert 190 < event_blocks < 200
+    # at least one block
+    assert event_density.plan_round(BUCKET_BLOCKS, 0.1, 50000) == BUCKET_BLOCKS
+
+
+def test_split_range():
+    event_density = density.EventDensity(
+        [("a", 0, BucketStats(BUCKET_BLOCKS, 0, 0)), ("a", 1, BucketStats(100, 50, 10))]
+    )
+    ranges = event_density.split_range(0, 2 * BUCKET_BLOCKS - 1, 2, 1000, 50000)
+    assert len(ranges) == 2
+    assert ranges[0][0] == 0
+    assert ranges[1][1] == 2 * BUCKET_BLOCKS - 1
+    assert ranges[0][1] + 1 == ranges[1][0]
+    # the dense second bucket is split, the first half is mostly empty blocks
+    assert BUCKET_BLOCKS < ranges[0][1] < 2 * BUCKET_BLOCKS - 1
+    first_cost = event_density.cost(*ranges[0], 1000, 50000)
+    second_cost = event_density.cost(*ranges[1], 1000, 50000)
+    assert abs(first_cost - second_cost) < 0.01
+
+    assert density.EventDensity().split_range(0, 9, 3, 1000, 50000) == [
+        (0, 2),
+        (3, 5),
+        (6, 9),
+    ]
+    assert density.EventDensity().split_range(5, 6, 4, 1000, 50000) == [
+        (5, 5),
+        (6, 6),
+    ]
+
+
+def test_forecast():
+    forecast = density.Forecast()
+    assert forecast.eta(10) is None
+    forecast.record(2.0, 10.0)
+    assert forecast.eta(10).total_seconds() == 50
+    forecast.record(1.0, 15.0)
+    assert forecast.eta(1).total_seconds() == 8
+
+
+def test_sync_records_event_density(testenv, event_emitter, conn, synchronizer):
+    synchronizer.required_confirmations = 0
+    event_emitter.add_some_tranfer_events()
+    synchronizer.sync_until_current()
+    latest_block_number = testenv.web3.eth.blockNumber
+    with conn.cursor() as cur:
+        event_density = density.load_event_density(cur)
+    assert event_density.stats == {
+        ("default", 0): BucketStats(latest_block_number + 1, 3, 3)
+    }
@@ -1,4 +1,4 @@
-from ethindex import pgimport
+from ethindex import logdecode, pgimport
 
 
 def test_get_events(testenv, event_emitter):
@@ -46,6 +46,17 @@ def test_topic_index_from_db(testenv, event_emitter, conn):
     assert events1 == events3
 
 
+def test_topic_index_shares_decoders(testenv):
+    topic_index = logdecode.TopicIndex(
+        {address: list(testenv.abi) for address in testenv.contract_addresses}
+    )
+    assert len(topic_index.abi_hash2decoders) == 1
+    decoders = [
+        topic_index.address2decoders[address] for address in testenv.contract_addresses
+    ]
+    assert all(d is decoders[0] for d in decoders)
+
+
 def test_should_not_crash_on_unknown_event(testenv, event_emitter, conn):
     """Test that the indexer will not emit an error when an unknown event is emitted from an indexed address"""
     for abi_element in testenv.abi:
@@ -61,3 +72,73 @@ def test_should_not_crash_on_unknown_event(testenv, event_emitter, conn):
     )
 
     pgimport.get_events(testenv.web3, testenv.topic_index, 0, "latest")
+
+
+def test_get_events_with_event_name_allowlist(testenv, event_emitter):
+    event_emitter.add_some_tranfer_events()
+    address2abi = {address: testenv.abi for address in testenv.contract_addresses}
+
+    topic_index = logdecode.TopicIndex(address2abi, event_names=["Transfer"])
+    events = pgimport.get_events(testenv.web3, topic_index, 0, "latest")
+    assert [event.name for event in events] == ["Transfer"] * 3
+
+    topic_index = logdecode.TopicIndex(address2abi, event_names=["NoSuchEvent"])
+    assert topic_index.topics == []
+    assert pgimport.get_events(testenv.web3, topic_index, 0, "latest") == []
+
+
+def test_get_events_sharded(testenv, event_emitter):
+    event_emitter.add_some_tranfer_events()
+    event_emitter.add_some_tranfer_events()
+    events = pgimport.get_events(testenv.web3, testenv.topic_index, 0, "latest")
+    sharded_events = pgimport.get_events(
+        testenv.web3,
+        testenv.topic_index,
+        0,
+        "latest",
+        addresses_per_shard=1,
+        max_workers=1,
+    )
+    assert len(events) == 6
+    assert sharded_events == events
+
+
+def test_event_args_are_decoded_lazily(testenv, event_emitter):
+    event_emitter.add_some_tranfer_events()
+    events = pgimport.get_events(testenv.web3, testenv.topic_index, 0, "latest")
+    event = events[0]
+    assert event._args is None
+    assert event.args["_value"] == 0
+    assert event._data is None and event._topics is None
+    assert isinstance(event.blockhash, bytes)
+
+
+def test_decode_events_in_batches(testenv, event_emitter):
+    event_emitter.add_some_tranfer_events()
+    event_emitter.add_some_tranfer_events()
+    events = pgimport.get_events(testenv.web3, testenv.topic_index, 0, "latest")
+    expected_args = [
+        event._decoder.decode_generic(event._data, event._topics) for event in events
+    ]
+    logdecode.decode_events(events)
+    assert all(event._data is None for event in events)
+    assert [event.args for event in events] == expected_args
+
+
+def test_merge_needs_same_event_names(testenv, conn):
+    pgimport.do_createtables(conn)
+    pgimport.do_importabi(
+        conn, testenv.addresses_json_path, testenv.contracts_json_path
+    )
+    pgimport.insert_sync_entry(conn, "all", testenv.contract_addresses[:1])
+    pgimport.insert_sync_entry(
+        conn, "transfers", testenv.contract_addresses[1:], event_names=["Transfer"]
+    )
+    conn.commit()
+    synchronizer = pgimport.Synchronizer(
+        conn, testenv.web3, "transfers", merge_with_syncid="all"
+    )
+    assert not synchronizer.try_merge()
+    with conn.cursor() as cur:
+        cur.execute("select syncid from sync order by syncid")
+        assert [row["syncid"] for row in cur.fetchall()] == ["all", "transfers"]
@@ -0,0 +1,125 @@
+"""test following the head of the chain"""
+
+from ethindex import follow
+
+
+def fetch_events(conn):
+    with conn.cursor() as cur:
+        cur.execute("select * from events order by blocknumber")
+        rows = cur.fetchall()
+        return [event["args"]["_value"] for event in rows]
+
+
+def fetch_sync_row(conn):
+    with conn.cursor() as cur:
+        cur.execute("select * from sync")
+        return cur.fetchone()
+
+
+def test_unconfirmed_window():
+    window = follow.UnconfirmedWindow(10, "0x10")
+    headers = [
+        follow.BlockHeader(11, "0x11", "0x10"),
+        follow.BlockHeader(12, "0x12", "0x11"),
+    ]
+    assert window.extends_head(headers)
+    assert not window.extends_head(headers[1:])
+    assert not window.extends_head([follow.BlockHeader(11, "0x11", "0xff")])
+
+    window.append(headers)
+    assert window.head.number == 12
+    window.prune(11)
+    assert [header.number for header in window.headers] == [12]
+    window.prune(12)
+    assert window.head.number == 12
+
+
+ADDRESS = "0x" + "ab" * 20
+TOPIC = "0x" + "cd" * 32
+
+
+def make_bloom(*values):
+    bloom = bytearray(follow.BLOOM_SIZE)
+    for value in values:
+        for index, mask in follow.bloom_bits(bytes.fromhex(value[2:])):
+            bloom[index] |= mask
+    return bytes(bloom)
+
+
+def test_bloom_bits():
+    # keccak of the zero address starts with 5380c7b7ae81, the low 11 bits of
+    # the first three pairs of bytes are 896, 1975 and 1665
+    assert follow.bloom_bits(bytes(20)) == ((143, 1), (9, 128), (47, 2))
+
+
+def test_logs_bloom_filter():
+    bloom_filter = follow.LogsBloomFilter([ADDRESS], [TOPIC])
+    assert bloom_filter.may_contain(make_bloom(ADDRESS, TOPIC))
+    assert bloom_filter.may_contain("0x" + make_bloom(ADDRESS, TOPIC).hex())
+    assert bloom_filter.may_contain(int.from_bytes(make_bloom(ADDRESS, TOPIC), "big"))
+    assert not bloom_filter.may_contain(bytes(follow.BLOOM_SIZE))
+    assert not bloom_filter.may_contain(make_bloom(ADDRESS))
+    assert not bloom_filter.may_contain(make_bloom(TOPIC, "0x" + "ef" * 20))
+    assert bloom_filter.may_contain(None)
+
+
+def test_bloom_stats():
+    stats = follow.BloomStats()
+    assert stats.skip_rate is None
+    stats.record(4, 4)
+    stats.record(4, 1)
+    assert stats.skip_rate == 5 / 8
+    assert (stats.requests, stats.skipped_requests) == (2, 1)
+
+
+def test_follow_head(testenv, event_emitter, conn, synchronizer):
+    synchronizer.required_confirmations = 2
+    synchronizer.follow_head = True
+    assert not synchronizer.follow_head_round()
+
+    event_emitter.add_some_tranfer_events()  # add events with values 0, 1, 2
+    synchronizer.sync_until_current()
+    assert synchronizer.follow_head_round()
+
+    event_emitter.add_some_tranfer_events()  # add events with values 3, 4, 5
+    assert synchronizer.follow_head_round()
+    assert fetch_events(conn) == [0, 1, 2, 3, 4, 5]
+    sync_row = fetch_sync_row(conn)
+    assert sync_row["last_block_number"] == testenv.web3.eth.blockNumber
+    assert sync_row["last_confirmed_block_number"] == testenv.web3.eth.blockNumber - 2
+    assert synchronizer.head_latency.blocks == 3
+    assert synchronizer.bloom_stats.blocks == 3
+
+
+def test_follow_head_skips_blocks_without_logs(
+    testenv, event_emitter, conn, synchronizer
+):
+    synchronizer.follow_head = True
+    event_emitter.add_some_tranfer_events()  # add events with values 0, 1, 2
+    synchronizer.sync_until_current()
+    testenv.ethereum_tester.mine_blocks(2)
+    assert synchronizer.follow_head_round()
+    assert synchronizer.bloom_stats.skipped_blocks == 2
+    assert synchronizer.bloom_stats.skipped_requests == 1
+
+    event_emitter.add_some_tranfer_events()  # add events with values 3, 4, 5
+    assert synchronizer.follow_head_round()
+    assert fetch_events(conn) == [0, 1, 2, 3, 4, 5]
+    assert synchronizer.bloom_stats.skipped_blocks == 2
+
+
+def test_follow_head_falls_back_on_reorg(testenv, event_emitter, conn, synchronizer):
+    synchronizer.follow_head = True
+    event_emitter.add_some_tranfer_events()  # add events with values 0, 1, 2
+    snapshot = testenv.ethereum_tester.take_snapshot()
+    event_emitter.add_some_tranfer_events()  # add events with values 3, 4, 5
+    synchronizer.sync_until_current()
+
+    testenv.ethereum_tester.revert_to_snapshot(snapshot)
+    event_emitter.add_some_tranfer_events()  # add events with values 6, 7, 8
+    event_emitter.add_some_tranfer_events()  # add events with values 9, 10, 11
+    assert not synchronizer.follow_head_round()
+    assert synchronizer.head_window is None
+
+    synchronizer.sync_until_current()
+    assert fetch_events(conn) == [0, 1, 2, 6, 7, 8, 9, 10, 11]
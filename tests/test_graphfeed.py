@@ -0,0 +1,64 @@
+"""test feeding the graph from the graph feed outbox"""
+
+from ethindex import pgimport
+from ethindex.logdecode import Event
+
+NETWORK = "0x" + "11" * 20
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+CAROL = "0x" + "cc" * 20
+
+
+def make_balance_update(value, blocknumber, logindex=0, to=BOB):
+    return Event(
+        name=pgimport.BALANCE_UPDATE_EVENT_NAME,
+        args={"_from": ALICE, "_to": to, "_value": value},
+        address=NETWORK,
+        blocknumber=blocknumber,
+        blockhash=blocknumber.to_bytes(32, "big"),
+        transactionhash=(blocknumber * 100 + logindex).to_bytes(32, "big"),
+        transactionindex=0,
+        logindex=logindex,
+        timestamp=1000 + blocknumber,
+    )
+
+
+def fetch_graphfeed(conn):
+    with conn.cursor() as cur:
+        cur.execute("select eventname, args from graphfeed order by id")
+        return [(row["eventname"], row["args"]["_value"]) for row in cur.fetchall()]
+
+
+def count_outbox_rows(conn):
+    with conn.cursor() as cur:
+        cur.execute("select count(*) from graphfeed_outbox")
+        return cur.fetchone()["count"]
+
+
+def test_graph_updates_go_through_outbox(conn, synchronizer):
+    synchronizer.update_graph_feed(
+        [make_balance_update(1, 1), make_balance_update(2, 2)], []
+    )
+    conn.commit()
+    assert fetch_graphfeed(conn) == []
+    assert count_outbox_rows(conn) == 2
+
+    assert synchronizer.feed_graph_from_outbox() == 2
+    assert fetch_graphfeed(conn) == [("BalanceUpdate", 1), ("BalanceUpdate", 2)]
+    assert count_outbox_rows(conn) == 0
+    assert synchronizer.feed_graph_from_outbox() == 0
+
+
+def test_removed_events_are_replaced(conn, synchronizer):
+    synchronizer.graph_feed_batch_size = 1
+    previous = make_balance_update(5, 1)
+    removed = make_balance_update(7, 2)
+    pgimport.insert_events(conn, [previous])
+    synchronizer.update_graph_feed([], [removed])
+    synchronizer.update_graph_feed([], [make_balance_update(9, 3, to=CAROL)])
+    conn.commit()
+
+    assert synchronizer.feed_graph_from_outbox() == 2
+    # the removed update between alice and bob is replaced by the previous one,
+    # there is no previous update between alice and carol
+    assert fetch_graphfeed(conn) == [("BalanceUpdate", 5), ("BalanceUpdate", 0)]
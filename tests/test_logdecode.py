@@ -0,0 +1,92 @@
+"""test decoding event args without eth_abi"""
+
+import eth_abi
+import pytest
+
+from ethindex import logdecode
+
+EVENT_ABI = {
+    "type": "event",
+    "name": "Test",
+    "anonymous": False,
+    "inputs": [
+        {"name": "_from", "type": "address", "indexed": True},
+        {"name": "_value", "type": "uint256", "indexed": False},
+        {"name": "_balance", "type": "int72", "indexed": False},
+        {"name": "_isFrozen", "type": "bool", "indexed": False},
+        {"name": "_id", "type": "bytes4", "indexed": False},
+        {"name": "_fee", "type": "int256", "indexed": True},
+    ],
+}
+DATA_TYPES = ["uint256", "int72", "bool", "bytes4"]
+ADDRESS = "0x" + "ab" * 20
+
+
+@pytest.fixture
+def decoder():
+    return logdecode.EventDecoder(EVENT_ABI)
+
+
+def make_topics(decoder, fee=-7):
+    return [
+        decoder.topic,
+        eth_abi.encode_single("address", ADDRESS),
+        eth_abi.encode_single("int256", fee),
+    ]
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        [5, -3, True, b"abcd"],
+        [pow(2, 256) - 1, pow(2, 71) - 1, False, b"\x00\x00\x00\x01"],
+        [0, -pow(2, 71), True, b"\xff\xff\xff\xff"],
+    ],
+)
+def test_word_decoding_equals_eth_abi(decoder, values):
+    assert decoder.data_word_decoders is not None
+    data = eth_abi.encode_abi(DATA_TYPES, values)
+    topics = make_topics(decoder)
+    args = decoder.decode(data, topics)
+    expected_args = decoder.decode_generic(data, topics)
+    assert args == expected_args
+    assert list(args) == list(expected_args)
+    assert [type(value) for value in args.values()] == [
+        type(value) for value in expected_args.values()
+    ]
+
+
+def test_decode_many(decoder):
+    logs = [
+        (
+            eth_abi.encode_abi(DATA_TYPES, [i, -i, i % 2 == 0, b"abcd"]),
+            make_topics(decoder, i),
+        )
+        for i in range(10)
+    ]
+    assert decoder.decode_many(logs) == [
+        decoder.decode_generic(data, topics) for data, topics in logs
+    ]
+
+
+def test_invalid_padding_is_rejected_like_eth_abi(decoder):
+    data = bytearray(eth_abi.encode_abi(DATA_TYPES, [1, 1, True, b"abcd"]))
+    # bool with a value of 2
+    data[95] = 2
+    with pytest.raises(eth_abi.exceptions.NonEmptyPaddingBytes):
+        decoder.decode(bytes(data), make_topics(decoder))
+
+
+def test_dynamic_types_use_eth_abi():
+    decoder = logdecode.EventDecoder(
+        {
+            "type": "event",
+            "name": "Dynamic",
+            "anonymous": False,
+            "inputs": [{"name": "_text", "type": "string", "indexed": False}],
+        }
+    )
+    assert decoder.data_word_decoders is None
+    assert decoder.decode(eth_abi.encode_abi(["string"], ["abc"]), [decoder.topic]) == {
+        "_text": "abc"
+    }
@@ -0,0 +1,175 @@
+"""test the log store and reimporting events from it"""
+
+import hexbytes
+import pytest
+
+from ethindex import logstore, pgimport, reproject
+
+ADDRESS = "0x" + "11" * 20
+
+
+def make_log(block_number, log_index, topics, data):
+    return {
+        "address": ADDRESS,
+        "blockNumber": block_number,
+        "blockHash": hexbytes.HexBytes(bytes([block_number]) * 32),
+        "transactionHash": hexbytes.HexBytes(b"\x02" * 32),
+        "transactionIndex": 0,
+        "logIndex": log_index,
+        "topics": [hexbytes.HexBytes(topic) for topic in topics],
+        "data": "0x" + data.hex(),
+    }
+
+
+def make_block(number):
+    return {
+        "number": number,
+        "timestamp": 1000 + number,
+        "hash": hexbytes.HexBytes(bytes([number]) * 32),
+    }
+
+
+def test_segment_roundtrip(tmpdir):
+    logs = [
+        make_log(3, 0, [b"\x01" * 32, b"\x02" * 32], b"data"),
+        make_log(3, 1, [], b""),
+        make_log(5, 0, [b"\x03" * 32], b"more data"),
+    ]
+    store = logstore.LogStore(str(tmpdir), segment_blocks=10)
+    store.append(1, 6, logs, [make_block(3), make_block(5)])
+    assert store.segment_ranges() == []
+    store.flush()
+    assert store.segment_ranges() == [(1, 6)]
+
+    stored_logs = list(store.iterate_logs(0, 10))
+    assert [(log["blockNumber"], log["logIndex"]) for log in stored_logs] == [
+        (3, 0),
+        (3, 1),
+        (5, 0),
+    ]
+    assert stored_logs[0]["address"] == ADDRESS
+    assert [bytes(topic) for topic in stored_logs[0]["topics"]] == [
+        b"\x01" * 32,
+        b"\x02" * 32,
+    ]
+    assert bytes(stored_logs[2]["data"]) == b"more data"
+    assert stored_logs[2]["blockHash"] == b"\x05" * 32
+    assert stored_logs[2].timestamp == 1005
+    assert [log["blockNumber"] for log in store.iterate_logs(4, 5)] == [5]
+
+
+def test_append_skips_stored_blocks(tmpdir):
+    store = logstore.LogStore(str(tmpdir), segment_blocks=5)
+    store.append(0, 4, [], [])
+    store.append(3, 7, [], [])
+    store.flush()
+    store.append(10, 11, [], [])
+    store.flush()
+    assert store.segment_ranges() == [(0, 4), (5, 7), (10, 11)]
+    assert store.missing_ranges(0, 12) == [(8, 9), (12, 12)]
+    assert store.missing_ranges(2, 6) == []
+
+
+def test_flush_writes_tail_segments(tmpdir):
+    store = logstore.LogStore(str(tmpdir), segment_blocks=10)
+    store.append(0, 2, [make_log(1, 0, [], b"a")], [make_block(1)], [ADDRESS])
+    store.flush()
+    store.flush()
+    store.append(3, 4, [], [], [ADDRESS])
+    store.flush()
+    assert store.segment_ranges() == [(0, 2), (3, 4)]
+
+    # a restarted sync job merges the tail segments into the full segment
+    store = logstore.LogStore(str(tmpdir), segment_blocks=10)
+    assert store.last_block() == 4
+    store.append(3, 9, [make_log(7, 0, [], b"b")], [make_block(7)], [ADDRESS])
+    assert store.segment_ranges() == [(0, 9)]
+    assert len(tmpdir.listdir()) == 1
+    assert [bytes(log["data"]) for log in store.iterate_logs(0, 9)] == [b"a", b"b"]
+    assert [log.timestamp for log in store.iterate_logs(0, 9)] == [1001, 1007]
+
+
+def test_segments_record_addresses(tmpdir):
+    other = "0x" + "22" * 20
+    store = logstore.LogStore(str(tmpdir))
+    store.append(0, 4, [make_log(3, 0, [], b"")], [make_block(3)], [other])
+    store.append(5, 6, [], [], [ADDRESS, other])
+    store.flush()
+    assert store.segment_ranges() == [(0, 4), (5, 6)]
+    # the address of the log is added to the addresses the logs were fetched for
+    assert [segment.addresses for segment in store.iterate_segments(0, 6)] == [
+        [other, ADDRESS],
+        [ADDRESS, other],
+    ]
+
+
+@pytest.fixture
+def store(tmpdir):
+    return logstore.LogStore(str(tmpdir))
+
+
+def fetch_events(conn):
+    with conn.cursor() as cur:
+        cur.execute("select * from events order by blocknumber, logindex")
+        return cur.fetchall()
+
+
+def test_reproject_events(testenv, conn, synchronizer, event_emitter, tmpdir):
+    for i in range(3):
+        event_emitter.add_some_tranfer_events()
+    synchronizer.required_confirmations = 2
+    synchronizer.log_store = logstore.LogStore(str(tmpdir))
+    synchronizer.sync_until_current()
+
+    # restart the sync job, which follows the head from now on
+    synchronizer = pgimport.Synchronizer(
+        conn,
+        testenv.web3,
+        "default",
+        required_confirmations=2,
+        follow_head=True,
+        log_store=logstore.LogStore(str(tmpdir)),
+    )
+    event_emitter.add_some_tranfer_events()
+    synchronizer.sync_until_current()
+    for i in range(2):
+        event_emitter.add_some_tranfer_events()
+        assert synchronizer.follow_head_round()
+
+    last_block = synchronizer.last_confirmed_block_number
+    synced_events = [
+        event for event in fetch_events(conn) if event["blocknumber"] <= last_block
+    ]
+    assert len(synced_events) == 16
+    store = logstore.LogStore(str(tmpdir))
+    assert store.missing_ranges(0, last_block) == []
+
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("delete from events where blocknumber <= %s", (last_block,))
+    count = reproject.reproject_events(conn, store, "default", 0, last_block)
+    assert count == 16
+    assert fetch_events(conn)[:16] == synced_events
+
+
+def test_reproject_keeps_events_of_uncovered_addresses(
+    conn, synchronizer, event_emitter, store
+):
+    event_emitter.add_some_tranfer_events()
+    synchronizer.required_confirmations = 0
+    synchronizer.sync_until_current()
+    synced_events = fetch_events(conn)
+    last_block = synchronizer.last_confirmed_block_number
+    # like the blocks synced before the addresses were onboarded
+    store.append(0, last_block, [], [])
+    store.flush()
+    assert reproject.reproject_events(conn, store, "default", 0, last_block) == 0
+    assert fetch_events(conn) == synced_events
+
+
+def test_reproject_needs_stored_blocks(conn, synchronizer, event_emitter, store):
+    event_emitter.add_some_tranfer_events()
+    synchronizer.required_confirmations = 0
+    synchronizer.sync_until_current()
+    with pytest.raises(RuntimeError):
+        reproject.reproject_events(conn, store, "default", 0, 1)
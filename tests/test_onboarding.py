@@ -0,0 +1,96 @@
+"""test onboarding new addresses into a running sync job"""
+
+import pytest
+
+from ethindex import pgimport
+
+
+def fetch_event_values(conn, address=None):
+    with conn.cursor() as cur:
+        cur.execute("select * from events order by blocknumber, logindex")
+        return [
+            row["args"]["_value"]
+            for row in cur.fetchall()
+            if address is None or row["address"] == address
+        ]
+
+
+def fetch_sync_row(conn):
+    with conn.cursor() as cur:
+        cur.execute("select * from sync")
+        return cur.fetchone()
+
+
+@pytest.fixture
+def synchronizer(testenv, conn):
+    """a synchronizer syncing all but the last contract"""
+    pgimport.do_createtables(conn)
+    pgimport.do_importabi(
+        conn, testenv.addresses_json_path, testenv.contracts_json_path
+    )
+    pgimport.insert_sync_entry(conn, "default", testenv.contract_addresses[:-1])
+    conn.commit()
+    return pgimport.Synchronizer(
+        conn,
+        testenv.web3,
+        "default",
+        required_confirmations=2,
+        onboard_new_addresses=True,
+    )
+
+
+def test_onboard_new_addresses(testenv, event_emitter, conn, synchronizer):
+    new_address = testenv.contract_addresses[-1]
+    for i in range(3):
+        event_emitter.add_some_tranfer_events()
+    synchronizer.sync_until_current()
+    assert fetch_event_values(conn, new_address) == []
+
+    assert not synchronizer.onboard_round()
+    # the events of the confirmed blocks have been synced
+    assert fetch_event_values(conn, new_address) == [2, 5]
+    sync_row = fetch_sync_row(conn)
+    assert sync_row["addresses"] == testenv.contract_addresses
+    with conn.cursor() as cur:
+        cur.execute("select * from sync_onboarding")
+        assert cur.fetchall() == []
+
+    # the unconfirmed blocks are synced again for all addresses
+    synchronizer.sync_until_current()
+    assert fetch_event_values(conn, new_address) == [2, 5, 8]
+    assert fetch_event_values(conn) == list(range(9))
+
+
+def test_onboard_in_rounds(testenv, event_emitter, conn, synchronizer):
+    synchronizer.blocks_per_round = 3
+    for i in range(3):
+        event_emitter.add_some_tranfer_events()
+    synchronizer.sync_until_current()
+    last_confirmed_block_number = fetch_sync_row(conn)["last_confirmed_block_number"]
+
+    rounds = 1
+    while synchronizer.onboard_round():
+        rounds += 1
+    assert rounds == (last_confirmed_block_number + 1 + 2) // 3
+    synchronizer.sync_until_current()
+    assert fetch_event_values(conn) == list(range(9))
+
+
+def test_no_addresses_to_onboard(testenv, conn, synchronizer):
+    synchronizer.onboard_new_addresses = False
+    synchronizer.sync_until_current()
+    assert not synchronizer.onboard_round()
+    assert fetch_sync_row(conn)["addresses"] == testenv.contract_addresses[:-1]
+
+
+def test_merge_moves_onboarding_addresses(testenv, conn, synchronizer):
+    pgimport.insert_sync_entry(conn, "other", [])
+    pgimport.add_onboarding_addresses(conn, "other", testenv.contract_addresses[-1:])
+    conn.commit()
+    other = pgimport.Synchronizer(
+        conn, testenv.web3, "other", merge_with_syncid="default"
+    )
+    assert other.try_merge()
+    with conn.cursor() as cur:
+        cur.execute("select syncid from sync_onboarding")
+        assert [row["syncid"] for row in cur.fetchall()] == ["default"]
@@ -0,0 +1,67 @@
+"""test querying the events table"""
+
+import pytest
+
+from ethindex import query
+
+USER = "0x0000000000000000000000000000000000000001"
+
+
+@pytest.fixture
+def synced(testenv, event_emitter, synchronizer):
+    for i in range(3):
+        event_emitter.add_some_tranfer_events()  # add events with values 0 to 8
+    synchronizer.required_confirmations = 0
+    synchronizer.sync_until_current()
+
+
+def values(events):
+    return [event["args"]["_value"] for event in events]
+
+
+def test_query_all_events(conn, synced):
+    page = query.query_events(conn, query.EventQuery())
+    assert values(page.events) == list(range(9))
+    assert page.next_cursor is None
+
+
+def test_query_by_address(conn, testenv, synced):
+    page = query.query_events(
+        conn, query.EventQuery(addresses=[testenv.contract_addresses[1].lower()])
+    )
+    assert values(page.events) == [1, 4, 7]
+
+
+def test_query_by_user(conn, synced):
+    # USER receives the transfers of the first contract and sends the transfers
+    # of the second contract
+    page = query.query_events(conn, query.EventQuery(user_address=USER))
+    assert values(page.events) == [0, 1, 3, 4, 6, 7]
+
+
+def test_query_by_block_range(conn, synced):
+    events = query.query_events(conn, query.EventQuery()).events
+    from_block = events[2]["blocknumber"]
+    to_block = events[4]["blocknumber"]
+    page = query.query_events(
+        conn, query.EventQuery(from_block=from_block, to_block=to_block)
+    )
+    assert values(page.events) == [2, 3, 4]
+
+
+def test_pagination(conn, synced):
+    event_query = query.EventQuery(event_names=["Transfer"])
+    first_page = query.query_events(conn, event_query, limit=4)
+    assert values(first_page.events) == [0, 1, 2, 3]
+    second_page = query.query_events(
+        conn, event_query, limit=4, cursor=first_page.next_cursor
+    )
+    assert values(second_page.events) == [4, 5, 6, 7]
+    assert values(query.iterate_events(conn, event_query, page_size=2)) == list(
+        range(9)
+    )
+
+
+def test_invalid_cursor(conn, synced):
+    with pytest.raises(ValueError):
+        query.query_events(conn, query.EventQuery(), cursor="foo")
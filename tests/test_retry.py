@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+from ethindex import retry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Flaky:
+    """callable failing the first `failures` calls"""
+
+    def __init__(self, failures, exception=ConnectionError):
+        self.failures = failures
+        self.exception = exception
+        self.calls = 0
+
+    def __call__(self, value):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.exception("flaky")
+        return value
+
+
+def test_retrier_retries_transient_errors():
+    sleeps = []
+    retrier = retry.Retrier("test", attempts=5, sleep=sleeps.append)
+    flaky = Flaky(3)
+    assert retrier(flaky, 42) == 42
+    assert flaky.calls == 4
+    assert len(sleeps) == 3
+
+
+def test_retrier_gives_up():
+    retrier = retry.Retrier("test", attempts=3, sleep=lambda delay: None)
+    flaky = Flaky(5)
+    with pytest.raises(ConnectionError):
+        retrier(flaky, 42)
+    assert flaky.calls == 3
+
+
+def test_retrier_does_not_retry_other_errors():
+    retrier = retry.Retrier(
+        "test", retry_on=(ConnectionError,), sleep=lambda delay: None
+    )
+    flaky = Flaky(1, exception=KeyError)
+    with pytest.raises(KeyError):
+        retrier(flaky, 42)
+    assert flaky.calls == 1
+
+
+def test_backoff_delays_are_bounded():
+    for attempt in range(20):
+        delay = retry.jittered_delay(attempt, base_delay=0.5, max_delay=10)
+        assert 0 <= delay <= min(10, 0.5 * pow(2, attempt))
+
+
+def test_circuit_breaker_opens_and_closes():
+    clock = FakeClock()
+    breaker = retry.CircuitBreaker(
+        "test", failure_threshold=2, reset_timeout=10, clock=clock
+    )
+    flaky = Flaky(2)
+    for i in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(flaky, 42)
+    assert breaker.is_open
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.call(flaky, 42)
+    assert flaky.calls == 2
+
+    clock.now = 11
+    assert breaker.call(flaky, 42) == 42
+    assert not breaker.is_open
+
+
+def test_half_open_circuit_breaker_lets_one_call_through():
+    clock = FakeClock()
+    breaker = retry.CircuitBreaker(
+        "test", failure_threshold=1, reset_timeout=10, clock=clock
+    )
+    with pytest.raises(ConnectionError):
+        breaker.call(Flaky(1), 42)
+    clock.now = 11
+    started = threading.Event()
+    release = threading.Event()
+
+    def trial():
+        started.set()
+        release.wait(5)
+        return 42
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(breaker.call(trial)))
+    thread.start()
+    assert started.wait(5)
+    assert breaker.is_open
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.call(Flaky(0), 43)
+    release.set()
+    thread.join()
+    assert results == [42]
+    assert breaker.call(Flaky(0), 43) == 43
+
+
+def test_retrier_stops_when_circuit_opens():
+    breaker = retry.CircuitBreaker("test", failure_threshold=2)
+    retrier = retry.Retrier(
+        "test", attempts=5, breaker=breaker, sleep=lambda delay: None
+    )
+    flaky = Flaky(5)
+    with pytest.raises(retry.CircuitOpenError):
+        retrier(flaky, 42)
+    assert flaky.calls == 2
+
+
+def test_backoff_resets():
+    clock = FakeClock()
+    backoff = retry.Backoff(base_delay=1, max_delay=1000, reset_after=60, clock=clock)
+    for i in range(10):
+        backoff.next_delay()
+    assert backoff.failures == 10
+    clock.now = 100
+    assert backoff.next_delay() <= 1
@@ -0,0 +1,269 @@
+"""test the multi endpoint json-rpc client against local stub json-rpc servers"""
+
+import concurrent.futures
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+from ethindex import rpc
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.received.append(request["method"])
+        time.sleep(server.delay)
+        if server.fail:
+            self.send_response(500)
+            self.end_headers()
+            return
+        if server.error is not None:
+            response = {"error": server.error}
+        elif request["method"] == "eth_getBlockByNumber":
+            response = {
+                "result": {"number": request["params"][0], "hash": server.block_hash}
+            }
+        else:
+            response = {"result": "0x10"}
+        body = json.dumps({"jsonrpc": "2.0", "id": request["id"], **response}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(http.server.ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.received = []
+        self.delay = 0
+        self.fail = False
+        # answer with this json-rpc error, if given
+        self.error = None
+        self.block_hash = "0x" + "ab" * 32
+
+    @property
+    def uri(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+
+@pytest.fixture
+def stub_servers():
+    servers = [StubServer() for i in range(3)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def provider(stub_servers):
+    return rpc.MultiEndpointProvider(
+        [server.uri for server in stub_servers], timeout=5, hedge_delay=0.05
+    )
+
+
+def test_requests_are_spread(provider, stub_servers):
+    for i in range(60):
+        assert provider.make_request("net_version", [])["result"] == "0x10"
+    assert all(server.received for server in stub_servers)
+
+
+def test_failover(provider, stub_servers):
+    for server in stub_servers[:2]:
+        server.fail = True
+    for i in range(20):
+        assert provider.make_request("net_version", [])["result"] == "0x10"
+    assert sum(endpoint.stats.errors for endpoint in provider.endpoints[:2]) > 0
+    assert provider.endpoints[2].stats.errors == 0
+
+
+@pytest.mark.parametrize("method", ["net_version", "eth_blockNumber"])
+def test_failover_on_node_error(provider, stub_servers, method):
+    for server in stub_servers[:2]:
+        server.error = {"code": -32000, "message": "header not found"}
+    for i in range(20):
+        assert provider.make_request(method, [])["result"] == "0x10"
+    assert sum(endpoint.stats.errors for endpoint in provider.endpoints[:2]) > 0
+    assert provider.endpoints[2].stats.errors == 0
+
+    stub_servers[2].error = {"code": -32005, "message": "rate limit exceeded"}
+    with pytest.raises(rpc.TRANSIENT_ERRORS):
+        provider.make_request(method, [])
+
+
+def test_failing_endpoint_is_avoided(provider, stub_servers):
+    stub_servers[0].fail = True
+    for i in range(20):
+        provider.make_request("net_version", [])
+    stub_servers[0].received.clear()
+    for i in range(20):
+        provider.make_request("net_version", [])
+    assert stub_servers[0].received == []
+
+
+def test_hedged_request(provider, stub_servers):
+    stub_servers[0].delay = 2
+    start = time.monotonic()
+    for i in range(10):
+        assert provider.make_request("eth_blockNumber", [])["result"] == "0x10"
+    assert time.monotonic() - start < 2
+    assert sum(endpoint.stats.hedged for endpoint in provider.endpoints) > 0
+
+
+def test_block_hash_agreement(provider):
+    provider.ensure_block_hash_agreement(5)
+    provider.ensure_block_hash_agreement(5, expected_hash="0x" + "AB" * 32)
+    with pytest.raises(rpc.BlockHashMismatch):
+        provider.ensure_block_hash_agreement(5, expected_hash="0x" + "cd" * 32)
+
+
+def test_block_hash_mismatch(provider, stub_servers):
+    stub_servers[2].block_hash = "0x" + "cd" * 32
+    with pytest.raises(rpc.BlockHashMismatch):
+        provider.ensure_block_hash_agreement(5)
+
+
+def test_raw_client_with_provider(provider):
+    raw_client = rpc.make_raw_client(rpc.Web3(provider))
+    assert raw_client.block_number() == 16
+
+
+def make_raw_client(result):
+    def send(request_data, method):
+        request = json.loads(request_data)
+        return json.dumps(
+            {"jsonrpc": "2.0", "id": request["id"], "result": result}
+        ).encode()
+
+    return rpc.RawClient(send)
+
+
+def test_raw_client_get_logs():
+    raw_client = make_raw_client(
+        [
+            {
+                "address": "0x" + "ab" * 20,
+                "blockNumber": "0x1b",
+                "blockHash": "0x" + "01" * 32,
+                "transactionHash": "0x" + "02" * 32,
+                "transactionIndex": "0x0",
+                "logIndex": "0x3",
+                "topics": ["0x" + "03" * 32],
+                "data": "0x0004",
+                "removed": False,
+            }
+        ]
+    )
+    assert raw_client.get_logs({"fromBlock": "0x0"}) == [
+        {
+            "address": "0xABaBaBaBABabABabAbAbABAbABabababaBaBABaB",
+            "blockNumber": 27,
+            "blockHash": b"\x01" * 32,
+            "transactionHash": b"\x02" * 32,
+            "transactionIndex": 0,
+            "logIndex": 3,
+            "topics": [b"\x03" * 32],
+            "data": b"\x00\x04",
+        }
+    ]
+
+
+def test_raw_client_get_block_header():
+    raw_client = make_raw_client(
+        {
+            "number": "0x10",
+            "hash": "0x" + "01" * 32,
+            "parentHash": "0x" + "02" * 32,
+            "timestamp": "0x5f5e100",
+            "logsBloom": "0x" + "00" * 256,
+            "transactions": [],
+        }
+    )
+    assert raw_client.get_block_header(16) == {
+        "number": 16,
+        "hash": b"\x01" * 32,
+        "parentHash": b"\x02" * 32,
+        "timestamp": 100000000,
+        "logsBloom": bytes(256),
+    }
+
+
+def test_raw_client_block_not_found():
+    with pytest.raises(rpc.TRANSIENT_ERRORS):
+        make_raw_client(None).get_block_header(16)
+
+
+def test_raw_client_error():
+    def send(request_data, method):
+        return b'{"jsonrpc": "2.0", "id": 1, "error": {"code": -32000}}'
+
+    with pytest.raises(ValueError):
+        rpc.RawClient(send).block_number()
+
+
+def test_request_budget_burst():
+    budget = rpc.RequestBudget(50, burst=2)
+    start = time.monotonic()
+    budget.acquire()
+    budget.acquire()
+    assert budget.throttled == [0, 0, 0]
+    budget.acquire(rpc.PRIORITY_BACKFILL)
+    assert time.monotonic() - start >= 0.015
+    assert budget.throttled == [0, 0, 1]
+    assert budget.wait_time[rpc.PRIORITY_BACKFILL] > 0
+    assert budget.queue_depth == 0
+
+
+def test_request_budget_prefers_higher_priority():
+    budget = rpc.RequestBudget(10, burst=1)
+    budget.acquire()
+    order = []
+
+    def acquire(priority):
+        with rpc.request_priority(priority):
+            budget.acquire()
+        order.append(priority)
+
+    backfill = threading.Thread(target=acquire, args=(rpc.PRIORITY_BACKFILL,))
+    backfill.start()
+    while budget.waiting[rpc.PRIORITY_BACKFILL] == 0:
+        time.sleep(0.001)
+    head = threading.Thread(target=acquire, args=(rpc.PRIORITY_HEAD,))
+    head.start()
+    backfill.join()
+    head.join()
+    assert order == [rpc.PRIORITY_HEAD, rpc.PRIORITY_BACKFILL]
+
+
+def test_request_priority_is_passed_to_executor_threads():
+    def get_priority():
+        return rpc._request_priority.get()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        with rpc.request_priority(rpc.PRIORITY_HEAD):
+            future = rpc.submit_with_context(executor, get_priority)
+        assert future.result() == rpc.PRIORITY_HEAD
+        future = rpc.submit_with_context(executor, get_priority)
+        assert future.result() == rpc.PRIORITY_CONFIRMATIONS
+
+
+def test_provider_with_budget(stub_servers):
+    provider = rpc.MultiEndpointProvider(
+        [stub_servers[0].uri], timeout=5, requests_per_second=100, burst=1
+    )
+    start = time.monotonic()
+    for i in range(5):
+        assert provider.make_request("eth_blockNumber", [])["result"] == "0x10"
+    assert time.monotonic() - start >= 0.035
+    assert sum(provider.endpoints[0].budget.throttled) > 0
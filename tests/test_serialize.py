@@ -0,0 +1,79 @@
+"""test encoding events for postgres"""
+
+import json
+
+from ethindex import pgimport, serialize
+from ethindex.logdecode import Event
+
+BIG_VALUE = pow(2, 256) - 1
+
+
+def make_event(args, logindex=0):
+    return Event(
+        name="Transfer",
+        args=args,
+        address="0x" + "11" * 20,
+        blocknumber=5,
+        blockhash=b"\x01" * 32,
+        transactionhash=b"\x02" * 32,
+        transactionindex=1,
+        logindex=logindex,
+        timestamp=1000,
+    )
+
+
+def test_encode_args():
+    args = {"_value": BIG_VALUE, "_extraData": b"\xab\xcd", "_list": [b"\x01"]}
+    assert json.loads(serialize.encode_args(args)) == {
+        "_value": BIG_VALUE,
+        "_extraData": "0xabcd",
+        "_list": ["0x01"],
+    }
+    # the args are not modified
+    assert args["_extraData"] == b"\xab\xcd"
+
+
+def test_copy_field():
+    assert serialize.copy_field(None) == "\\N"
+    assert serialize.copy_field(12) == "12"
+    assert serialize.copy_field('{"a": "b\\\\c\\td"}') == '{"a": "b\\\\\\\\c\\\\td"}'
+    assert serialize.copy_field("a\tb\nc") == "a\\tb\\nc"
+
+
+def test_event_copy_line():
+    line = serialize.event_copy_line(make_event({"_value": 3}))
+    assert line.endswith("\n")
+    assert line[:-1].split("\t") == [
+        "0x" + "02" * 32,
+        "5",
+        "0x" + "11" * 20,
+        "Transfer",
+        '{"_value": 3}',
+        "0x" + "01" * 32,
+        "1",
+        "0",
+        "1000",
+    ]
+
+
+def fetch_events(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            """select transactionhash, blocknumber, address, eventname, args,
+                      blockhash, transactionindex, logindex, timestamp
+               from events order by logindex"""
+        )
+        return cur.fetchall()
+
+
+def test_copy_events_equals_insert_event(conn):
+    pgimport.do_createtables(conn)
+    args = {"_value": BIG_VALUE, "_text": 'tab\tbackslash\\quote"', "_data": b"\x00"}
+    with conn.cursor() as cur:
+        pgimport.insert_event(cur, make_event(args))
+    inserted = fetch_events(conn)
+    with conn.cursor() as cur:
+        cur.execute("delete from events")
+        assert serialize.copy_events(cur, iter([make_event(args)])) == 1
+    assert fetch_events(conn) == inserted
+    assert inserted[0]["args"] == dict(args, _data="0x00")
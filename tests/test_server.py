@@ -0,0 +1,113 @@
+"""test the read-only http query service"""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from ethindex import server
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_evicts_least_recently_used():
+    cache = server.ResponseCache(max_entries=2)
+    cache.put("a", b"1", immutable=True)
+    cache.put("b", b"2", immutable=True)
+    assert cache.get("a") == b"1"
+    cache.put("c", b"3", immutable=True)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+
+
+def test_cache_expires_mutable_entries():
+    clock = FakeClock()
+    cache = server.ResponseCache(ttl=5, clock=clock)
+    cache.put("mutable", b"1")
+    cache.put("immutable", b"2", immutable=True)
+    clock.now = 10
+    assert cache.get("mutable") is None
+    assert cache.get("immutable") == b"2"
+
+
+def test_cache_invalidates_mutable_entries():
+    cache = server.ResponseCache()
+    cache.put("mutable", b"1")
+    cache.put("immutable", b"2", immutable=True)
+    cache.invalidate_mutable()
+    assert cache.get("mutable") is None
+    assert cache.get("immutable") == b"2"
+
+
+def test_cache_clear_drops_immutable_entries():
+    cache = server.ResponseCache()
+    cache.put("immutable", b"1", immutable=True)
+    generation = cache.generation
+    cache.clear()
+    assert cache.get("immutable") is None
+    # a response read before the cache was cleared may be outdated already
+    cache.put("immutable", b"1", immutable=True, generation=generation)
+    cache.invalidate_mutable()
+    assert cache.get("immutable") is None
+
+
+@pytest.fixture
+def service(testenv, event_emitter, synchronizer):
+    for i in range(3):
+        event_emitter.add_some_tranfer_events()  # add events with values 0 to 8
+    synchronizer.required_confirmations = 0
+    synchronizer.sync_until_current()
+    pool = server.make_pool("", pool_size=2)
+    service = server.QueryService(pool, server.ResponseCache())
+    service.refresh_confirmed_block_number()
+    yield service
+    pool.closeall()
+
+
+@pytest.fixture
+def query_server(service):
+    query_server = server.QueryServer(("127.0.0.1", 0), service)
+    threading.Thread(target=query_server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}".format(query_server.server_address[1])
+    query_server.shutdown()
+    query_server.server_close()
+
+
+def get(url):
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def test_get_events(query_server):
+    result = get(query_server + "/events?limit=4&event_name=Transfer")
+    assert [event["args"]["_value"] for event in result["events"]] == [0, 1, 2, 3]
+    result = get(query_server + "/events?cursor=" + result["next_cursor"])
+    assert [event["args"]["_value"] for event in result["events"]] == [4, 5, 6, 7, 8]
+    assert result["next_cursor"] is None
+
+
+def test_bad_request(query_server):
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        get(query_server + "/events?limit=foo")
+    assert excinfo.value.code == 400
+
+
+def test_confirmed_pages_are_immutable(service):
+    service.handle("/events", {"limit": ["4"]})
+    service.handle("/events", {})
+    assert len(service.cache) == 2
+    service.on_sync_committed()
+    # the first page only contains confirmed events, the second one can change
+    assert len(service.cache) == 1
+    # onboarding may have added events to confirmed blocks
+    service.on_sync_committed(rewritten=True)
+    assert len(service.cache) == 0
@@ -0,0 +1,94 @@
+"""test snapshots of the graph state"""
+
+from ethindex import pgimport, snapshot
+from ethindex.logdecode import GraphUpdate
+
+NETWORK = "0x" + "11" * 20
+OTHER_NETWORK = "0x" + "22" * 20
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+
+
+def graph_update(name, args, blocknumber, network=NETWORK):
+    return GraphUpdate(
+        name=name,
+        args=args,
+        address=network,
+        timestamp=1000 + blocknumber,
+        blocknumber=blocknumber,
+    )
+
+
+def test_snapshot_roundtrip():
+    rows = [
+        {
+            "id": 1,
+            "eventname": "BalanceUpdate",
+            "timestamp": 10,
+            "args": {"_from": ALICE, "_to": BOB, "_value": 5},
+        },
+        {"id": 2, "eventname": "NetworkFreeze", "timestamp": 11, "args": {}},
+        {
+            "id": 3,
+            "eventname": "TrustlineUpdate",
+            "timestamp": 12,
+            "args": {"_creditor": ALICE, "_debtor": BOB, "_isFrozen": True},
+        },
+        {
+            "id": 4,
+            "eventname": "TrustlineUpdate",
+            "timestamp": 13,
+            "args": {"_creditor": BOB, "_debtor": ALICE},
+        },
+        {
+            "id": 5,
+            "eventname": "TrustlineUpdate",
+            "timestamp": 14,
+            "args": {"_creditor": ALICE, "_debtor": BOB, "_isFrozen": None},
+        },
+    ]
+    network_snapshot = snapshot.build_snapshot(NETWORK, 5, 100, rows)
+    assert network_snapshot["events"]["BalanceUpdate"]["args"]["_value"] == [5]
+    assert network_snapshot["events"]["TrustlineUpdate"]["missing"] == {
+        "_isFrozen": [1]
+    }
+    assert list(snapshot.iterate_snapshot_rows(network_snapshot)) == [
+        dict(row, address=NETWORK) for row in rows
+    ]
+
+
+def test_take_snapshots(conn, synchronizer, tmpdir):
+    with conn.cursor() as cur:
+        cur.execute("update sync set last_confirmed_block_number=10")
+        pgimport.insert_graph_feed_updates(
+            cur,
+            [
+                graph_update(
+                    "BalanceUpdate", {"_from": ALICE, "_to": BOB, "_value": 1}, 1
+                ),
+                graph_update(
+                    "BalanceUpdate", {"_from": BOB, "_to": ALICE, "_value": 2}, 2
+                ),
+                graph_update("NetworkFreeze", {}, 3, network=OTHER_NETWORK),
+                # not confirmed yet
+                graph_update(
+                    "BalanceUpdate", {"_from": ALICE, "_to": BOB, "_value": 3}, 20
+                ),
+            ],
+        )
+        cur.execute("select id from graphfeed order by id")
+        ids = [row["id"] for row in cur.fetchall()]
+    conn.commit()
+
+    paths = snapshot.take_snapshots(conn, str(tmpdir))
+    assert len(paths) == 2
+
+    network_snapshot = snapshot.load_latest_snapshot(str(tmpdir), NETWORK)
+    assert network_snapshot["graphfeed_id"] == ids[2]
+    assert network_snapshot["block_number"] == 10
+    rows = list(snapshot.iterate_snapshot_rows(network_snapshot))
+    assert [(row["id"], row["args"]["_value"]) for row in rows] == [(ids[1], 2)]
+
+    other_snapshot = snapshot.load_latest_snapshot(str(tmpdir), OTHER_NETWORK)
+    rows = list(snapshot.iterate_snapshot_rows(other_snapshot))
+    assert [row["eventname"] for row in rows] == ["NetworkFreeze"]
@@ -0,0 +1,106 @@
+"""test storing events in SQLite"""
+
+import pytest
+
+from ethindex import pgimport, sqlite
+
+
+def test_translate():
+    assert sqlite.translate("select 1", None) == ("select 1", ())
+    assert sqlite.translate(
+        "select * from t where a=%s and b in %s and c like 'x%%'",
+        ("a", (1, 2, 3)),
+    ) == (
+        "select * from t where a=? and b in (?, ?, ?) and c like 'x%'",
+        ["a", 1, 2, 3],
+    )
+    assert sqlite.translate(
+        "insert into t values (%s, %s)", [["a", "b"], {"c": 1}]
+    ) == (
+        "insert into t values (?, ?)",
+        ['["a", "b"]', '{"c": 1}'],
+    )
+
+
+@pytest.fixture
+def sqlite_conn(tmp_path):
+    conn = pgimport.connect_storage(str(tmp_path / "ethindex.sqlite"))
+    pgimport.get_storage(conn).create_tables(conn)
+    yield conn
+    conn.close()
+
+
+def test_connection_behaves_like_psycopg2(sqlite_conn):
+    with sqlite_conn:
+        pgimport.insert_sync_entry(sqlite_conn, "default", ["0xab", "0xcd"])
+    with sqlite_conn.cursor() as cur:
+        cur.execute("SELECT * FROM sync WHERE syncid=%s", ("default",))
+        row = cur.fetchone()
+    assert row["addresses"] == ["0xab", "0xcd"]
+    assert row["last_confirmed_block_number"] == -1
+    assert row["event_names"] is None
+
+    with pytest.raises(RuntimeError):
+        with sqlite_conn:
+            with sqlite_conn.cursor() as cur:
+                cur.execute("DELETE FROM sync")
+            raise RuntimeError
+    with sqlite_conn.cursor() as cur:
+        cur.execute("SELECT count(*) AS n FROM sync")
+        assert cur.fetchone()["n"] == 1
+
+
+def test_wal_mode(sqlite_conn):
+    assert sqlite_conn.raw.execute("PRAGMA journal_mode").fetchone() == {
+        "journal_mode": "wal"
+    }
+
+
+@pytest.fixture
+def sqlite_synchronizer(testenv, sqlite_conn):
+    pgimport.do_importabi(
+        sqlite_conn, testenv.addresses_json_path, testenv.contracts_json_path
+    )
+    pgimport.ensure_default_entry(sqlite_conn)
+    sqlite_conn.commit()
+    return pgimport.Synchronizer(
+        sqlite_conn, testenv.web3, "default", required_confirmations=10
+    )
+
+
+def fetch_events(conn):
+    with conn.cursor() as cur:
+        cur.execute("select * from events order by blocknumber, logindex")
+        return [row["args"]["_value"] for row in cur.fetchall()]
+
+
+def test_sync_into_sqlite(testenv, event_emitter, sqlite_conn, sqlite_synchronizer):
+    event_emitter.add_some_tranfer_events()
+    snapshot = testenv.ethereum_tester.take_snapshot()
+    event_emitter.add_some_tranfer_events()
+    sqlite_synchronizer.sync_until_current()
+    assert fetch_events(sqlite_conn) == [0, 1, 2, 3, 4, 5]
+
+    testenv.ethereum_tester.revert_to_snapshot(snapshot)
+    event_emitter.add_some_tranfer_events()
+    event_emitter.add_some_tranfer_events()
+    sqlite_synchronizer.sync_until_current()
+    assert fetch_events(sqlite_conn) == [0, 1, 2, 6, 7, 8, 9, 10, 11]
+
+    assert sqlite_synchronizer.feed_graph_from_outbox() > 0
+    with sqlite_conn.cursor() as cur:
+        cur.execute("select * from graphfeed_outbox")
+        assert cur.fetchall() == []
+
+
+def test_unconfirmed_table_is_not_supported(testenv, sqlite_conn):
+    with pytest.raises(ValueError):
+        pgimport.Synchronizer(
+            sqlite_conn, testenv.web3, "default", unconfirmed_table=True
+        )
+
+
+def test_check_sqlite_version():
+    sqlite.check_sqlite_version((3, 38, 0))
+    with pytest.raises(RuntimeError, match="3.38.0 or newer"):
+        sqlite.check_sqlite_version((3, 34, 1))
@@ -0,0 +1,85 @@
+"""test checking the stored events against the chain"""
+
+import json
+import types
+
+import psycopg2.extras
+import psycopg2.pool
+import pytest
+
+from ethindex import verify
+
+
+def test_jsonb_text():
+    value = {"_value": 12, "_to": "0xab", "_from": "0xcd", "b": [True, None], "a": "ä"}
+    assert verify.jsonb_text(value) == (
+        '{"a": "ä", "b": [true, null], "_to": "0xab", "_from": "0xcd", "_value": 12}'
+    )
+    assert verify.jsonb_text(pow(2, 256) - 1) == str(pow(2, 256) - 1)
+    assert verify.jsonb_text(b"\x01\x02") == '"0x0102"'
+    assert verify.jsonb_text('a "quoted"\n') == json.dumps('a "quoted"\n')
+
+
+def make_event(block_number, log_index, value):
+    return types.SimpleNamespace(
+        transactionhash=b"\x01" * 32,
+        blockhash=bytes([block_number]) * 32,
+        blocknumber=block_number,
+        logindex=log_index,
+        address="0x" + "ab" * 20,
+        args={"_value": value},
+    )
+
+
+def test_chain_events_digest():
+    events = [make_event(5, 0, 1), make_event(3, 1, 2), make_event(3, 0, 3)]
+    chain_events = verify.ChainEvents(events)
+    assert chain_events.block_numbers == [3, 3, 5]
+    assert chain_events.digest(6, 10) == (0, None)
+    count, digest = chain_events.digest(3, 5)
+    assert count == 3
+    assert (count, digest) == verify.combine_digests(
+        [
+            verify.event_digest(e)
+            for e in sorted(events, key=lambda e: (e.blocknumber, e.logindex))
+        ]
+    )
+    assert chain_events.digest(3, 4) != chain_events.digest(3, 5)
+
+
+def test_merge_ranges():
+    assert verify.merge_ranges([(1, 1), (2, 3), (5, 5)]) == [(1, 3), (5, 5)]
+    assert verify.merge_ranges([]) == []
+
+
+@pytest.fixture
+def pool(conn):
+    pool = psycopg2.pool.ThreadedConnectionPool(
+        1, 3, "", cursor_factory=psycopg2.extras.RealDictCursor
+    )
+    yield pool
+    pool.closeall()
+
+
+def test_verify_events(testenv, event_emitter, conn, synchronizer, pool):
+    synchronizer.required_confirmations = 0
+    for i in range(3):
+        event_emitter.add_some_tranfer_events()
+    synchronizer.sync_until_current()
+    assert verify.verify_events(pool, testenv.web3, "default", workers=2) == []
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """UPDATE events SET args=jsonb_set(args, '{_value}', '100')
+               WHERE args->>'_value'='4' RETURNING blockNumber"""
+        )
+        changed_block = cur.fetchone()["blocknumber"]
+        cur.execute(
+            """DELETE FROM events WHERE args->>'_value'='7' RETURNING blockNumber"""
+        )
+        deleted_block = cur.fetchone()["blocknumber"]
+    conn.commit()
+    assert verify.verify_events(pool, testenv.web3, "default") == [
+        (changed_block, changed_block),
+        (deleted_block, deleted_block),
+    ]